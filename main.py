@@ -19,7 +19,17 @@ def main(config: DictConfig) -> None:
     # Initiate OpenSafe Mobility Class
     analysis = OpenSafeMobility(config=config)
     # Define the scheduler and run the model
-    schedule.every(config.time_step).minutes.do(analysis.run)
+    if config.staged_pipeline:
+        # Stages of consecutive runs overlap; the scheduler does not wait for a run to finish
+        run = analysis.create_pipeline().run_cycle
+    else:
+        run = analysis.run
+    schedule.every(config.time_step).minutes.do(run)
+    if config.trigger.mode == "event":
+        # Check the rainfall thresholds as soon as new radar data arrives
+        schedule.every(config.trigger.poll_seconds).seconds.do(
+            analysis.run_on_new_radar_data
+        )
     while True:
         schedule.run_pending()
         time.sleep(1)
@@ -6,50 +6,59 @@
 # Dev log   :
 """"""
 import logging
+import os
+import threading
 import time
-import paramiko
 
 from datetime import timedelta, datetime
-from functools import partial
-from itertools import compress
 from shutil import copyfile
 
 from modules.geo_utils.SmartGeoProcess import GeoDataPoints
-from modules.network_utils.SmartNetworkAnalysis import NetworkAnalysis
+from modules.network_utils.SmartNetworkAnalysis import (
+    NetworkAnalysis,
+    NETWORK_CACHE_VERSION,
+)
 from modules.file_management.file_processing import (
     create_a_folder_if_it_doesnt_exist,
-    list_all_files_with_an_extension,
+    hash_files,
+    npz_cache_path,
 )
 from modules.file_management.file_processing import remove_all_contents_of_a_folder
 from modules.file_management.file_processing import remove_folder_if_exist
 from modules.radar.radar_data import (
-    remove_empty_files,
     round_down_time_to_the_nearest_time_delta,
     format_time,
 )
+from modules.radar.radar_data import slice_list_and_provide_all_elements
+from modules.radar.radar_fetcher import create_radar_fetcher
+from modules.radar.radar_store import RadarStore, time_of_radar_file
+from modules.radar.radar_window import RadarWindow
+from modules.radar.radar_matrix import RadarMatrix
+from modules.radar.rainfall_thresholds import evaluate_run_criteria
 from modules.radar.radar_data import (
-    collcect_a_file,
-    slice_list_and_provide_all_elements,
-)
-from modules.radar.radar_data import (
-    get_before_and_after_indexes_for_a_list_item,
-    sum_consecutive_rows,
+    fill_missing_time_steps,
+    sum_consecutive_time_steps,
 )
 from modules.hec_ras.ras import kill_a_process
 from modules.rascontrol import rascontrol
 from modules.radar.dss import generate_dss_from_pandas
 from modules.geo_utils.raster_processing import subtract_two_raster
 from modules.geo_utils.geoprocess import reproject_raster
+from modules.geo_utils.raster_pipeline import fused_depth_pipeline
+from modules.geo_utils.raster_processing import read_band_as_float
 from modules.image_utils.image_processing import generate_png_file
+from modules.image_utils.map_tiles import generate_xyz_tiles, clear_xyz_tiles
 from modules.plot_utils.generate_validation_plots import (
     generate_validation_plots_before_run,
     utc_datetime_to_cst,
 )
-from modules.publish.publish import sync_aws
+from modules.publish.publish import sync_aws, create_publisher
+from modules.staged_pipeline import Stage, StagedPipeline
 
 import pandas as pd
 import numpy as np
 import geopandas as gpd
+import rasterio
 
 log = logging.getLogger(__name__)
 
@@ -61,7 +70,6 @@ class OpenSafeMobility:
 
     def __init__(self, config):
         # Store the config file for future use
-        self.ssh_client = None
         self.config = config
         self.path_to_store_radar = None
 
@@ -72,11 +80,25 @@ class OpenSafeMobility:
         self.list_of_relevant_files_to_current_run = None
         self.availability_status_of_relevant_files_to_current_run = None
         self.current_time_steps_on_disk = None
-        self.df_radar = None
+        self.radar_matrix = None
+        # Last radar time step of the last completed run and of the last early threshold check
+        self.last_run_data_step = None
+        self.last_checked_data_step = None
+        # Staged pipeline, see create_pipeline; the lock guards the radar data shared by its stages
+        self.pipeline = None
+        self.state_lock = threading.RLock()
+        self.publish_lock = threading.Lock()
         self.df_criteria = None
+        # Criteria x sub-basins, True where the rainfall of a sub-basin exceeds the criterion
+        self.df_criteria_exceeded = None
         self.df_validation_dash_maps = None
         self.crs = None
         self.network = None
+        self.publisher = None
+        # Kept across runs, so the connection to the radar server is reused
+        self.radar_fetcher = None
+        self.radar_store = None
+        self.radar_window = None
 
         # Initialize storage tasks
         self.initialize()
@@ -114,16 +136,19 @@ class OpenSafeMobility:
         log.info("Staring a run")
         # Storing model start time to estimate the total run time
         start_time = time.time()
+        # Collect the radar data and prepare the rainfall of the current window
+        self.update_rainfall()
+        if (
+            self.config.trigger.mode == "event"
+            and self.last_available_data_step == self.last_run_data_step
+        ):
+            # The early trigger already ran this time step
+            log.info("No new radar data since the last run")
+            return
         # Remove last analysis results
         self.remove_old_files()
         # Preemptively avoid hec-ras locking error
         self.fix_potential_hec_ras_error()
-        # Generate the DSS file
-        self.get_rainfall_radar_data()
-        # Create a panda dataframe and write the files to it
-        self.read_files_to_pandas()
-        # Handle missing data
-        self.handle_missing_data()
         # Check model run condition
         if any(
             [
@@ -132,13 +157,37 @@ class OpenSafeMobility:
             ]
         ):
             # If either of this two conditions are met, the madel will run
-            # Create a dss file from panda dataframe
+            self.run_flood_model()
+        else:
+            # No flood map this run; take down the tiles of the last one
+            self.clear_water_depth_tiles()
+        # Create validation plots and publish them
+        self.update_dashboard()
+        self.last_run_data_step = self.last_available_data_step
+        # Convey runtime and final status
+        log.info(
+            f"Running completed at: {datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
+        )
+        log.info(f"Runtime: --- %{(time.time() - start_time) / 60} minutes --- ")
+
+    def run_flood_model(self) -> None:
+        """
+        Flood model and the analysis of its results: DSS file, HEC-RAS, rasters, water depth map and network analysis
+        :return:
+        """
+        # Create a dss file from panda dataframe
+        with self.state_lock:
             self.create_dss()
-            # Run Analysis using HEC-RAS Controller
-            self.run_hec_ras_model()
-            log.info("HEC-RAS Model Complete")
-            # Kill HEC-RAS
-            self.kill_hec_ras()
+        # Run Analysis using HEC-RAS Controller
+        self.run_hec_ras_model()
+        log.info("HEC-RAS Model Complete")
+        # Kill HEC-RAS
+        self.kill_hec_ras()
+        if self.config.analysis_results.raster_pipeline.fused:
+            # Water over structure, projected rasters and water depth map in one pass
+            self.run_fused_raster_pipeline()
+            log.info("Water over structure raster and water depth map created")
+        else:
             # Get water depth over DSM, this will be used to identify flooded roads
             self.subtract_dsm_from_wse()
             log.info("Water over structure raster created")
@@ -148,6 +197,8 @@ class OpenSafeMobility:
                 destination_file_location=self.config.analysis_results.temporary_files.results_tiff_projected,
                 destination_crs=self.config.analysis_results.temporary_files.output_crs,
                 source_crs=self.config.analysis_results.temporary_files.input_crs,
+                plan_cache_folder=self.get_warp_plan_folder(),
+                max_plan_pixels=self.config.analysis_results.raster_pipeline.warp_plan_max_pixels,
             )
             # Reproject water over roads raster
             reproject_raster(
@@ -155,38 +206,221 @@ class OpenSafeMobility:
                 destination_file_location=self.config.analysis_results.temporary_files.results_tiff_water_over_roads_projected,
                 destination_crs=self.config.analysis_results.temporary_files.output_crs,
                 source_crs=self.config.analysis_results.temporary_files.input_crs,
+                plan_cache_folder=self.get_warp_plan_folder(),
+                max_plan_pixels=self.config.analysis_results.raster_pipeline.warp_plan_max_pixels,
             )
             # Save water depth raster
             self.generate_water_depth_map()
             log.info("Generated water depth map")
-            # # Initialize network analysis
-            self.initiate_network()
-            # Perform mobility analysis
-            self.perform_mobility_analysis()
-            # Plot flooded roads
-            try:
-                self.plot_flooded_roads()
-            except FileNotFoundError:
-                log.warning("Unable to plot flooded roads!")
-            copyfile(
-                src=f"{self.config.analysis_results.temporary_files.temp_storage_for_analysis}\Geo_summary_results.json",
-                dst=self.config.analysis_results.final_results.accessibility_measures,
+        # Tiles of the water depth map for the website
+        if self.config.website.flood_depth_tiles.generate:
+            self.generate_water_depth_tiles()
+        # Publish the map while the network analysis runs
+        self.publish(
+            [self.config.analysis_results.final_results.flood_depth_png]
+            + (
+                [self.config.website.flood_depth_tiles.path_tiles]
+                if self.config.website.flood_depth_tiles.generate
+                else []
             )
-        # Create validation plots
-        self.create_validation_plots()
-        # Save to html the the last run step of this code, this is then displayed on the website
-        self.save_last_run_html()
+        )
+        # # Initialize network analysis
+        self.initiate_network()
+        # Perform mobility analysis
+        self.perform_mobility_analysis()
+        # Plot flooded roads
+        try:
+            self.plot_flooded_roads()
+        except FileNotFoundError:
+            log.warning("Unable to plot flooded roads!")
+        copyfile(
+            src=f"{self.config.analysis_results.temporary_files.temp_storage_for_analysis}\Geo_summary_results.json",
+            dst=self.config.analysis_results.final_results.accessibility_measures,
+        )
+        self.publish(
+            [
+                self.config.analysis_results.final_results.road_condition,
+                self.config.analysis_results.final_results.accessibility_measures,
+            ]
+        )
+
+    def update_dashboard(self, last_run_tag: bool = True) -> None:
+        """
+        Validation dashboard and last run tag of the website
+        :param last_run_tag: Also stamp the last run tag with the current radar data
+        :return:
+        """
+        _results = self.config.analysis_results.final_results
+        with self.state_lock:
+            # Create validation plots
+            self.create_validation_plots()
+            if last_run_tag:
+                # Save to html the the last run step of this code, this is then displayed on the website
+                self.save_last_run_html()
         # Sync the files with aws
-        sync_aws(self.config)
-        # Convey runtime and final status
-        log.info(
-            f"Running completed at: {datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
+        if self.config.publish.method == "delta":
+            self.publish(
+                [_results.validation_dashboard]
+                + ([_results.last_run_tag_website] if last_run_tag else [])
+            )
+        else:
+            sync_aws(self.config)
+
+    def create_pipeline(self) -> StagedPipeline:
+        """
+        Staged version of run. The radar data and the validation dashboard of the next cycle are updated while HEC-RAS
+        and the network analysis of the current cycle run. The flood model stage runs one cycle at a time; while it is
+        busy, only the most recent cycle waits for it.
+        :return: StagedPipeline; call run_cycle to start a cycle
+        """
+        self.pipeline = StagedPipeline(
+            [
+                Stage("rainfall", self.rainfall_stage),
+                Stage("dashboard", self.dashboard_stage, after=["rainfall"]),
+                Stage("model", self.model_stage, after=["rainfall"]),
+            ]
         )
-        log.info(f"Runtime: --- %{(time.time() - start_time) / 60} minutes --- ")
+        return self.pipeline
 
-    def remove_old_files(self) -> None:
+    def rainfall_stage(self, results: dict) -> dict:
+        """
+        Pipeline stage: collect the radar data and check the rainfall thresholds
+        :return: Whether there is new radar data, whether to run the flood model, and the time step (file name) and
+        time of the newest radar data
+        """
+        with self.state_lock:
+            self.update_rainfall()
+            if (
+                self.config.trigger.mode == "event"
+                and self.last_available_data_step == self.last_run_data_step
+            ):
+                log.info("No new radar data since the last run")
+                return {
+                    "new_data": False,
+                    "run_model": False,
+                    "data_step": None,
+                    "data_time": None,
+                }
+            run_model = any(
+                [
+                    self.check_threshold(),
+                    self.config.thresholds.run_model_even_if_no_flooding,
+                ]
+            )
+            data_step = self.last_available_data_step
+            data_time = self.radar_matrix.times[-1].to_pydatetime()
+        return {
+            "new_data": True,
+            "run_model": run_model,
+            "data_step": data_step,
+            "data_time": data_time,
+        }
+
+    def dashboard_stage(self, results: dict) -> None:
+        """
+        Pipeline stage: validation dashboard. The last run tag is stamped by the model stage, once the map of its cycle
+        is published.
+        """
+        if results["rainfall"]["new_data"]:
+            self.update_dashboard(last_run_tag=False)
+
+    def model_stage(self, results: dict) -> None:
+        """
+        Pipeline stage: flood model and network analysis. Once this stage completes, the time step of the cycle is
+        recorded as run and the last run tag of the website is stamped with it; a failed cycle is run again.
+        """
+        rainfall = results["rainfall"]
+        if not rainfall["new_data"]:
+            return
+        with self.state_lock:
+            if (
+                self.config.trigger.mode == "event"
+                and rainfall["data_step"] == self.last_run_data_step
+            ):
+                # A cycle of the same time step waited while this stage was busy
+                return
+        if rainfall["run_model"]:
+            start_time = time.time()
+            # The rainfall and dashboard stages of the next cycle use the result and temporary folders
+            with self.state_lock:
+                # Remove last analysis results; the dashboard is updated by its own stage
+                self.remove_old_files(
+                    keep=["validation_dashboard", "last_run_tag_website"]
+                )
+                # Preemptively avoid hec-ras locking error
+                self.fix_potential_hec_ras_error()
+            self.run_flood_model()
+            log.info(
+                f"Flood model completed at: {datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}"
+            )
+            log.info(f"Runtime: --- %{(time.time() - start_time) / 60} minutes --- ")
+        else:
+            # No flood map this cycle; take down the tiles of the last one
+            self.clear_water_depth_tiles()
+        with self.state_lock:
+            self.last_run_data_step = rainfall["data_step"]
+            self.save_last_run_html(rainfall["data_time"])
+        if self.config.publish.method == "delta":
+            self.publish(
+                [self.config.analysis_results.final_results.last_run_tag_website]
+            )
+        else:
+            sync_aws(self.config)
+
+    def update_rainfall(self) -> None:
+        """
+        Collect the new radar data and prepare the rainfall of the current window
+        :return: None
+        """
+        # Generate the DSS file
+        self.get_rainfall_radar_data()
+        # Create a panda dataframe and write the files to it
+        self.read_files_to_pandas()
+        # Handle missing data
+        self.handle_missing_data()
+
+    def run_on_new_radar_data(self) -> None:
+        """
+        Early trigger. Checks the rainfall thresholds as soon as a new radar time step is on the server, and runs the
+        analysis without waiting for the next scheduled run if a threshold is exceeded.
+        :return: None
+        """
+        with self.state_lock:
+            exceeded = self._check_new_radar_data()
+        # The run takes the lock for its own steps; holding it here would block the pipeline stages
+        if exceeded:
+            log.info("Early trigger: running the analysis for the new radar data")
+            if self.pipeline is not None:
+                self.pipeline.run_cycle()
+            else:
+                self.run()
+
+    def _check_new_radar_data(self) -> bool:
+        """
+        Collect the radar data and check the rainfall thresholds if there is a new time step
+        :return: True if a threshold is exceeded by a new time step
+        """
+        try:
+            self.get_rainfall_radar_data()
+        except Exception as error:
+            # The scheduled run reports connection problems; keep polling
+            log.warning(f"Unable to check for new radar data: {error}")
+            return False
+        if self.last_available_data_step in (
+            self.last_checked_data_step,
+            self.last_run_data_step,
+        ):
+            return False
+        self.last_checked_data_step = self.last_available_data_step
+        log.info(f"New radar data: {self.last_available_data_step}")
+        self.read_files_to_pandas()
+        self.handle_missing_data()
+        return bool(self.check_threshold())
+
+    def remove_old_files(self, keep: list = ()) -> None:
         """
         Remove old results. This step ensures that no old files are carried over to the new analysis
+        :param keep: Keys of the final results to keep
         :return: None
         :rtype: None
         """
@@ -198,7 +432,8 @@ class OpenSafeMobility:
         # Collect all temp and final result files
         [
             remove_folder_if_exist(_files)
-            for _files in self.config.analysis_results.final_results.values()
+            for _key, _files in self.config.analysis_results.final_results.items()
+            if _key not in keep
         ]
         [
             remove_folder_if_exist(_files)
@@ -227,31 +462,22 @@ class OpenSafeMobility:
         :return: None
         :rtype: None
         """
-        # Remove empty CSV files in the location of radar data
-        remove_empty_files(
-            rootdir=self.config.storage.folders_to_create.path_to_store_radar
-        )
-
-        # Initiate connection to the server
-        if self.connect_to_remote_server_via_ssh():
-            log.info("Connected to remote server for radar.")
+        # Initiate connection to the server; reconnects only if the connection was lost
+        self.connect_to_remote_server_via_ssh()
 
         # Get the file names required
         self.get_radar_paths_for_current_run()
 
     def connect_to_remote_server_via_ssh(self) -> None:
         """
-        Connect via ssh to the remote server
+        Connect via ssh to the remote server, reusing the connection of the previous run if it is still open
         :return: None
         :rtype: None
         """
-        self.ssh_client = paramiko.SSHClient()
-        self.ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-        self.ssh_client.connect(
-            hostname=self.config.radar.server.HOST_NAME,
-            username=self.config.radar.server.USER_NAME,
-            password=self.config.radar.server.PASSWORD,
-        )
+        if self.radar_fetcher is None:
+            self.radar_fetcher = create_radar_fetcher(self.config)
+        self.radar_fetcher.connect()
+        log.info("Connected to remote server for radar.")
 
     def get_radar_paths_for_current_run(self) -> None:
         """
@@ -300,55 +526,27 @@ class OpenSafeMobility:
             f"KHGX_LII_basin_UTC_{format_time(_time)}.csv" for _time in list_of_times
         ]
 
-        # Find a list of all files with csv extension in the main folder
+        # Collect the files that are on the server but not on the disk; the server folder is listed once
         _pth_store_radar = self.config.storage.folders_to_create.path_to_store_radar
-        existing_files_partial = partial(
-            list_all_files_with_an_extension, _pth_store_radar, ".csv"
+        status = self.radar_fetcher.fetch_missing(
+            list_of_file_names=list_of_times,
+            remote_folder=self.config.radar.fetcher.remote_folder,
+            local_folder=_pth_store_radar,
+        )
+        failed = [i for i in list_of_times if status[i] == "failed"]
+        if len(failed) > 0:
+            log.info(f"Failed to collect {len(failed)} files")
+            log.info(f"Following files failed: {failed}")
+        log.info(
+            f"Radar files: {sum(x == 'collected' for x in status.values())} collected, "
+            f"{len(self.radar_fetcher.known_missing)} not on the server"
         )
 
-        # Get all existing files
-        existing_files = existing_files_partial()
-
-        # The files that we are currently lacking are
-        # files_to_collect_from_server = list(set(list_of_times) - set(existing_files))
-        files_to_collect_from_server = [
-            i for i in list_of_times if i not in existing_files
-        ]
-
-        # Now we have to collect all this file and save it to the disk
-        def server_file_path(_file_name):
-            return f"PIRadarData/{_file_name}"
-
-        def local_file_path(_file_name):
-            return f"{_pth_store_radar}/{_file_name}"
-
-        log.info(files_to_collect_from_server)
-        status = [
-            collcect_a_file(
-                self.ssh_client, server_file_path(_pth), local_file_path(_pth)
-            )
-            for _pth in files_to_collect_from_server
-        ]
-        count_failed = len(status) - sum(status)
-        if count_failed > 0:
-            log.info(status)
-            log.info(f"Failed to collect {len(status) - sum(status)} files")
-            log.info(
-                f"Following files failed: {list(compress(files_to_collect_from_server, [not elem for elem in status]))}"
-            )
-
-        # Remove empty CSV files in the location of radar data
-        # We have to call this function again since the ssh call to server will save files without any data
-        remove_empty_files(rootdir=_pth_store_radar)
         # List of files to concat
-        # Get the new list of existing files
-        existing_files_now = existing_files_partial()
-        # Get the status of files in the list_of_times
-        file_status = [
-            True if i in existing_files_now else False for i in list_of_times
-        ]
         # Filter only the available time steps
-        files_to_combine = [i for i in list_of_times if i in existing_files_now]
+        files_to_combine = [
+            i for i in list_of_times if status[i] in ("local", "collected")
+        ]
         assert len(files_to_combine) > 0
 
         # Store the results
@@ -363,131 +561,78 @@ class OpenSafeMobility:
 
     def read_files_to_pandas(self) -> None:
         """
-        Read csv files to panda dataframe
+        Read the radar data of the current window to a matrix (time step x sub-basin)
         :return:
         """
         # List of all time steps
         csv_list = self.list_of_relevant_files_to_current_run
         list_on_drive = self.current_time_steps_on_disk
-        diff = list(set(csv_list) - set(list_on_drive))
+        _pth_store_radar = self.config.storage.folders_to_create.path_to_store_radar
 
-        # Renaming lambda function
-        func_lambda = (
-            lambda item: f"{self.config.storage.folders_to_create.path_to_store_radar}/{item}"
+        # Add the new csv files to the radar store; each file is read only once
+        if self.radar_store is None:
+            self.radar_store = RadarStore(
+                folder=self.config.storage.folders_to_create.path_to_radar_store,
+                time_step_minutes=self.config.radar.radar_rainfall.time_resolution_of_the_incoming_data,
+            )
+            self.radar_window = RadarWindow(
+                store=self.radar_store,
+                missing_data_tag=self.config.radar.radar_rainfall.missing_data_tag,
+                replace_missing_tag_with=self.config.radar.radar_rainfall.replace_missing_tag_with,
+            )
+        self.radar_store.ingest(
+            [f"{_pth_store_radar}/{item}" for item in list_on_drive]
         )
 
-        # Reaa all csv files on disk
-        df = pd.concat(
-            [
-                pd.read_csv(func_lambda(item), names=[item[:-4]])
-                for item in list_on_drive
-            ],
-            axis=1,
+        # Move the in-memory window; only the new time steps are read from the store. Time steps not on disk are NaN
+        times = [time_of_radar_file(item) for item in csv_list]
+        values, present, subbasins = self.radar_window.update(times)
+        # Keep the sub-basins reported in the window
+        reported = np.flatnonzero(~np.isnan(values[present]).all(axis=0))
+        self.radar_matrix = RadarMatrix(
+            values=values[:, reported],
+            times=times,
+            subbasins=[subbasins[x] for x in reported],
+            present=present,
         )
-        # For the files not on disk, create empty file
-        for item in diff:
-            df[item[:-4]] = np.nan
-        # Reindex the items based on the initial list
-        self.df_radar = df.reindex([item[:-4] for item in csv_list], axis=1)
-        # self.df_radar.to_csv("datafrmae_lambda.csv")
 
     def handle_missing_data(self) -> None:
         """
         Functions to handle missing data in rainfall radar
         :return:
         """
-        # Handling -1 data
-        self.df_radar = self.df_radar.replace(
-            self.config.radar.radar_rainfall.missing_data_tag,
-            self.config.radar.radar_rainfall.replace_missing_tag_with,
-        )
+        # The -1 data is replaced when a time step enters the radar window
         # Now handle completely missing data
-        # List of missing data
-        missing_time_steps = [
-            item
-            for item in self.list_of_relevant_files_to_current_run
-            if item not in set(self.current_time_steps_on_disk)
-        ]
-
+        method = self.config.radar.radar_rainfall.handle_missing_by
+        missing = np.flatnonzero(~self.radar_matrix.present)
+        if len(missing) == 0:
+            return
         log.info(
-            f"Some values are missing {missing_time_steps}, attempting to fill them using : "
-            f"{self.config.radar.radar_rainfall.handle_missing_by}"
-        )
-
-        for time_step in missing_time_steps:
-            # Find the method to fill the values
-            method = self.config.radar.radar_rainfall.handle_missing_by
-            if method == "linear":
-                # Find the step before and after the current step
-                before_after_column_names = (
-                    get_before_and_after_indexes_for_a_list_item(
-                        list_to_filter=self.list_of_relevant_files_to_current_run,
-                        item_to_match=time_step,
-                    )
-                )
-                # Now select the columns and average them
-                # remove the CSV tag from the list; when we created the table, we removed the .csv extension
-                before_after_column_names = [
-                    item[:-4] for item in before_after_column_names
-                ]
-                self.df_radar[time_step[:-4]] = self.df_radar[
-                    before_after_column_names
-                ].mean(axis=1)
-
-            elif method[:4] == "fill":
-                self.df_radar[time_step[:-4]] = float(method[5:])
+            f"{len(missing)} time steps are missing {list(self.radar_matrix.times[missing])}, attempting to fill "
+            f"them using : {method}"
+        )
+        # Fill all time steps at once
+        self.radar_matrix.values = fill_missing_time_steps(
+            values=self.radar_matrix.values,
+            present=self.radar_matrix.present,
+            method=method,
+        )
 
     def check_threshold(self) -> None:
         """
         For a given rainfall duration and rainfall depth, check if the criterion is met.
         """
-        # First read all thresholds
-        criteria = self.config.thresholds.run_criteria
-        # Looping through criteria
-        df = pd.DataFrame(
-            columns=[
-                "Duration",
-                "Limit",
-                "Time steps",
-                "Max of Observed Rainfall",
-                "Avg of Observed Rainfall",
-            ]
-        )
-        for keys in criteria:
-            duration = criteria[keys]["duration_min"]
-            threshold = criteria[keys]["threshold"]
-            time_steps = int(
-                duration
-                // self.config.radar.radar_rainfall.time_resolution_of_the_incoming_data
-            )
-
-            # Finding the mean and max of all column values
-            current_keys = self.list_of_relevant_files_to_current_run[
-                -int(time_steps) :
-            ]
-            current_keys = [item[:-4] for item in current_keys]
-            max_rainfall = (self.df_radar[current_keys].sum(axis=1)).max()
-            mean_rainfall = (self.df_radar[current_keys].sum(axis=1)).mean()
-
-            df = df.append(
-                {
-                    "Duration": duration,
-                    "Limit": threshold,
-                    "Time steps": time_steps,
-                    "Max of Observed Rainfall": max_rainfall,
-                    "Avg of Observed Rainfall": mean_rainfall,
-                },
-                ignore_index=True,
-            )
-
-        df["Trigger_Model_Run"] = np.where(
-            df["Limit"] > df["Max of Observed Rainfall"], False, True
+        # All criteria at once, from one cumulative sum of the rainfall along time
+        self.df_criteria, self.df_criteria_exceeded = evaluate_run_criteria(
+            radar_matrix=self.radar_matrix,
+            criteria=self.config.thresholds.run_criteria,
+            time_step_minutes=self.config.radar.radar_rainfall.time_resolution_of_the_incoming_data,
         )
-        self.df_criteria = df
+        df = self.df_criteria
 
         # Send the status
         # Model is triggered if at least one criteria is true. ie. criteria is exceeded at least in one sub-watershed
-        if True in set(df["Trigger_Model_Run"]):
+        if df["Trigger_Model_Run"].any():
             # Threshold exceeded, initiate model run
             log.info(
                 "Rainfall threshold exceeded in at least one sub-watershed. Triggering model run"
@@ -506,15 +651,21 @@ class OpenSafeMobility:
         number_of_columns_to_sum = self.config.radar.radar_rainfall.col_per_time_step
         # Read the number of rows to sum
         record_length = self.config.radar.radar_rainfall.record_length
-        # Modify the record
-        _df = sum_consecutive_rows(
-            df=self.df_radar,
-            number_of_columns_to_sum=number_of_columns_to_sum,
+        # Sub-basins to keep in the record
+        rows_to_keep = self.config.radar.radar_rainfall.rows_to_keep_in_the_record
+        # Modify the record; sub-basins are columns
+        _values = sum_consecutive_time_steps(
+            values=self.radar_matrix.values[
+                :, self.radar_matrix.subbasin_positions(rows_to_keep)
+            ],
+            number_of_steps_to_sum=number_of_columns_to_sum,
             length_of_the_record_to_filter=record_length,
         )
-        # Transposing the data to make sub-basins as columns
-        _df = _df.transpose()
-        _df = _df[self.config.radar.radar_rainfall.rows_to_keep_in_the_record].copy()
+        _df = pd.DataFrame(
+            _values,
+            index=[f"s{x}" for x in range(1, record_length + 1)],
+            columns=list(rows_to_keep),
+        )
         # # add a random value
         # numeric_cols = [col for col in _df if _df[col].dtype.kind != 'O']
         # _df[numeric_cols] += 1
@@ -578,10 +729,73 @@ class OpenSafeMobility:
         img = generate_png_file(
             path_to_tiff=self.config.analysis_results.temporary_files.results_tiff_projected,
             color_map=self.config.website.map_legend,
+            paletted=self.config.website.paletted_flood_depth_png,
         )
 
         img.save(self.config.analysis_results.final_results.flood_depth_png)
 
+    def run_fused_raster_pipeline(self) -> None:
+        """
+        Estimate the water over structure, reproject the depth and water over structure rasters and generate the water
+        depth map, reading each HEC-RAS raster once
+        :return:
+        """
+        _files = self.config.analysis_results.temporary_files
+        img = fused_depth_pipeline(
+            path_depth=_files.results_tiff,
+            path_wse=_files.results_WSE_tiff,
+            path_dsm=self.config.spatial_network_data.input.flood_analysis.dsm,
+            path_depth_projected=_files.results_tiff_projected,
+            path_water_over_roads_projected=_files.results_tiff_water_over_roads_projected,
+            source_crs=_files.input_crs,
+            destination_crs=_files.output_crs,
+            color_map=self.config.website.map_legend,
+            plan_cache_folder=self.get_warp_plan_folder(),
+            paletted=self.config.website.paletted_flood_depth_png,
+        )
+
+        img.save(self.config.analysis_results.final_results.flood_depth_png)
+
+    def generate_water_depth_tiles(self) -> None:
+        """
+        Update the XYZ tiles of the water depth map; only tiles that changed since the last run are written
+        :return:
+        """
+        _tiles = self.config.website.flood_depth_tiles
+        with rasterio.open(
+            self.config.analysis_results.temporary_files.results_tiff_projected
+        ) as src:
+            depth = read_band_as_float(src).astype("float32")
+            transform = src.transform
+
+        generate_xyz_tiles(
+            depth=depth,
+            transform=transform,
+            color_map=self.config.website.map_legend,
+            tile_folder=_tiles.path_tiles,
+            min_zoom=_tiles.min_zoom,
+            max_zoom=_tiles.max_zoom,
+        )
+
+    def clear_water_depth_tiles(self) -> None:
+        """
+        Remove the XYZ tiles of the last water depth map and publish their removal, for runs without a flood map
+        :return:
+        """
+        if not self.config.website.flood_depth_tiles.generate:
+            return
+        clear_xyz_tiles(self.config.website.flood_depth_tiles.path_tiles)
+        self.publish([self.config.website.flood_depth_tiles.path_tiles])
+
+    def get_warp_plan_folder(self) -> str:
+        """
+        Folder of the cached reprojection plans. Returns None if caching is disabled.
+        :return: str
+        """
+        if not self.config.analysis_results.raster_pipeline.cache_warp_plan:
+            return None
+        return self.config.storage.folders_to_create.path_to_raster_cache
+
     def initiate_network(self) -> None:
         """
         Initiate network model
@@ -589,30 +803,70 @@ class OpenSafeMobility:
         """
         # Get the crs
         self.crs = self.config.spatial_network_data.input.spatial_analysis.crs
+        # Keep the scenario state of the previous run for incremental updates
+        previous_scenario_state = (
+            self.network.scenario_state if self.network is not None else {}
+        )
         # Read the network
         self.network = NetworkAnalysis(
             path_network=self.config.spatial_network_data.input.network_analysis.path_network,
             crs=self.crs,
         )
-        # Read the nodes, unique nodes, and generate network
-        self.network.fit()
-        # Register the critical facilities
+        # The critical facilities
         list_of_critical_facilities = (
             self.config.spatial_network_data.input.spatial_analysis.critical_facilities
         )
-        # Loop through each critical facility
-        critical_facilities = {}
-        for key in list_of_critical_facilities.keys():
-            critical_facilities[key] = GeoDataPoints(
-                path_geodata=list_of_critical_facilities[key], crs=self.crs
-            )
-            critical_facilities[key].read_geodata()
-            critical_facilities[key].gdf = self.network.get_the_nearest_node_for_points(
-                gdf=critical_facilities[key].gdf, label_facility=key
+        # The network and facilities do not change between runs; reuse the results of the last fit if available
+        path_cache = self.get_network_cache_path()
+        if path_cache and self.network.load_fit(path_cache):
+            log.info(f"Loaded network and initial distances from {path_cache}")
+        else:
+            # Read the nodes, unique nodes, and generate network
+            self.network.fit()
+            # Read each critical facility and snap all of them to the network in one query
+            critical_facilities = {}
+            for key in list_of_critical_facilities.keys():
+                critical_facilities[key] = GeoDataPoints(
+                    path_geodata=list_of_critical_facilities[key], crs=self.crs
+                )
+                critical_facilities[key].read_geodata()
+            self.network.snap_facilities(
+                {key: value.gdf for key, value in critical_facilities.items()},
+                max_snap_distance=self.config.spatial_network_data.input.spatial_analysis.max_snap_distance,
             )
 
-        # The key contains the names of facilities
-        self.network.get_initial_distance()
+            # The key contains the names of facilities
+            self.network.get_initial_distance()
+            if path_cache:
+                self.network.save_fit(path_cache)
+        self.network.scenario_state = previous_scenario_state
+
+    def get_network_cache_path(self) -> str:
+        """
+        Path of the network cache, named after the content hash of the network, the critical facilities and the
+        relevant configuration. Returns None if caching is disabled.
+        :return: str
+        """
+        if not self.config.spatial_network_data.input.network_analysis.cache_network:
+            return None
+        _input = self.config.spatial_network_data.input
+        list_of_critical_facilities = _input.spatial_analysis.critical_facilities
+        key = hash_files(
+            [_input.network_analysis.path_network]
+            + list(list_of_critical_facilities.values()),
+            extra=f"{_input.spatial_analysis.crs}|{list(list_of_critical_facilities.keys())}|"
+            f"{self.network.lbl_of_weight}|{NETWORK_CACHE_VERSION}",
+        )
+        return npz_cache_path(self.get_network_cache_folder(), "network", key)
+
+    def get_network_cache_folder(self) -> str:
+        """
+        Folder of the cached network data (fitted network, link to pixel index). Returns None if caching is disabled.
+        :return: str
+        """
+        if not self.config.spatial_network_data.input.network_analysis.cache_network:
+            return None
+        return self.config.storage.folders_to_create.path_to_network_cache
 
     def perform_mobility_analysis(self) -> None:
         """
@@ -622,10 +876,14 @@ class OpenSafeMobility:
         self.network.batch_extract_raster(
             list_of_raster_path=self.config.analysis_results.temporary_files.results_tiff_water_over_roads_projected,
             buffer=self.config.spatial_network_data.input.spatial_analysis.buffer_for_flood_depth_extraction,
+            method=self.config.spatial_network_data.input.spatial_analysis.flood_depth_extraction_method,
+            index_cache_folder=self.get_network_cache_folder(),
         )
         # Perform scenario analysis
         self.network.perform_scenaio_analysis(
-            link_removal_threshold=self.config.spatial_network_data.input.network_analysis.link_removal_threshold
+            link_removal_threshold=self.config.spatial_network_data.input.network_analysis.link_removal_threshold,
+            incremental=self.config.spatial_network_data.input.network_analysis.incremental_update,
+            max_change_ratio=self.config.spatial_network_data.input.network_analysis.max_changed_link_ratio,
         )
         # Estimate CL ratio
         self.network.estimate_CL_ratio()
@@ -663,6 +921,14 @@ class OpenSafeMobility:
         # gdf_roads_flooded.to_file("flooded_roads.geojson", driver='GeoJSON')
 
         if gdf_roads_flooded.shape[0] > 0:
+            # Keep the columns of the published file; line sampling statistics other than max stay internal
+            gdf_roads_flooded = gdf_roads_flooded.drop(
+                columns=[
+                    x
+                    for x in gdf_roads_flooded.columns
+                    if x.startswith(("mean_", "length_flooded_"))
+                ]
+            )
             gdf_roads_flooded.to_file(
                 self.config.analysis_results.final_results.road_condition,
                 driver="GeoJSON",
@@ -705,32 +971,20 @@ class OpenSafeMobility:
         # Get all intervals required
         all_durations = {main_duration} | set(_config_duration["tool_tips"])
 
-        # Aggregate the time interval required
-        # df = pd.DataFrame(columns=all_durations)
-        # Sum the value
-        def aggregate_values(time_interval):
-            # Number of time steps to aggregate
-            time_steps = int(
-                time_interval
-                // self.config.radar.radar_rainfall.time_resolution_of_the_incoming_data
-            )
-            # Get the keys
-            current_keys = self.list_of_relevant_files_to_current_run[
-                -int(time_steps) :
-            ]
-            # Remove .csv from keys
-            current_keys = [item[:-4] for item in current_keys]
-            # Sum rainfall
-            return self.df_radar[current_keys].sum(axis=1).rename(time_interval)
-
-        # Now append the results
-        self.df_validation_dash_maps = pd.concat(
-            [aggregate_values(case) for case in all_durations], axis=1
+        # Sub-basins without the summary records
+        _radar = self.radar_matrix.without_subbasins(
+            self.config.radar.radar_rainfall.rows_to_remove_from_record
+        )
+        _time_resolution = (
+            self.config.radar.radar_rainfall.time_resolution_of_the_incoming_data
         )
-        self.df_validation_dash_maps.drop(
-            labels=self.config.radar.radar_rainfall.rows_to_remove_from_record,
-            axis=0,
-            inplace=True,
+        # Sum rainfall over the number of time steps of each time interval
+        self.df_validation_dash_maps = pd.DataFrame(
+            {
+                time_interval: _radar.trailing_sum(time_interval // _time_resolution)
+                for time_interval in all_durations
+            },
+            index=_radar.subbasins,
         )
 
     def create_cumulative_rainfall_for_visualization(self) -> None:
@@ -738,19 +992,40 @@ class OpenSafeMobility:
         Estimate cumulative rainfall for visualization
         :return:
         """
-        # Get the time series
-        return self.df_radar.drop(
-            labels=self.config.radar.radar_rainfall.rows_to_remove_from_record, axis=0
-        )
+        # Get the time series; sub-basins as rows and time steps as columns
+        return self.radar_matrix.without_subbasins(
+            self.config.radar.radar_rainfall.rows_to_remove_from_record
+        ).to_frame()
 
-    def save_last_run_html(self):
+    def publish(self, list_of_paths: list) -> None:
+        """
+        Publish the changed files among the given website files and folders. Only used with the delta publish method;
+        the aws_cli method syncs the whole website at the end of the run. The first call also publishes the static
+        files of the website (publish.delta.static_paths).
+        :param list_of_paths: Files or folders inside the website folder
+        :return:
+        """
+        if self.config.publish.method != "delta":
+            return
+        # Stages of the staged pipeline publish from their own threads
+        with self.publish_lock:
+            if self.publisher is None:
+                self.publisher = create_publisher(self.config)
+                # Static files of the website, e.g., the scripts; unchanged files are skipped
+                self.publisher.publish(list(self.config.publish.delta.static_paths))
+            self.publisher.publish(list_of_paths)
+
+    def save_last_run_html(self, time_last_radar: datetime = None):
         """
         Save the last run html tag
+        :param time_last_radar: Time (UTC) of the radar data of the run; defaults to the newest radar data
         :return:
         """
-        time_last_radar = utc_datetime_to_cst(
-            datetime.strptime(self.last_available_data_step[-18:-4], "%Y%m%d%H%M%S")
-        ).strftime("%H:%M, %m/%d/%y")
+        if time_last_radar is None:
+            time_last_radar = self.radar_matrix.times[-1].to_pydatetime()
+        time_last_radar = utc_datetime_to_cst(time_last_radar).strftime(
+            "%H:%M, %m/%d/%y"
+        )
 
         with open(
             self.config.analysis_results.final_results.last_run_tag_website, "w+"
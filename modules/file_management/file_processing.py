@@ -6,8 +6,11 @@
 # Dev log   :
 """"""
 import os
+import hashlib
+from contextlib import contextmanager
 from pathlib import Path
 import shutil
+import numpy as np
 from tqdm import tqdm
 
 
@@ -198,3 +201,70 @@ def remove_all_contents_of_a_folder(folder_path: str) -> None:
                 shutil.rmtree(file_path)
         except Exception as e:
             print("Failed to delete %s. Reason: %s" % (file_path, e))
+
+
+def hash_files(list_of_file_paths: list, extra: str = "") -> str:
+    """
+    Content hash of a list of files, used as a cache key
+    :param list_of_file_paths: Files to hash; the order matters
+    :param extra: Additional text to include in the hash, e.g., the relevant configuration
+    :return: Hex digest
+    """
+    digest = hashlib.sha256(extra.encode())
+    for file_path in list_of_file_paths:
+        with open(file_path, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextmanager
+def atomic_write(file_path: str, mode: str = "wb"):
+    """
+    Open a temporary file next to file_path and move it over file_path once the block completes, so that an
+    interrupted run never leaves a partial file
+    :param file_path: File to write
+    :param mode: Mode to open the file in, "wb" or "w"
+    :return: File object of the temporary file
+    """
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    path_tmp = f"{file_path}.tmp"
+    try:
+        with open(path_tmp, mode) as file:
+            yield file
+        os.replace(path_tmp, file_path)
+    finally:
+        if os.path.exists(path_tmp):
+            os.remove(path_tmp)
+
+
+def save_npz(file_path: str, arrays: dict) -> None:
+    """
+    Save arrays to a npz file, atomically
+    :param file_path: Path of the npz file
+    :param arrays: Arrays by name
+    :return:
+    """
+    with atomic_write(file_path, "wb") as file:
+        np.savez(file, **arrays)
+
+
+def load_npz(file_path: str) -> dict:
+    """
+    Load all arrays of a npz file written by save_npz
+    :param file_path: Path of the npz file
+    :return: Arrays by name
+    """
+    with np.load(file_path, allow_pickle=False) as cache:
+        return {key: cache[key] for key in cache.files}
+
+
+def npz_cache_path(cache_folder: str, name: str, key: str) -> str:
+    """
+    Path of a cached npz file in cache_folder, named after a hash of its inputs
+    :param cache_folder: Folder of the cached files
+    :param name: Kind of the cached data, e.g., "warp_plan"
+    :param key: Hex digest of the inputs, e.g., from hash_files or hashlib.sha256
+    :return: Path to the npz file
+    """
+    return os.path.join(cache_folder, f"{name}_{key[:16]}.npz")
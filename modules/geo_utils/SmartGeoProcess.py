@@ -23,6 +23,8 @@ from loky import get_reusable_executor
 import rioxarray as rxr
 import logging
 
+from modules.geo_utils.line_sampling import cached_line_index, LINE_SAMPLING_STATS
+
 log = logging.getLogger(__name__)
 
 
@@ -254,7 +256,12 @@ class GeoDataLines(GeoDataShapes):
         GeoDataShapes.__init__(self, path_geodata=path_geodata, crs=crs)
 
     def batch_estimate_raster_stat(
-        self, list_of_raster_path, buffer=None, attach_to_file=False
+        self,
+        list_of_raster_path,
+        buffer=None,
+        attach_to_file=False,
+        method="zonal_stats",
+        index_cache_folder=None,
     ):
 
         # If string is passed, convert the string into raster
@@ -265,7 +272,13 @@ class GeoDataLines(GeoDataShapes):
         )
 
         # Create a partial function for passing buffer and making the process concurrent
-        func_ = partial(self.extract_raster_stat, buffer=buffer, concurrent=True)
+        func_ = partial(
+            self.extract_raster_stat,
+            buffer=buffer,
+            concurrent=True,
+            method=method,
+            index_cache_folder=index_cache_folder,
+        )
 
         with get_reusable_executor() as executor:
             results = list(
@@ -299,25 +312,48 @@ class GeoDataLines(GeoDataShapes):
         affine=None,
         suffix=None,
         concurrent=False,
+        method="zonal_stats",
+        min_flooded_depth=0.0,
+        index_cache_folder=None,
     ):
 
-        """['min', 'max', 'median', 'majority', 'sum']"""
+        """
+        Raster statistics for each line
+        :param method: "zonal_stats" buffers the lines by buffer and runs rasterstats with the given stats
+        ['min', 'max', 'median', 'majority', 'sum']; "line_sampling" samples the raster along the lines and returns
+        the given stats of max, mean and length_flooded (length of line with a value above min_flooded_depth, in crs
+        units)
+        :param index_cache_folder: Folder to keep the line to pixel index of line_sampling across runs
+        """
         # Get the stat
         if polygon is None:
             polygon = self.gdf
-        # Make a copy
-        _polygon = polygon.copy()
-        # get zonal statistics
 
-        if buffer is not None:
-            # Add buffer
-            _polygon = gpd.GeoDataFrame(
-                _polygon, geometry=polygon.buffer(buffer)
-            )  # Buffer buffer on each side
+        if method == "line_sampling":
+            df_zonal_stats = self.get_raster_stat_along_lines(
+                raster,
+                polygon,
+                stats=stats,
+                affine=affine,
+                min_flooded_depth=min_flooded_depth,
+                index_cache_folder=index_cache_folder,
+            )
+        elif method == "zonal_stats":
+            # Make a copy
+            _polygon = polygon.copy()
+            # get zonal statistics
 
-        df_zonal_stats = self.get_raster_stat_at_polygons(
-            raster, _polygon, stats, affine
-        )
+            if buffer is not None:
+                # Add buffer
+                _polygon = gpd.GeoDataFrame(
+                    _polygon, geometry=polygon.buffer(buffer)
+                )  # Buffer buffer on each side
+
+            df_zonal_stats = self.get_raster_stat_at_polygons(
+                raster, _polygon, stats, affine
+            )
+        else:
+            raise ValueError(f"Unknown raster extraction method: {method}")
 
         # Rename the columns for all columns in the database by adding some suffix
         if (suffix is None) and (isinstance(raster, str)):
@@ -336,6 +372,54 @@ class GeoDataLines(GeoDataShapes):
 
         return rdf
 
+    def get_raster_stat_along_lines(
+        self,
+        raster,
+        lines=None,
+        stats=LINE_SAMPLING_STATS,
+        affine=None,
+        min_flooded_depth=0.0,
+        index_cache_folder=None,
+    ):
+        """
+        Raster statistics along each line, from the pixels crossed by the line (see LinePixelIndex)
+        :param raster: Path to the raster, or a 2D array together with affine
+        :param lines: Line geodataframe, defaults to self.gdf
+        :param stats: Statistics to return, any of max, mean and length_flooded
+        :param affine: Transform of the raster if an array is passed
+        :param min_flooded_depth: Values above this count towards length_flooded
+        :param index_cache_folder: Folder to keep the line to pixel index across runs; None builds it every call
+        :return: pd.DataFrame with a column per statistic
+        """
+        if lines is None:
+            lines = self.gdf
+        unknown = set(stats) - set(LINE_SAMPLING_STATS)
+        if unknown:
+            raise ValueError(f"line_sampling does not provide the stats {unknown}")
+
+        raster_crs = ""
+        if isinstance(raster, str):
+            with rasterio.open(raster) as src:
+                data = src.read(1, masked=True).astype("float64").filled(np.nan)
+                affine = src.transform
+                raster_crs = src.crs.to_wkt() if src.crs is not None else ""
+                # Sample in the crs of the raster
+                if src.crs is not None and lines.crs is not None:
+                    if not lines.crs.equals(src.crs):
+                        lines = lines.to_crs(src.crs)
+        else:
+            data = np.asarray(raster, dtype="float64")
+
+        index = cached_line_index(
+            lines.geometry.values,
+            affine,
+            data.shape,
+            crs=raster_crs,
+            cache_folder=index_cache_folder,
+        )
+        result = index.reduce(data, min_flooded_depth=min_flooded_depth)
+        return pd.DataFrame({stat: result[stat] for stat in stats}, index=lines.index)
+
 
 class GeoDataPolygons(GeoDataShapes):
     """A class for geodata polygons"""
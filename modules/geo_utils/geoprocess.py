@@ -2,21 +2,73 @@ from osgeo import gdal
 import geopandas as gpd
 import rasterstats as rs
 import rioxarray as rxr
+import rasterio
 import os
 
+from rasterio import Affine
+
+from modules.geo_utils.warp_plan import cached_warp_plan
+
+# Largest raster, in pixels, reprojected with a cached warp plan; the plan and the band are held in memory
+WARP_PLAN_MAX_PIXELS = 25_000_000
+
 
 def reproject_raster(
     source_file_location: str,
     destination_file_location: str,
     destination_crs: str = "EPSG:4326",
     source_crs: str = "EPSG:2278",
+    plan_cache_folder: str = None,
+    max_plan_pixels: int = WARP_PLAN_MAX_PIXELS,
 ):
+    """
+    Reproject a raster with gdal.Warp. If plan_cache_folder is given and the raster has at most max_plan_pixels
+    pixels, the cached pixel mapping of its grid is applied instead (see WarpPlan); the result has the dtype and the
+    nodata value of the source, like the gdal.Warp result. Larger rasters are always warped by gdal, which works in
+    chunks of bounded memory.
+    """
+    if plan_cache_folder is not None:
+        with rasterio.open(source_file_location) as src:
+            use_plan = src.width * src.height <= max_plan_pixels
+            if use_plan:
+                data = src.read(1)
+                transform, dtype, nodata = src.transform, src.dtypes[0], src.nodata
+        if use_plan:
+            # Same grid every run; apply the cached pixel mapping instead of warping
+            plan = cached_warp_plan(
+                transform,
+                data.shape,
+                source_crs,
+                destination_crs,
+                cache_folder=plan_cache_folder,
+            )
+            # gdal.Warp fills the pixels outside the source with its nodata value, or 0 without one
+            projected = plan.apply(
+                data, fill_value=0 if nodata is None else nodata
+            ).astype(dtype)
+            with rasterio.open(
+                destination_file_location,
+                "w",
+                driver="GTiff",
+                width=projected.shape[1],
+                height=projected.shape[0],
+                count=1,
+                dtype=dtype,
+                crs=destination_crs,
+                transform=Affine(*plan.destination_transform),
+                nodata=nodata,
+            ) as dst:
+                dst.write(projected, 1)
+            return
+
     input_raster = gdal.Open(source_file_location)
     warp = gdal.Warp(
         destination_file_location,
         input_raster,
         dstSRS=destination_crs,
         srcSRS=source_crs,
+        multithread=True,
+        warpOptions=["NUM_THREADS=ALL_CPUS"],
     )
     warp = None  # Closes the files
 
@@ -51,4 +103,3 @@ def extract_raster_value_with_buffer(
     #
     zonal_df = gpd.GeoDataFrame.from_features(zonal_stat)
     return zonal_df
-
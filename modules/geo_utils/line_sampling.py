@@ -0,0 +1,208 @@
+"""Raster statistics along lines
+Details
+-------
+Samples a raster along line geometries, without buffering the lines into polygons. Each line is split into short
+pieces (at most half a pixel long), and the raster pixel under the middle of each piece is recorded together with the
+length of the piece. The pixel lists of all lines are stored as one CSR structure, so the statistics of every line are
+a single gather of the raster values followed by a reduceat per statistic. The road network and the raster grid do
+not change between runs, so the index is saved to disk and reused (see cached_line_index).
+
+"""
+import hashlib
+import logging
+import os
+
+import numpy as np
+import shapely
+
+from modules.file_management.file_processing import (
+    load_npz,
+    npz_cache_path,
+    save_npz,
+)
+from modules.geo_utils.raster_processing import transform_coefficients
+
+log = logging.getLogger(__name__)
+
+# Statistics returned by LinePixelIndex.reduce
+LINE_SAMPLING_STATS = ("max", "mean", "length_flooded")
+
+
+class LinePixelIndex:
+    """Pixels crossed by each line of a set of lines, as a CSR structure"""
+
+    def __init__(self, indptr, pixels, weights, transform, shape):
+        # Samples of line i are pixels[indptr[i]:indptr[i + 1]]
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        # Flat index of the pixel under each sample, in a raster of the given shape
+        self.pixels = np.asarray(pixels, dtype=np.int64)
+        # Length of line covered by each sample, in the units of the raster crs
+        self.weights = np.asarray(weights, dtype=np.float64)
+        # Coefficients (a, b, c, d, e, f) of the affine transform of the raster
+        self.transform = transform_coefficients(transform)
+        self.shape = tuple(int(x) for x in shape)
+
+    @property
+    def n_lines(self) -> int:
+        return len(self.indptr) - 1
+
+    @classmethod
+    def from_lines(cls, geometries, transform, shape, step=None) -> "LinePixelIndex":
+        """
+        Build the index for a set of (multi)line geometries
+        :param geometries: Line geometries, in the crs of the raster
+        :type geometries: array like of shapely geometries
+        :param transform: Affine transform of the raster
+        :type transform: Affine
+        :param shape: Shape (rows, cols) of the raster
+        :type shape: tuple
+        :param step: Largest length of a sampled piece; defaults to half the pixel size. Pixels whose corner is
+        clipped by a shorter stretch of line than this may be missed; pass a smaller step to catch them
+        :type step: float
+        :return: LinePixelIndex
+        """
+        a, b, c, d, e, f = transform_coefficients(transform)
+        rows, cols = int(shape[0]), int(shape[1])
+        if step is None:
+            step = min(np.hypot(a, d), np.hypot(b, e)) / 2
+
+        geometries = np.asarray(geometries, dtype=object)
+        # Split multi part lines; pieces must not join the end of a part to the start of the next one
+        parts, part_line = shapely.get_parts(geometries, return_index=True)
+        coords, coord_part = shapely.get_coordinates(
+            shapely.segmentize(parts, max_segment_length=step), return_index=True
+        )
+
+        # One sample per piece, at its middle
+        same_part = coord_part[1:] == coord_part[:-1]
+        start, end = coords[:-1][same_part], coords[1:][same_part]
+        sample_line = part_line[coord_part[:-1][same_part]]
+        weights = np.hypot(*(end - start).T)
+        # Pixel under the middle of the piece, from the inverse of the affine transform
+        x, y = (start + end).T / 2 - np.array([[c], [f]])
+        det = a * e - b * d
+        col = np.floor((e * x - b * y) / det).astype(np.int64)
+        row = np.floor((a * y - d * x) / det).astype(np.int64)
+
+        # Drop samples outside the raster
+        inside = (row >= 0) & (row < rows) & (col >= 0) & (col < cols)
+        sample_line, weights = sample_line[inside], weights[inside]
+        pixels = row[inside] * cols + col[inside]
+
+        # Samples are ordered by line already
+        indptr = np.zeros(len(geometries) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sample_line, minlength=len(geometries)), out=indptr[1:])
+        return cls(indptr, pixels, weights, (a, b, c, d, e, f), (rows, cols))
+
+    def save(self, path) -> None:
+        """Save the index to a npz file"""
+        save_npz(
+            path,
+            {
+                "indptr": self.indptr,
+                "pixels": self.pixels,
+                "weights": self.weights,
+                "transform": np.array(self.transform),
+                "shape": np.array(self.shape),
+            },
+        )
+
+    @classmethod
+    def load(cls, path) -> "LinePixelIndex":
+        """Load an index written by save"""
+        cache = load_npz(path)
+        return cls(
+            cache["indptr"],
+            cache["pixels"],
+            cache["weights"],
+            cache["transform"],
+            cache["shape"],
+        )
+
+    def reduce(self, data, nodata=None, min_flooded_depth: float = 0.0) -> dict:
+        """
+        Statistics of the raster along each line. Lines that do not cross any valid pixel get NaN, except for
+        length_flooded which is 0.
+        :param data: Raster values with the shape of the index
+        :type data: np.ndarray
+        :param nodata: Nodata value of the raster; NaN values are always treated as nodata
+        :type nodata: float
+        :param min_flooded_depth: Pieces with a value above this are counted in length_flooded
+        :type min_flooded_depth: float
+        :return: {"max": .., "mean": .., "length_flooded": ..}, one value per line for each statistic
+        :rtype: dict
+        """
+        data = np.asarray(data)
+        if data.shape != self.shape:
+            raise ValueError(
+                f"Raster shape {data.shape} does not match the index shape {self.shape}"
+            )
+        values = data.reshape(-1)[self.pixels].astype(np.float64)
+        if nodata is not None:
+            values[values == nodata] = np.nan
+        valid = ~np.isnan(values)
+        weights = np.where(valid, self.weights, 0.0)
+
+        result = {
+            "max": np.full(self.n_lines, np.nan),
+            "mean": np.full(self.n_lines, np.nan),
+            "length_flooded": np.zeros(self.n_lines),
+        }
+        # reduceat needs non empty segments
+        not_empty = np.flatnonzero(np.diff(self.indptr) > 0)
+        if len(not_empty) == 0:
+            return result
+        starts = self.indptr[not_empty]
+
+        # fmax ignores NaN unless all values of a line are NaN
+        result["max"][not_empty] = np.fmax.reduceat(values, starts)
+        length_valid = np.add.reduceat(weights, starts)
+        weighted_sum = np.add.reduceat(np.where(valid, values, 0.0) * weights, starts)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result["mean"][not_empty] = np.where(
+                length_valid > 0, weighted_sum / length_valid, np.nan
+            )
+        result["length_flooded"][not_empty] = np.add.reduceat(
+            np.where(valid & (values > min_flooded_depth), weights, 0.0), starts
+        )
+        return result
+
+
+def line_index_key(geometries, transform, shape, crs="", step=None) -> str:
+    """
+    Hash identifying a LinePixelIndex: the line geometries, the raster grid (transform, shape, crs) and the step
+    :return: Hex digest
+    """
+    digest = hashlib.sha256(
+        f"{transform_coefficients(transform)}|{tuple(shape)}|{crs}|{step}".encode()
+    )
+    for wkb in shapely.to_wkb(np.asarray(geometries, dtype=object)):
+        digest.update(wkb)
+    return digest.hexdigest()
+
+
+def cached_line_index(
+    geometries, transform, shape, crs="", cache_folder=None, step=None
+) -> LinePixelIndex:
+    """
+    LinePixelIndex for the lines and the raster grid, loaded from cache_folder if it was built before
+    :param geometries: Line geometries, in the crs of the raster
+    :param transform: Affine transform of the raster
+    :param shape: Shape (rows, cols) of the raster
+    :param crs: Crs of the raster, as text; part of the cache key
+    :param cache_folder: Folder of the cached indexes; None disables caching
+    :param step: See LinePixelIndex.from_lines
+    :return: LinePixelIndex
+    """
+    if cache_folder is None:
+        return LinePixelIndex.from_lines(geometries, transform, shape, step=step)
+
+    key = line_index_key(geometries, transform, shape, crs=crs, step=step)
+    path = npz_cache_path(cache_folder, "line_index", key)
+    if os.path.isfile(path):
+        return LinePixelIndex.load(path)
+
+    log.info(f"Building the line to pixel index {path}")
+    index = LinePixelIndex.from_lines(geometries, transform, shape, step=step)
+    index.save(path)
+    return index
@@ -0,0 +1,175 @@
+"""Fused raster stage
+Details
+-------
+After each HEC-RAS run the depth and water surface elevation rasters go through subtraction (water over structure),
+reprojection to the map crs and coloring. Done step by step, every step writes a raster that the next step reads
+back. The fused stage reads each input once, keeps the intermediate arrays in memory, and only writes the final
+products: the projected depth and water over roads rasters and the depth map image.
+
+"""
+import os
+
+import numpy as np
+import rasterio
+from rasterio import Affine
+from rasterio.enums import Resampling
+from rasterio.transform import array_bounds
+from rasterio.warp import calculate_default_transform, reproject
+
+from modules.geo_utils.raster_processing import align_to_grid, read_band_as_float
+from modules.geo_utils.warp_plan import cached_warp_plan
+from modules.image_utils.image_processing import colorize_array
+
+
+def fused_depth_pipeline(
+    path_depth: str,
+    path_wse: str,
+    path_dsm: str,
+    path_depth_projected: str,
+    path_water_over_roads_projected: str,
+    source_crs: str,
+    destination_crs: str,
+    color_map: dict,
+    plan_cache_folder: str = None,
+    paletted: bool = False,
+):
+    """
+    Water over structure, reprojection and coloring of the HEC-RAS results in one pass
+    :param path_depth: Depth raster from HEC-RAS
+    :type path_depth: str
+    :param path_wse: Water surface elevation raster from HEC-RAS
+    :type path_wse: str
+    :param path_dsm: Digital surface model; read on the grid of the water surface elevation raster
+    :type path_dsm: str
+    :param path_depth_projected: Path to save the projected depth raster
+    :type path_depth_projected: str
+    :param path_water_over_roads_projected: Path to save the projected water over structure raster
+    :type path_water_over_roads_projected: str
+    :param source_crs: Crs of the HEC-RAS rasters
+    :type source_crs: str
+    :param destination_crs: Crs of the saved rasters and the image
+    :type destination_crs: str
+    :param color_map: Color map of the depth image, see colorize_array
+    :type color_map: dict
+    :param plan_cache_folder: Folder of the cached warp plans, see project_array
+    :type plan_cache_folder: str
+    :param paletted: Return an 8-bit paletted image instead of RGBA
+    :type paletted: bool
+    :return: Depth map image
+    :rtype: PIL.Image.Image
+    """
+    with rasterio.open(path_depth) as src:
+        depth = read_band_as_float(src).astype("float32")
+        depth_transform = src.transform
+
+    with rasterio.open(path_wse) as src, rasterio.open(path_dsm) as dsm:
+        _dsm = align_to_grid(dsm, src)
+        water_over_roads = (read_band_as_float(src) - read_band_as_float(_dsm)).astype(
+            "float32"
+        )
+        wse_transform = src.transform
+        if _dsm is not dsm:
+            _dsm.close()
+
+    depth_projected, depth_projected_transform = project_array(
+        depth,
+        depth_transform,
+        source_crs,
+        destination_crs,
+        plan_cache_folder=plan_cache_folder,
+    )
+    write_float_raster(
+        path_depth_projected,
+        depth_projected,
+        depth_projected_transform,
+        destination_crs,
+    )
+
+    water_projected, water_projected_transform = project_array(
+        water_over_roads,
+        wse_transform,
+        source_crs,
+        destination_crs,
+        plan_cache_folder=plan_cache_folder,
+    )
+    write_float_raster(
+        path_water_over_roads_projected,
+        water_projected,
+        water_projected_transform,
+        destination_crs,
+    )
+
+    return colorize_array(depth_projected, color_map, paletted=paletted)
+
+
+def project_array(
+    array: np.ndarray,
+    transform,
+    source_crs: str,
+    destination_crs: str,
+    plan_cache_folder: str = None,
+) -> tuple:
+    """
+    Reproject a float array in memory (nearest neighbour, NaN as nodata). The output grid is the one gdal.Warp picks
+    by default.
+    :param plan_cache_folder: If given, the pixel mapping of the grid is cached in this folder and applied as an array
+    gather (see WarpPlan); otherwise the array is warped with all cpus
+    :return: Projected array and its transform
+    :rtype: tuple
+    """
+    if plan_cache_folder is not None:
+        plan = cached_warp_plan(
+            transform,
+            array.shape,
+            source_crs,
+            destination_crs,
+            cache_folder=plan_cache_folder,
+        )
+        return plan.apply(array), Affine(*plan.destination_transform)
+
+    height, width = array.shape
+    (
+        destination_transform,
+        destination_width,
+        destination_height,
+    ) = calculate_default_transform(
+        source_crs,
+        destination_crs,
+        width,
+        height,
+        *array_bounds(height, width, transform),
+    )
+    projected = np.full((destination_height, destination_width), np.nan, array.dtype)
+    reproject(
+        source=array,
+        destination=projected,
+        src_transform=transform,
+        src_crs=source_crs,
+        src_nodata=np.nan,
+        dst_transform=destination_transform,
+        dst_crs=destination_crs,
+        dst_nodata=np.nan,
+        resampling=Resampling.nearest,
+        num_threads=os.cpu_count() or 1,
+    )
+    return projected, destination_transform
+
+
+def write_float_raster(path: str, array: np.ndarray, transform, crs: str) -> None:
+    """Save a float array as a tiled, deflate compressed GeoTIFF with NaN as nodata"""
+    with rasterio.open(
+        path,
+        "w",
+        driver="GTiff",
+        width=array.shape[1],
+        height=array.shape[0],
+        count=1,
+        dtype="float32",
+        crs=crs,
+        transform=transform,
+        nodata=np.nan,
+        tiled=True,
+        compress="deflate",
+        predictor=3,
+    ) as dst:
+        dst.write(array.astype("float32"), 1)
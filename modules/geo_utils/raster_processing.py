@@ -4,11 +4,20 @@
 # Version   :
 # Notes     :
 """"""
+import numpy as np
+import rasterio
 import rioxarray as rxr
+from rasterio.enums import Resampling
+from rasterio.vrt import WarpedVRT
+from rasterio.windows import Window
 
 
 def subtract_two_raster(
-    raster_to_subtract_from: str, subtracting_raster: str, file_path_to_save: str
+    raster_to_subtract_from: str,
+    subtracting_raster: str,
+    file_path_to_save: str,
+    windowed: bool = True,
+    block_size: int = 512,
 ) -> None:
     """
     Subtract two rasters
@@ -18,10 +27,133 @@ def subtract_two_raster(
     :type subtracting_raster: str
     :param file_path_to_save: Path to save the final raster
     :type file_path_to_save: str
+    :param windowed: Stream the rasters block by block so that the memory use does not depend on the raster size;
+    otherwise both rasters are read in full
+    :type windowed: bool
+    :param block_size: Size of the blocks in pixels, also the tile size of the saved raster; a multiple of 16
+    :type block_size: int
     :return: None
     :rtype: None
     """
+    if windowed:
+        subtract_two_raster_windowed(
+            raster_to_subtract_from,
+            subtracting_raster,
+            file_path_to_save,
+            block_size=block_size,
+        )
+        return
+
     _main_raster = rxr.open_rasterio(raster_to_subtract_from, masked=True).squeeze()
     _second_raster = rxr.open_rasterio(subtracting_raster, masked=True).squeeze()
     _difference = _main_raster - _second_raster
     _difference.rio.to_raster(file_path_to_save)
+
+
+def subtract_two_raster_windowed(
+    raster_to_subtract_from: str,
+    subtracting_raster: str,
+    file_path_to_save: str,
+    block_size: int = 512,
+) -> None:
+    """
+    Subtract two rasters block by block. The result is on the grid of raster_to_subtract_from; if the grid of
+    subtracting_raster differs it is warped on the fly (nearest neighbour). Pixels that are nodata in either raster are
+    NaN in the result, which is saved as a tiled, deflate compressed float32 GeoTIFF.
+    :param raster_to_subtract_from: A of A-B raster operation
+    :type raster_to_subtract_from: str
+    :param subtracting_raster: B of A-B raster operation
+    :type subtracting_raster: str
+    :param file_path_to_save: Path to save the final raster
+    :type file_path_to_save: str
+    :param block_size: Size of the blocks in pixels, also the tile size of the saved raster; a multiple of 16
+    :type block_size: int
+    :return: None
+    :rtype: None
+    """
+    with rasterio.open(raster_to_subtract_from) as _main, rasterio.open(
+        subtracting_raster
+    ) as _second:
+        profile = {
+            "driver": "GTiff",
+            "width": _main.width,
+            "height": _main.height,
+            "count": 1,
+            "dtype": "float32",
+            "crs": _main.crs,
+            "transform": _main.transform,
+            "nodata": np.nan,
+            "tiled": True,
+            "blockxsize": block_size,
+            "blockysize": block_size,
+            "compress": "deflate",
+            "predictor": 3,
+            "BIGTIFF": "IF_SAFER",
+        }
+
+        # Read the second raster on the grid of the first one
+        _aligned = align_to_grid(_second, _main)
+
+        with rasterio.open(file_path_to_save, "w", **profile) as dst:
+            for row in range(0, _main.height, block_size):
+                for col in range(0, _main.width, block_size):
+                    window = Window(
+                        col,
+                        row,
+                        min(block_size, _main.width - col),
+                        min(block_size, _main.height - row),
+                    )
+                    _difference = read_band_as_float(
+                        _main, window
+                    ) - read_band_as_float(_aligned, window)
+                    dst.write(_difference.astype("float32"), 1, window=window)
+
+        if _aligned is not _second:
+            _aligned.close()
+
+
+def align_to_grid(dataset, reference):
+    """
+    The dataset itself if it is on the grid of the reference dataset, otherwise a WarpedVRT (nearest neighbour) of
+    the dataset on that grid. Close the returned dataset if it is not the input.
+    """
+    if same_grid(dataset, reference):
+        return dataset
+    return WarpedVRT(
+        dataset,
+        crs=reference.crs,
+        transform=reference.transform,
+        width=reference.width,
+        height=reference.height,
+        resampling=Resampling.nearest,
+    )
+
+
+def read_band_as_float(dataset, window=None) -> np.ndarray:
+    """Read the first band (or a window of it) as float64, with nodata as NaN"""
+    return dataset.read(1, window=window, masked=True).astype("float64").filled(np.nan)
+
+
+def same_grid(dataset_a, dataset_b) -> bool:
+    """Whether two rasters share transform and shape, and crs if both have one"""
+    return (
+        (
+            dataset_a.crs is None
+            or dataset_b.crs is None
+            or dataset_a.crs == dataset_b.crs
+        )
+        and dataset_a.shape == dataset_b.shape
+        and np.allclose(
+            transform_coefficients(dataset_a.transform),
+            transform_coefficients(dataset_b.transform),
+        )
+    )
+
+
+def transform_coefficients(transform) -> tuple:
+    """Coefficients (a, b, c, d, e, f) of an affine transform, from an Affine or a sequence"""
+    if hasattr(transform, "a"):
+        return tuple(
+            float(getattr(transform, name)) for name in ("a", "b", "c", "d", "e", "f")
+        )
+    return tuple(float(x) for x in list(transform)[:6])
@@ -0,0 +1,152 @@
+"""Cached reprojection of rasters on a fixed grid
+Details
+-------
+HEC-RAS writes its results on the same grid every run, so reprojecting them to the map crs always maps the same
+source pixels to the same destination pixels. A WarpPlan stores, for every destination pixel, the index of the source
+pixel it takes its value from (nearest neighbour). It is built once per grid and crs pair, saved to disk, and applied to the
+rasters of later runs as a single array gather.
+
+"""
+import hashlib
+import logging
+import os
+
+import numpy as np
+from rasterio.enums import Resampling
+from rasterio.transform import array_bounds
+from rasterio.warp import calculate_default_transform, reproject
+
+from modules.file_management.file_processing import (
+    load_npz,
+    npz_cache_path,
+    save_npz,
+)
+from modules.geo_utils.raster_processing import transform_coefficients
+
+log = logging.getLogger(__name__)
+
+
+class WarpPlan:
+    """Source pixel of each destination pixel, for a nearest neighbour reprojection"""
+
+    def __init__(
+        self, source_index, source_shape, destination_transform, destination_shape
+    ):
+        # Flat index of the source pixel of each destination pixel, -1 outside the source raster
+        self.source_index = np.asarray(source_index)
+        self.source_shape = tuple(int(x) for x in source_shape)
+        # Coefficients (a, b, c, d, e, f) of the affine transform of the destination grid
+        self.destination_transform = transform_coefficients(destination_transform)
+        self.destination_shape = tuple(int(x) for x in destination_shape)
+
+    @classmethod
+    def build(
+        cls, source_transform, source_shape, source_crs, destination_crs
+    ) -> "WarpPlan":
+        """
+        Plan the reprojection of a grid to another crs; the destination grid is the one gdal.Warp picks by default
+        :param source_transform: Affine transform of the source raster
+        :param source_shape: Shape (rows, cols) of the source raster
+        :param source_crs: Crs of the source raster
+        :param destination_crs: Crs to reproject to
+        :return: WarpPlan
+        """
+        rows, cols = int(source_shape[0]), int(source_shape[1])
+        destination_transform, width, height = calculate_default_transform(
+            source_crs,
+            destination_crs,
+            cols,
+            rows,
+            *array_bounds(rows, cols, source_transform),
+        )
+        # Warp the index of each source pixel; nearest neighbour keeps the indexes intact, so the result is exactly
+        # the pixel mapping gdal applies
+        dtype = np.int32 if rows * cols < np.iinfo(np.int32).max else np.float64
+        source_index = np.full((height, width), -1, dtype=dtype)
+        reproject(
+            source=np.arange(rows * cols, dtype=dtype).reshape(rows, cols),
+            destination=source_index,
+            src_transform=source_transform,
+            src_crs=source_crs,
+            dst_transform=destination_transform,
+            dst_crs=destination_crs,
+            dst_nodata=-1,
+            resampling=Resampling.nearest,
+            num_threads=os.cpu_count() or 1,
+        )
+        source_index = source_index.astype(np.int64 if dtype == np.float64 else dtype)
+        return cls(source_index, (rows, cols), destination_transform, (height, width))
+
+    def apply(self, array: np.ndarray, fill_value=np.nan) -> np.ndarray:
+        """
+        Reproject an array on the source grid
+        :param array: Values on the source grid
+        :param fill_value: Value of the destination pixels outside the source raster
+        :return: Values on the destination grid
+        """
+        array = np.asarray(array)
+        if array.shape != self.source_shape:
+            raise ValueError(
+                f"Raster shape {array.shape} does not match the plan shape {self.source_shape}"
+            )
+        inside = self.source_index >= 0
+        result = np.full(
+            self.destination_shape,
+            fill_value,
+            dtype=np.result_type(array.dtype, np.min_scalar_type(fill_value)),
+        )
+        result[inside] = array.reshape(-1)[self.source_index[inside]]
+        return result
+
+    def save(self, path) -> None:
+        """Save the plan to a npz file"""
+        save_npz(
+            path,
+            {
+                "source_index": self.source_index,
+                "source_shape": np.array(self.source_shape),
+                "destination_transform": np.array(self.destination_transform),
+                "destination_shape": np.array(self.destination_shape),
+            },
+        )
+
+    @classmethod
+    def load(cls, path) -> "WarpPlan":
+        """Load a plan written by save"""
+        cache = load_npz(path)
+        return cls(
+            cache["source_index"],
+            cache["source_shape"],
+            cache["destination_transform"],
+            cache["destination_shape"],
+        )
+
+
+def cached_warp_plan(
+    source_transform, source_shape, source_crs, destination_crs, cache_folder=None
+) -> WarpPlan:
+    """
+    WarpPlan for the grid and crs pair, loaded from cache_folder if it was built before
+    :param source_transform: Affine transform of the source raster
+    :param source_shape: Shape (rows, cols) of the source raster
+    :param source_crs: Crs of the source raster
+    :param destination_crs: Crs to reproject to
+    :param cache_folder: Folder of the cached plans; None disables caching
+    :return: WarpPlan
+    """
+    if cache_folder is None:
+        return WarpPlan.build(
+            source_transform, source_shape, source_crs, destination_crs
+        )
+
+    key = hashlib.sha256(
+        f"{transform_coefficients(source_transform)}|{tuple(source_shape)}|{source_crs}|{destination_crs}".encode()
+    ).hexdigest()
+    path = npz_cache_path(cache_folder, "warp_plan", key)
+    if os.path.isfile(path):
+        return WarpPlan.load(path)
+
+    log.info(f"Building the warp plan {path}")
+    plan = WarpPlan.build(source_transform, source_shape, source_crs, destination_crs)
+    plan.save(path)
+    return plan
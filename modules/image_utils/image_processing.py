@@ -3,22 +3,72 @@ from PIL import Image
 import numpy as np
 from geotiff import GeoTiff
 
+# Rows colored at once; bounds the memory of the bin indexes
+_ROWS_PER_CHUNK = 1024
 
-def generate_png_file(path_to_tiff: str, color_map: dict, crs_code: int = 2278):
+
+def generate_png_file(
+    path_to_tiff: str, color_map: dict, crs_code: int = 2278, paletted: bool = False
+):
     # Read the geotiff file
     geo_tiff = GeoTiff(path_to_tiff, crs_code=crs_code)
     zarr_array = geo_tiff.read()
     _img = np.array(zarr_array)
 
-    # Apply color map
-    rgb_img = np.zeros((*_img.shape, 4), dtype=np.uint8)
-    for key in color_map.keys():
-        color_map[key] = [float(i) for i in color_map[key]]
-        start, end, *_rgb = color_map[key]
-        boolean_array = np.logical_and(_img > start, _img <= end)
-        rgb_img[boolean_array] = _rgb
-
-    # Convert array to image
-    img = Image.fromarray(rgb_img, "RGBA")
-    # Return image
-    return img
+    return colorize_array(_img, color_map, paletted=paletted)
+
+
+class ColorLegend:
+    """
+    A color map {key: [start, end, r, g, b, a]} compiled to sorted bin edges and a palette. Values in (start, end]
+    take the color of the entry; where entries overlap the later one wins. Values outside every entry, and NaN, are
+    transparent.
+    """
+
+    def __init__(self, color_map: dict):
+        entries = [[float(i) for i in color_map[key]] for key in color_map.keys()]
+        # Bin i of np.digitize(..., right=True) holds the values in (edges[i - 1], edges[i]]
+        self.edges = np.unique([x for start, end, *_ in entries for x in (start, end)])
+        # Palette entry 0 is transparent, entry i + 1 is the color of legend entry i
+        self.palette = np.zeros((len(entries) + 1, 4), dtype=np.uint8)
+        # Palette entry of each bin, including the bins below the first and above the last edge
+        self.lut = np.zeros(len(self.edges) + 1, dtype=np.uint8)
+        for count, (start, end, *_rgba) in enumerate(entries):
+            self.palette[count + 1] = _rgba
+            covered = (self.edges[:-1] >= start) & (self.edges[1:] <= end)
+            self.lut[1:-1][covered] = count + 1
+
+    def palette_index(self, _img: np.ndarray) -> np.ndarray:
+        """Palette entry of each value, as uint8"""
+        _img = np.asarray(_img)
+        index = np.empty(_img.shape, dtype=np.uint8)
+        for start in range(0, _img.shape[0], _ROWS_PER_CHUNK):
+            _rows = slice(start, start + _ROWS_PER_CHUNK)
+            index[_rows] = self.lut.take(
+                np.digitize(_img[_rows], self.edges, right=True)
+            )
+        return index
+
+    def to_image(self, index: np.ndarray, paletted: bool = False):
+        """Image of an array of palette entries, 8-bit paletted or RGBA"""
+        if paletted:
+            img = Image.fromarray(index, "P")
+            img.putpalette(self.palette[:, :3].reshape(-1).tolist())
+            # Alpha of each palette entry, written as the tRNS chunk of the png
+            img.info["transparency"] = self.palette[:, 3].tobytes()
+            return img
+
+        # Convert array to image
+        return Image.fromarray(self.palette.take(index, axis=0), "RGBA")
+
+
+def colorize_array(_img: np.ndarray, color_map, paletted: bool = False):
+    """
+    Color a depth array with the color map {key: [start, end, r, g, b, a]}, for (start, end] intervals
+    :param _img: Depth array
+    :param color_map: Color map, or a ColorLegend compiled from it
+    :param paletted: Return an 8-bit paletted image instead of RGBA
+    :return: PIL.Image.Image
+    """
+    legend = color_map if isinstance(color_map, ColorLegend) else ColorLegend(color_map)
+    return legend.to_image(legend.palette_index(_img), paletted=paletted)
@@ -0,0 +1,192 @@
+"""Tiled flood depth map for the website
+Details
+-------
+Cuts the projected depth raster into a pyramid of web mercator XYZ tiles ({z}/{x}/{y}.png). A manifest in the tile
+folder stores a hash of the content of every tile, so a run only writes the tiles whose colors changed since the
+previous run, and removes the tiles that became empty. Empty tiles are not written. The manifest also gives the zoom
+levels and the bounds of the tile set, which the website reads to set up the map layer.
+
+Layout of the manifest:
+    {"min_zoom": .., "max_zoom": .., "tile_size": .., "bounds": [west, south, east, north], "tiles": {"z/x/y": hash}}
+
+"""
+import hashlib
+import json
+import logging
+import os
+
+import numpy as np
+
+from modules.file_management.file_processing import atomic_write
+from modules.geo_utils.raster_processing import transform_coefficients
+from modules.image_utils.image_processing import ColorLegend
+
+log = logging.getLogger(__name__)
+
+# Name of the manifest in the tile folder
+MANIFEST_NAME = "manifest.json"
+
+
+def generate_xyz_tiles(
+    depth: np.ndarray,
+    transform,
+    color_map,
+    tile_folder: str,
+    min_zoom: int = 10,
+    max_zoom: int = 15,
+    tile_size: int = 256,
+) -> dict:
+    """
+    Write the XYZ tiles of a depth raster in EPSG:4326, only for the tiles that changed since the last call
+    :param depth: Depth array, NaN for no data
+    :type depth: np.ndarray
+    :param transform: Affine transform of the depth array (north up, EPSG:4326)
+    :param color_map: Color map {key: [start, end, r, g, b, a]} or a ColorLegend
+    :param tile_folder: Folder of the tile pyramid
+    :type tile_folder: str
+    :param min_zoom: Lowest zoom level
+    :type min_zoom: int
+    :param max_zoom: Highest zoom level
+    :type max_zoom: int
+    :param tile_size: Size of the tiles in pixels
+    :type tile_size: int
+    :return: Number of tiles written, unchanged and removed
+    :rtype: dict
+    """
+    legend = color_map if isinstance(color_map, ColorLegend) else ColorLegend(color_map)
+    a, b, c, d, e, f = transform_coefficients(transform)
+    if b != 0 or d != 0:
+        raise ValueError("Only north up rasters can be tiled")
+
+    # Tiles show colors, so a legend change must redraw them
+    legend_hash = hashlib.sha1(legend.edges.tobytes() + legend.palette.tobytes())
+
+    previous = _read_manifest(tile_folder)["tiles"]
+
+    rows, cols = depth.shape
+    west, north = c, f
+    east, south = c + a * cols, f + e * rows
+    manifest = {}
+    summary = {"written": 0, "unchanged": 0, "removed": 0}
+    for zoom in range(min_zoom, max_zoom + 1):
+        x_min, y_min = _lonlat_to_tile(west, north, zoom)
+        x_max, y_max = _lonlat_to_tile(east, south, zoom)
+        for x in range(x_min, x_max + 1):
+            # Source column of each tile pixel column
+            lon = _pixel_to_lon(
+                x * tile_size + np.arange(tile_size) + 0.5, zoom, tile_size
+            )
+            src_col = np.floor((lon - c) / a).astype(np.int64)
+            for y in range(y_min, y_max + 1):
+                lat = _pixel_to_lat(
+                    y * tile_size + np.arange(tile_size) + 0.5, zoom, tile_size
+                )
+                src_row = np.floor((lat - f) / e).astype(np.int64)
+                index = legend.palette_index(_sample(depth, src_row, src_col))
+                # Fully transparent tiles are not written
+                if not legend.palette[:, 3].take(index).any():
+                    continue
+
+                key = f"{zoom}/{x}/{y}"
+                digest = legend_hash.copy()
+                digest.update(index.tobytes())
+                manifest[key] = digest.hexdigest()
+                path_tile = os.path.join(tile_folder, str(zoom), str(x), f"{y}.png")
+                if previous.get(key) == manifest[key] and os.path.isfile(path_tile):
+                    summary["unchanged"] += 1
+                    continue
+                os.makedirs(os.path.dirname(path_tile), exist_ok=True)
+                legend.to_image(index, paletted=True).save(path_tile)
+                summary["written"] += 1
+
+    # Tiles that are empty now
+    summary["removed"] = _remove_tiles(tile_folder, set(previous) - set(manifest))
+    _write_manifest(
+        tile_folder,
+        {
+            "min_zoom": min_zoom,
+            "max_zoom": max_zoom,
+            "tile_size": tile_size,
+            "bounds": [west, south, east, north],
+            "tiles": manifest,
+        },
+    )
+
+    log.info(
+        f"Flood depth tiles: {summary['written']} written, {summary['unchanged']} unchanged, "
+        f"{summary['removed']} removed"
+    )
+    return summary
+
+
+def clear_xyz_tiles(tile_folder: str) -> int:
+    """
+    Remove all tiles of a tile folder, e.g., when a run has no flood map; the manifest keeps the zoom levels and
+    bounds with an empty list of tiles
+    :param tile_folder: Folder of the tile pyramid
+    :type tile_folder: str
+    :return: Number of tiles removed
+    :rtype: int
+    """
+    if not os.path.isfile(os.path.join(tile_folder, MANIFEST_NAME)):
+        return 0
+    manifest = _read_manifest(tile_folder)
+    removed = _remove_tiles(tile_folder, manifest["tiles"])
+    _write_manifest(tile_folder, {**manifest, "tiles": {}})
+    if removed:
+        log.info(f"Flood depth tiles: {removed} removed")
+    return removed
+
+
+def _read_manifest(tile_folder: str) -> dict:
+    path_manifest = os.path.join(tile_folder, MANIFEST_NAME)
+    if not os.path.isfile(path_manifest):
+        return {"tiles": {}}
+    with open(path_manifest) as file:
+        manifest = json.load(file)
+    # Manifests of earlier versions held only the tiles
+    if "tiles" not in manifest:
+        manifest = {"tiles": manifest}
+    return manifest
+
+
+def _write_manifest(tile_folder: str, manifest: dict) -> None:
+    with atomic_write(os.path.join(tile_folder, MANIFEST_NAME), "w") as file:
+        json.dump(manifest, file)
+
+
+def _remove_tiles(tile_folder: str, list_of_keys) -> int:
+    for key in list_of_keys:
+        path_tile = os.path.join(tile_folder, *key.split("/")) + ".png"
+        if os.path.isfile(path_tile):
+            os.remove(path_tile)
+    return len(list_of_keys)
+
+
+def _sample(depth: np.ndarray, src_row: np.ndarray, src_col: np.ndarray) -> np.ndarray:
+    """Nearest neighbour sample of the depth on a grid of source rows and columns; NaN outside the raster"""
+    rows, cols = depth.shape
+    inside_row = (src_row >= 0) & (src_row < rows)
+    inside_col = (src_col >= 0) & (src_col < cols)
+    tile = depth[np.ix_(np.clip(src_row, 0, rows - 1), np.clip(src_col, 0, cols - 1))]
+    return np.where(inside_row[:, None] & inside_col[None, :], tile, np.nan)
+
+
+def _lonlat_to_tile(lon: float, lat: float, zoom: int) -> tuple:
+    """XYZ tile containing a point"""
+    n = 2**zoom
+    x = int(np.floor((lon + 180) / 360 * n))
+    y = int(np.floor((1 - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2 * n))
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def _pixel_to_lon(pixel: np.ndarray, zoom: int, tile_size: int) -> np.ndarray:
+    """Longitude of global web mercator pixel columns"""
+    return pixel / (tile_size * 2**zoom) * 360 - 180
+
+
+def _pixel_to_lat(pixel: np.ndarray, zoom: int, tile_size: int) -> np.ndarray:
+    """Latitude of global web mercator pixel rows"""
+    return np.degrees(
+        np.arctan(np.sinh(np.pi * (1 - 2 * pixel / (tile_size * 2**zoom))))
+    )
@@ -17,15 +17,23 @@ from modules.geo_utils.SmartGeoProcess import (
     GeoDataPolygons,
     GeoDataPoints,
 )
+from modules.network_utils.distance_engine import (
+    distance_to_nearest_facility,
+    flood_mask,
+    masked_distances,
+)
+from modules.network_utils.road_graph import RoadGraph
+from modules.network_utils.flood_flags import classify_flooded_links, flags_to_column
+from modules.file_management.file_processing import save_npz, load_npz
+from scipy.spatial import cKDTree
+import shapely
 from shapely.geometry import Point, MultiPoint, LineString
 from shapely.ops import nearest_points
 import pandas as pd
 import geopandas as gpd
-import networkx as nx
 import copy
 import os
-from itertools import product
-from functools import partial
+from itertools import repeat
 from loky import get_reusable_executor
 from tqdm import tqdm
 import numpy as np
@@ -34,32 +42,62 @@ import logging
 
 log = logging.getLogger(__name__)
 
+# Version of the layout of the files written by NetworkAnalysis.save_fit; increase it when the layout changes
+NETWORK_CACHE_VERSION = 1
+
 
 class NetworkAnalysis:
-    def __init__(self, path_network=None, crs="epsg:26915"):
+    def __init__(self, path_network=None, crs="epsg:26915", lbl_of_weight="length"):
         self.path_network = path_network
         self.crs = crs
+        # Link attribute used as the weight of the graph built in fit
+        self.lbl_of_weight = lbl_of_weight
         self.destination_nodes = {}
+        # Open links and shortest path trees of the last run of each scenario, used for incremental updates
+        self.scenario_state = {}
 
     def add_start_end_nodes_to_gdf(self, gdf=None, explode_data=False):
         """Explode might be required if the data contains multiline_string"""
-        # This function adds start and end nodes to geodataframe
+        # This function adds start and end node ids to geodataframe and saves the coordinates of each node id in
+        # self.node_coords
 
         if gdf is None:
             gdf = self.GeoData.gdf
         # Explode might be required if the data contains multiline_string
         if explode_data:
-            gdf = gdf.explode()
+            parts, index = shapely.get_parts(gdf.geometry.to_numpy(), return_index=True)
+            gdf = gdf.iloc[index].reset_index(drop=True)
+            gdf = gdf.set_geometry(gpd.GeoSeries(parts, crs=gdf.crs))
+
+        # First and last vertex of every link
+        geometry = gdf.geometry.to_numpy()
+        # get_point is None for anything but a LineString, e.g., MultiLineStrings, which would give wrong node ids
+        not_lines = shapely.get_type_id(geometry) != 1
+        if np.any(not_lines):
+            raise ValueError(
+                f"{not_lines.sum()} links of the network are not LineStrings; use explode_data=True to split "
+                f"MultiLineStrings into links"
+            )
+        end_points = np.concatenate(
+            [
+                shapely.get_coordinates(shapely.get_point(geometry, 0)),
+                shapely.get_coordinates(shapely.get_point(geometry, -1)),
+            ]
+        )
 
-        gdf["start_node"] = None
-        gdf["end_node"] = None
+        # Unique nodes, numbered in the order in which they first appear
+        node_coords, first_index, inverse = np.unique(
+            end_points, axis=0, return_index=True, return_inverse=True
+        )
+        order = np.argsort(first_index)
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        node_ids = rank[inverse.ravel()]
 
-        for index, row in gdf.iterrows():
-            coords = [(coords) for coords in list(row["geometry"].coords)]
-            start_node, end_node = [coords[i] for i in (0, -1)]
-            gdf.at[index, "start_node"] = start_node
-            gdf.at[index, "end_node"] = end_node
+        gdf["start_node"] = node_ids[: gdf.shape[0]]
+        gdf["end_node"] = node_ids[gdf.shape[0] :]
 
+        self.node_coords = node_coords[order]
         self.GeoData.gdf = gdf
 
     def get_network_from_geodata(self, path_network=None, crs=None):
@@ -77,12 +115,8 @@ class NetworkAnalysis:
 
     def get_unique_nodes_in_the_graph(self, gdf=None):
         """Generate unique nodes in the graph"""
-        if gdf is None:
-            gdf = self.GeoData.gdf
-
-        # Returns unique list of nodes and the count of unique nodes
-        lst_of_nodes = pd.concat([gdf["start_node"], gdf["end_node"]], axis=0)
-        lst_of_nodes.drop_duplicates(inplace=True)
+        # Returns unique list of nodes; the position of a node is its id
+        lst_of_nodes = pd.Series(list(map(tuple, self.node_coords.tolist())))
         df = pd.DataFrame()
         df["nodes"] = lst_of_nodes
 
@@ -102,6 +136,127 @@ class NetworkAnalysis:
         self.get_network_from_geodata()  # <--This reads the network data
         self.add_start_end_nodes_to_gdf()  # <-- Adds 'end_node', 'start_node' to gdf
         self.get_unique_nodes_in_the_graph()  # <-- Finds unique nodes and generated  self.nodes (lst_of_nodes) and (self.node_results) a df
+        self.build_graph()  # <-- Builds the integer indexed graph (self.graph) reused by all later steps
+
+    def build_graph(self, gdf=None, lbl_of_weight=None):
+        """Build the integer indexed, array backed graph; node ids follow the order of self.node_results"""
+        if gdf is None:
+            gdf = self.GeoData.gdf
+        if lbl_of_weight is None:
+            lbl_of_weight = self.lbl_of_weight
+
+        self.graph = self._links_to_graph(gdf, lbl_of_weight=lbl_of_weight)
+        return self.graph
+
+    def _links_to_graph(
+        self,
+        gdf,
+        lbl_of_weight="length",
+        directed=False,
+        start_node_label="start_node",
+        end_node_label="end_node",
+    ):
+        return RoadGraph(
+            node_coords=self.node_coords,
+            edge_source=gdf[start_node_label].to_numpy(),
+            edge_target=gdf[end_node_label].to_numpy(),
+            edge_length=gdf[lbl_of_weight].to_numpy(dtype=float),
+            directed=directed,
+        )
+
+    def _get_graph(
+        self,
+        lbl_of_weight="length",
+        model_flow_direction=False,
+        start_node_label=None,
+        end_node_label=None,
+    ):
+        """The graph built in fit, or a new one if another weight or a directed graph is requested"""
+        if model_flow_direction is False:
+            if lbl_of_weight == self.lbl_of_weight:
+                return self.graph
+            return self._links_to_graph(self.GeoData.gdf, lbl_of_weight=lbl_of_weight)
+        if all([model_flow_direction, start_node_label, end_node_label]):
+            # Model directed graph
+            return self._links_to_graph(
+                self.GeoData.gdf,
+                lbl_of_weight=lbl_of_weight,
+                directed=True,
+                start_node_label=start_node_label,
+                end_node_label=end_node_label,
+            )
+        raise ValueError(
+            "start_node_label and end_node_label are required to model flow direction"
+        )
+
+    def save_fit(self, path_cache):
+        """Save the fitted graph, the facility nodes and the initial distances to a npz file"""
+        facilities = list(self.destination_nodes.keys())
+        initial_columns = [
+            col for col in self.node_results.columns if col.startswith("Initial_dist_")
+        ]
+        arrays = {
+            "format_version": np.array(NETWORK_CACHE_VERSION),
+            "lbl_of_weight": np.array(self.lbl_of_weight, dtype=str),
+            "node_coords": self.graph.node_coords,
+            "edge_source": self.graph.edge_source,
+            "edge_target": self.graph.edge_target,
+            "edge_length": self.graph.edge_length,
+            "facilities": np.array(facilities, dtype=str),
+            "initial_columns": np.array(initial_columns, dtype=str),
+        }
+        for count, facility in enumerate(facilities):
+            arrays[f"facility_{count}"] = np.array(
+                sorted(self.destination_nodes[facility]), dtype=np.int64
+            )
+        for col in initial_columns:
+            arrays[col] = self.node_results[col].to_numpy(dtype=float)
+        save_npz(path_cache, arrays)
+
+    def load_fit(self, path_cache):
+        """
+        Restore the state of fit, the facility nodes and the initial distances from a file written by save_fit. The
+        network is still read for its geometry. A cache of another format version or weight is not loaded.
+        :return: True if the cache was loaded
+        """
+        if not os.path.isfile(path_cache):
+            return False
+
+        cache = load_npz(path_cache)
+        if "format_version" not in cache or (
+            int(cache["format_version"]) != NETWORK_CACHE_VERSION
+        ):
+            log.warning(f"Network cache {path_cache} has another format version")
+            return False
+        if str(cache["lbl_of_weight"]) != self.lbl_of_weight:
+            log.warning(
+                f"Network cache {path_cache} is weighted by {cache['lbl_of_weight']}, not {self.lbl_of_weight}"
+            )
+            return False
+
+        self.get_network_from_geodata()
+        if len(cache["edge_source"]) != self.GeoData.gdf.shape[0]:
+            log.warning(f"Network cache {path_cache} does not match the network")
+            return False
+        self.graph = RoadGraph(
+            node_coords=cache["node_coords"],
+            edge_source=cache["edge_source"],
+            edge_target=cache["edge_target"],
+            edge_length=cache["edge_length"],
+        )
+        # Same columns as add_start_end_nodes_to_gdf and get_unique_nodes_in_the_graph
+        self.node_coords = self.graph.node_coords
+        self.GeoData.gdf["start_node"] = self.graph.edge_source
+        self.GeoData.gdf["end_node"] = self.graph.edge_target
+        self.get_unique_nodes_in_the_graph()
+        # Facilities and initial distances
+        for count, facility in enumerate(cache["facilities"].tolist()):
+            self.destination_nodes[facility] = set(cache[f"facility_{count}"].tolist())
+        for col in cache["initial_columns"].tolist():
+            self.node_results[col] = cache[col]
+
+        self.gdf_results = self._df_to_gdf(self.node_results)
+        return True
 
     def give_nearest_point_to_given_point_nodeList(self, origin_X_Y, node_list):
         # get the list of nodes
@@ -115,28 +270,78 @@ class NetworkAnalysis:
         return (nearest_geoms[1].x, nearest_geoms[1].y)
 
     def get_the_nearest_node_for_points(
-        self, gdf, network_nodes=None, label_facility=None
+        self, gdf, network_nodes=None, label_facility=None, max_snap_distance=None
     ):
-        """Get the nearest node for each facility; Include label_facility for including the facility for analysis"""
+        """Get the nearest node for each facility; Include label_facility for including the facility for analysis.
+        The distance to the node is saved in 'snap_distance' (units of the crs) and points farther than
+        max_snap_distance are reported"""
 
+        xy = np.column_stack([gdf.geometry.x, gdf.geometry.y])
         # If no nodes are given, take out nodes
-        if network_nodes is None:
-            network_nodes = self.nodes
-        # Loop through nodes
-        gdf["nearest_network_node"] = None
-        for index, row in gdf.iterrows():
-            coords = [(coords) for coords in list(row["geometry"].coords)]
-            gdf.at[
-                index, "nearest_network_node"
-            ] = self.give_nearest_point_to_given_point_nodeList(
-                Point(coords), network_nodes
-            )
+        if network_nodes is not None:
+            # Snap to the given nodes, then find their ids in the graph
+            network_nodes = np.array(list(network_nodes), dtype=float)
+            snap_distance, nearest = cKDTree(network_nodes).query(xy)
+            node_ids, _ = self.graph.nearest_nodes(network_nodes[nearest])
+        else:
+            node_ids, snap_distance = self.graph.nearest_nodes(xy)
+
+        gdf["nearest_network_node"] = list(
+            map(tuple, self.graph.node_coords[node_ids].tolist())
+        )
+        gdf["snap_distance"] = snap_distance
+        self._report_snap_distance(gdf, label_facility, max_snap_distance)
 
         if label_facility is not None:
-            self.destination_nodes[label_facility] = set(gdf["nearest_network_node"])
+            self.destination_nodes[label_facility] = set(node_ids.tolist())
 
         return gdf
 
+    def snap_facilities(self, facilities, max_snap_distance=None):
+        """
+        Snap the points of all facilities to the network in one query and register them for the analysis
+        :param facilities: {facility label: geodataframe of points}
+        :param max_snap_distance: Report points farther than this from the network, units of the crs
+        :return: {facility label: geodataframe with 'nearest_network_node' and 'snap_distance'}
+        """
+        labels = list(facilities.keys())
+        xy = np.concatenate(
+            [
+                np.column_stack([gdf.geometry.x, gdf.geometry.y]).reshape(-1, 2)
+                for gdf in facilities.values()
+            ]
+        )
+        node_ids, snap_distance = self.graph.nearest_nodes(xy)
+
+        # Split the query results by facility
+        splits = np.cumsum([facilities[label].shape[0] for label in labels])[:-1]
+        for label, _node_ids, _distance in zip(
+            labels, np.split(node_ids, splits), np.split(snap_distance, splits)
+        ):
+            gdf = facilities[label]
+            gdf["nearest_network_node"] = list(
+                map(tuple, self.graph.node_coords[_node_ids].tolist())
+            )
+            gdf["snap_distance"] = _distance
+            self._report_snap_distance(gdf, label, max_snap_distance)
+            self.destination_nodes[label] = set(_node_ids.tolist())
+
+        return facilities
+
+    def _report_snap_distance(self, gdf, label_facility, max_snap_distance):
+        if gdf.shape[0] == 0:
+            return
+        log.info(
+            f"Snapped {gdf.shape[0]} {label_facility} to the network, "
+            f"maximum snap distance {gdf['snap_distance'].max()}"
+        )
+        if max_snap_distance is not None:
+            far = gdf["snap_distance"] > max_snap_distance
+            if far.any():
+                log.warning(
+                    f"{far.sum()} {label_facility} are farther than {max_snap_distance} from the network"
+                )
+
     def get_initial_distance(
         self,
         facility_labels="All",
@@ -147,8 +352,6 @@ class NetworkAnalysis:
         end_node_label=None,
     ):
 
-        _net_gdf = self.GeoData.gdf
-
         _facility_nodes_dict = copy.deepcopy(self.destination_nodes)
         # Limit only the facility interested
         if not facility_labels == "All":
@@ -163,66 +366,49 @@ class NetworkAnalysis:
                 k: v for k, v in _facility_nodes_dict.items() if k in facility_labels
             }
 
-        # adding nodes to the graph
-        if model_flow_direction is False:
-            # creating a network
-            G = nx.Graph()
-            for index, row in _net_gdf.iterrows():
-                G.add_edge(
-                    row["start_node"], row["end_node"], weight=row[lbl_of_weight]
-                )
-        elif all([model_flow_direction, end_node_label, end_node_label]):
-            # Model directed graph
-            G = nx.DiGraph()
-            for index, row in _net_gdf.iterrows():
-                G.add_edge(
-                    row[start_node_label],
-                    row[end_node_label],
-                    weight=row[lbl_of_weight],
-                )
+        # The network is built once in fit; every facility reuses it
+        graph = self._get_graph(
+            lbl_of_weight=lbl_of_weight,
+            model_flow_direction=model_flow_direction,
+            start_node_label=start_node_label,
+            end_node_label=end_node_label,
+        )
+        adjacency = graph.adjacency()
 
-        # Loop through each facility
+        # Loop through each facility, one multi-source pass per facility
         for facility, nodes in _facility_nodes_dict.items():
-            # Create a new deep copy of the network which contains all nodes
-            # This is done not to disturb the original node. The 'aux_node' depends on the facility
-            _g = copy.deepcopy(G)
-            # For each facility perform the analysis
-            _g.add_node("aux_node")
-            # Loop through nodes and add them to the master node
-            for items in nodes:
-                try:
-                    _g.add_edge(items, "aux_node", weight=0)
-                except:  # sometimes point of intersts like hosp locations may be flooded
-                    pass
-            # Add a column to save results
-            self.node_results[f"Initial_dist_{facility}"] = None
-
-            for index, row in self.node_results.iterrows():
-                lenVal = inaccessibility_code  # float("inf")
-                try:
-                    lenVal = nx.shortest_path_length(
-                        _g, source=row["nodes"], target="aux_node", weight="weight"
-                    )
-                except nx.NetworkXNoPath:
-                    lenVal = inaccessibility_code  # float("inf")
-                except:
-                    lenVal = inaccessibility_code  # float("inf") # error code for nodes not present in the mofified network. Flooded nodes
-
-                row[f"Initial_dist_{facility}"] = lenVal
+            self.node_results[
+                f"Initial_dist_{facility}"
+            ] = distance_to_nearest_facility(
+                adjacency,
+                facility_nodes=nodes,
+                directed=graph.directed,
+                inaccessibility_code=inaccessibility_code,
+            )
 
         # Save the dataframe as a) geodataframe and b) as dataframe
         self.gdf_results = self._df_to_gdf(self.node_results)
         return self.node_results
 
     def _df_to_gdf(self, df_results):
-        # Converting panda dataframe into geometry
-        geometry = [Point(xy) for xy in df_results.nodes]
+        # Converting panda dataframe into geometry; rows follow the node ids
+        geometry = gpd.points_from_xy(self.node_coords[:, 0], self.node_coords[:, 1])
         return gpd.GeoDataFrame(df_results, crs=self.crs, geometry=geometry)
 
-    def batch_extract_raster(self, list_of_raster_path, buffer=10):
+    def batch_extract_raster(
+        self,
+        list_of_raster_path,
+        buffer=10,
+        method="zonal_stats",
+        index_cache_folder=None,
+    ):
         # Generate a line file from self.geoData.gdf
         self.GeoData.batch_estimate_raster_stat(
-            list_of_raster_path=list_of_raster_path, buffer=buffer, attach_to_file=True
+            list_of_raster_path=list_of_raster_path,
+            buffer=buffer,
+            attach_to_file=True,
+            method=method,
+            index_cache_folder=index_cache_folder,
         )
         # Store raster paths
         facility_labels = (
@@ -245,8 +431,14 @@ class NetworkAnalysis:
         model_flow_direction=False,
         start_node_label=None,
         end_node_label=None,
+        incremental=False,
+        max_change_ratio=0.05,
     ):
-
+        """
+        Distance from every node to each facility for each flood scenario. With incremental=True, scenarios analysed
+        in an earlier run (self.scenario_state) are updated for the links that changed flood state, unless more than
+        max_change_ratio of the links changed.
+        """
         # Provide list of scenario to work on
         if scenaio_field_in_df is None:
             scenaio_field_in_df = self.list_scenarios
@@ -266,26 +458,53 @@ class NetworkAnalysis:
                 k: v for k, v in _facility_nodes_dict.items() if k in facility_labels
             }
 
-        # Create a partial function for passing buffer and making the process concurrent
-        func_ = partial(
-            self._scenario_analysis,
-            link_removal_threshold=link_removal_threshold,
+        # The graph is shared by all scenarios; each scenario is a mask over its links
+        graph = self._get_graph(
             lbl_of_weight=lbl_of_weight,
-            inaccessibilityCode=inaccessibilityCode,
+            model_flow_direction=model_flow_direction,
+            start_node_label=start_node_label,
+            end_node_label=end_node_label,
         )
+        scenario_masks = self.get_scenario_masks(
+            scenaio_field_in_df=scenaio_field_in_df,
+            link_removal_threshold=link_removal_threshold,
+        )
+        facility_nodes = {
+            facility: list(nodes) for facility, nodes in _facility_nodes_dict.items()
+        }
+
+        # State of the previous run of each scenario
+        previous_states = [
+            self.scenario_state.get(label) if incremental else None
+            for label in scenario_masks
+        ]
 
-        # func_((scenaio_field_in_df[0], list(_facility_nodes_dict.keys())[0]))
         with get_reusable_executor() as executor:
-            results = list(
+            outputs = list(
                 tqdm(
                     executor.map(
-                        func_, product(scenaio_field_in_df, _facility_nodes_dict)
+                        masked_distances,
+                        repeat(graph),
+                        scenario_masks.values(),
+                        repeat(facility_nodes),
+                        repeat(inaccessibilityCode),
+                        previous_states,
+                        repeat(max_change_ratio),
                     ),
-                    total=len(scenaio_field_in_df * len(_facility_nodes_dict)),
+                    total=len(scenario_masks),
                     desc="Performing scenario analysis",
                 )
             )
 
+        # Labels of the analysed scenarios, used to estimate the CL ratio
+        self.scenario_labels = list(scenario_masks.keys())
+        results = []
+        for sce, (_distances, state) in zip(self.scenario_labels, outputs):
+            self.scenario_state[sce] = state
+            results.extend(
+                pd.Series(distance, name=f"{sce}_{facility}")
+                for facility, distance in _distances.items()
+            )
         combined_df = pd.concat(results, axis=1)
 
         # If attached is true
@@ -304,6 +523,33 @@ class NetworkAnalysis:
 
         return combined_df
 
+    def get_scenario_masks(self, scenaio_field_in_df=None, link_removal_threshold=0.6):
+        """
+        Express flood scenarios as boolean masks over the links of the base graph, True for open links.
+        :param scenaio_field_in_df: Label of the water depth fields in the database
+        :param link_removal_threshold: Wading height, or a list of wading heights, unit same as CRS
+        :return: {scenario label: mask}; the label is the field name, suffixed with the wading height if more than
+        one wading height is given
+        """
+        if scenaio_field_in_df is None:
+            scenaio_field_in_df = self.list_scenarios
+        if not isinstance(scenaio_field_in_df, list):
+            scenaio_field_in_df = [scenaio_field_in_df]
+
+        thresholds = (
+            list(link_removal_threshold)
+            if isinstance(link_removal_threshold, (list, tuple))
+            else [link_removal_threshold]
+        )
+
+        masks = {}
+        for sce in scenaio_field_in_df:
+            link_depth = self.GeoData.gdf[sce].to_numpy(dtype=float)
+            for threshold in thresholds:
+                label = sce if len(thresholds) == 1 else f"{sce}_{threshold}"
+                masks[label] = flood_mask(link_depth, threshold)
+        return masks
+
     def batch_identify_flooded_road_from_roadway_elevation(
         self,
         string_for_shortlisting_scenario=None,
@@ -313,22 +559,20 @@ class NetworkAnalysis:
         factor_link_elevation_data=3.28084,
     ):
 
+        scenarios = self.list_scenarios
         if string_for_shortlisting_scenario:
             scenarios = [
-                sce
-                for sce in self.list_scenarios
-                if string_for_shortlisting_scenario in sce
+                sce for sce in scenarios if string_for_shortlisting_scenario in sce
             ]
 
-        for sce in tqdm(scenarios):
-            self.identify_flooded_roads_elevation(
-                sce,
-                wading_height=wading_height,
-                new_field_label=None,
-                col_name_for_elevation_in_network=col_name_for_elevation_in_network,
-                suffix=suffix,
-                factor_link_elevation_data=factor_link_elevation_data,
-            )
+        return self.identify_flooded_roads_elevation(
+            scenarios,
+            wading_height=wading_height,
+            new_field_label=None,
+            col_name_for_elevation_in_network=col_name_for_elevation_in_network,
+            suffix=suffix,
+            factor_link_elevation_data=factor_link_elevation_data,
+        )
 
     def batch_identify_flooded_road(
         self,
@@ -338,17 +582,15 @@ class NetworkAnalysis:
         factor_link_elevation_data=3.28084,
     ):
 
+        scenarios = self.list_scenarios
         if string_for_shortlisting_scenario:
             scenarios = [
-                sce
-                for sce in self.list_scenarios
-                if string_for_shortlisting_scenario in sce
+                sce for sce in scenarios if string_for_shortlisting_scenario in sce
             ]
 
-        for sce in tqdm(scenarios):
-            self.identify_flooded_roads(
-                sce, wading_height=wading_height, new_field_label=None, suffix=suffix
-            )
+        return self.identify_flooded_roads(
+            scenarios, wading_height=wading_height, new_field_label=None, suffix=suffix
+        )
 
     def identify_flooded_roads_elevation(
         self,
@@ -358,40 +600,38 @@ class NetworkAnalysis:
         suffix=None,
         col_name_for_elevation_in_network="max_elev",
         factor_link_elevation_data=1,
+        encode_no_data_as=None,
     ):
         """
-        Identify flooded roads using wading height. If the water depht is greater than the wading height the road
-        is considered flooded
-        :param scenaio_field_in_df: Label of field in the database
+        Identify flooded roads using wading height. If the water surface elevation minus the road elevation is greater
+        than the wading height the road is considered flooded
+        :param scenaio_field_in_df: Label of field in the database, or a list of labels
         :type scenaio_field_in_df:
-        :param wading_height: Wading height, unit same as CRS
+        :param wading_height: Wading height or list of wading heights, unit same as CRS
         :type wading_height: float
-        :return: None
-        :rtype:
+        :param encode_no_data_as: Code for links without data; None leaves them empty
+        :return: Flag matrix, one column per scenario and wading height
+        :rtype: np.ndarray
         """
-        if new_field_label is None:
-            new_field_label = f"{scenaio_field_in_df}_{wading_height}"
+        if not isinstance(scenaio_field_in_df, list):
+            scenaio_field_in_df = [scenaio_field_in_df]
 
-        if suffix:
-            new_field_label = f"{new_field_label}_{suffix}"
-
-        self.GeoData.gdf[new_field_label] = None
-
-        for index, row in self.GeoData.gdf.iterrows():
-            if np.isfinite(
-                row[scenaio_field_in_df]
-            ):  # <-- If data is available for that link
-                # Estimate elevation, +ve for flooded case
-                _elev_diff = (
-                    row[scenaio_field_in_df]
-                    - row[col_name_for_elevation_in_network]
-                    * factor_link_elevation_data
-                )
-                # Tag roads
-                if _elev_diff >= wading_height:
-                    self.GeoData.gdf.at[index, new_field_label] = 1  # <-- Flooded tag
-                elif _elev_diff < wading_height:
-                    self.GeoData.gdf.at[index, new_field_label] = 0  # <-- No flood tag
+        # Estimate elevation, +ve for flooded case
+        _elev_diff = (
+            self.GeoData.gdf[scenaio_field_in_df].to_numpy(dtype=float)
+            - self.GeoData.gdf[[col_name_for_elevation_in_network]].to_numpy(
+                dtype=float
+            )
+            * factor_link_elevation_data
+        )
+        return self._tag_flooded_roads(
+            _elev_diff,
+            scenaio_field_in_df,
+            wading_height=wading_height,
+            new_field_label=new_field_label,
+            suffix=suffix,
+            encode_no_data_as=encode_no_data_as,
+        )
 
     def identify_flooded_roads(
         self,
@@ -404,12 +644,13 @@ class NetworkAnalysis:
         """
         Identify flooded roads using wading height. If the water depht is greater than the wading height the road
         is considered flooded
-        :param scenaio_field_in_df: Label of field in the database
+        :param scenaio_field_in_df: Label of field in the database, or a list of labels
         :type scenaio_field_in_df:
-        :param wading_height: Wading height, unit same as CRS
+        :param wading_height: Wading height or list of wading heights, unit same as CRS
         :type wading_height: float
-        :return: None
-        :rtype:
+        :param encode_no_data_as: Code for links without data; None leaves them empty
+        :return: Flag matrix, one column per scenario and wading height
+        :rtype: np.ndarray
         """
         if scenaio_field_in_df is None:
             scenaio_field_in_df = self.list_scenarios
@@ -417,88 +658,59 @@ class NetworkAnalysis:
         if not isinstance(scenaio_field_in_df, list):
             scenaio_field_in_df = [scenaio_field_in_df]
 
-        if new_field_label is None:
-            new_field_label = [f"{x}_{wading_height}" for x in scenaio_field_in_df]
-
-        if suffix:
-            new_field_label = [f"{x}_{suffix}" for x in new_field_label]
-
-        for _scenaio_field_in_df, _label in zip(scenaio_field_in_df, new_field_label):
-
-            self.GeoData.gdf[_label] = encode_no_data_as
-
-            for index, row in self.GeoData.gdf.iterrows():
-                if np.isfinite(
-                    row[_scenaio_field_in_df]
-                ):  # <-- If data is available for that link
-                    if row[_scenaio_field_in_df] >= wading_height:
-                        self.GeoData.gdf.at[index, _label] = 1  # <-- Flooded tag
-                    elif row[_scenaio_field_in_df] < wading_height:
-                        self.GeoData.gdf.at[index, _label] = 0  # <-- No flood tag
+        return self._tag_flooded_roads(
+            self.GeoData.gdf[scenaio_field_in_df].to_numpy(dtype=float),
+            scenaio_field_in_df,
+            wading_height=wading_height,
+            new_field_label=new_field_label,
+            suffix=suffix,
+            encode_no_data_as=encode_no_data_as,
+        )
 
-    def _scenario_analysis(
+    def _tag_flooded_roads(
         self,
-        parms,
-        link_removal_threshold,
-        lbl_of_weight,
-        inaccessibilityCode,
-        model_flow_direction=False,
-        start_node_label=None,
-        end_node_label=None,
+        depth,
+        scenaio_field_in_df,
+        wading_height,
+        new_field_label=None,
+        suffix=None,
+        encode_no_data_as=None,
     ):
+        """Write one int8 flag column per scenario and wading height to the network"""
+        wading_heights = (
+            list(wading_height)
+            if isinstance(wading_height, (list, tuple))
+            else [wading_height]
+        )
 
-        scenaio_field_in_df, facility_node_list = parms
-        # creating a network
-        G = nx.Graph()
-        # Bring in the network
-        gdf_network = copy.deepcopy(self.GeoData.gdf)
-        df_results = copy.deepcopy(self.node_results)
-        # adding only the unaffected nodes to the graph
-
-        for index, row in gdf_network.iterrows():
-            # analyze only if the condition is satisfied
-            if not (row[scenaio_field_in_df] > link_removal_threshold):
-                G.add_edge(
-                    row["start_node"], row["end_node"], weight=row[lbl_of_weight]
-                )
+        if new_field_label is None:
+            new_field_label = [
+                f"{x}_{height}"
+                for x in scenaio_field_in_df
+                for height in wading_heights
+            ]
+        if not isinstance(new_field_label, list):
+            new_field_label = [new_field_label]
 
-        # Getting information on the nearest road node for each critical facility
-        nodesOfInterest = self.destination_nodes[
-            facility_node_list
-        ]  # <--Get nodes for the facility
-
-        # adding auxillary nodes
-        for items in nodesOfInterest:
-            try:
-                G.add_edge(
-                    items, "aux_node", weight=0
-                )  # sometimes point of interests like hosp locs. may be flooded
-            except:
-                pass
-
-        # Initilize the field
-        new_field_name = f"{scenaio_field_in_df}_{facility_node_list}"
-        df_results[new_field_name] = None
-
-        for index, row in df_results.iterrows():
-            lenVal = inaccessibilityCode  # float("inf")
-            try:
-                lenVal = nx.shortest_path_length(
-                    G, source=row["nodes"], target="aux_node", weight="weight"
-                )
-            except nx.NetworkXNoPath:
-                lenVal = inaccessibilityCode  # float("inf")
-            except:
-                lenVal = inaccessibilityCode  # float("inf") # error code for nodes not present in the mofified network. Flooded nodes
+        if suffix:
+            new_field_label = [f"{x}_{suffix}" for x in new_field_label]
 
-            df_results.at[index, new_field_name] = lenVal
+        flags = classify_flooded_links(
+            depth,
+            wading_heights,
+            encode_no_data_as=-1 if encode_no_data_as is None else encode_no_data_as,
+        )
+        for count, _label in enumerate(new_field_label):
+            self.GeoData.gdf[_label] = flags_to_column(
+                flags[:, count], encode_no_data_as=encode_no_data_as
+            )
 
-        return df_results[new_field_name]
+        return flags
 
     def estimate_CL_ratio(self):
         list_facilities = list(self.destination_nodes.keys())
         for facility in list_facilities:
-            for scenario in self.list_scenarios:
+            for scenario in self.scenario_labels:
                 self.node_results[f"CL_{facility}_{scenario}"] = 1 - (
                     (self.node_results[f"Initial_dist_{facility}"] + 1e-15)
                     / (self.node_results[f"{scenario}_{facility}"] + 1e-15)
@@ -0,0 +1,300 @@
+"""Distance engine for network analysis
+Details
+-------
+Computes the distance from every node of the road network to the nearest node of a facility using a single
+multi-source shortest path pass, instead of one Dijkstra run per node. When only a few links change flood state
+between runs, the shortest path tree of the previous run is updated instead of being recomputed.
+
+"""
+from heapq import heapify, heappop, heappush
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+from modules.network_utils.road_graph import RoadGraph
+
+
+# Predecessor of the facility nodes and of the unreachable nodes, as in scipy.sparse.csgraph
+NO_PREDECESSOR = -9999
+
+
+def shortest_path_tree(
+    adjacency: csr_matrix, facility_nodes, directed: bool = False
+) -> tuple:
+    """
+    Shortest path tree from the facility nodes, estimated in one multi-source shortest path pass. For directed
+    graphs the pass runs on the reversed graph so that the distance is measured from the node to the facility.
+    :param adjacency: Adjacency matrix of the network (see RoadGraph.adjacency)
+    :type adjacency: csr_matrix
+    :param facility_nodes: Indexes of the nodes closest to each facility
+    :type facility_nodes: iterable
+    :param directed: Whether the adjacency matrix is directed
+    :type directed: bool
+    :return: Distance per node (inf if a node can not reach any facility) and the predecessor of each node in the tree
+    :rtype: tuple
+    """
+    facility_nodes = np.unique(np.asarray(list(facility_nodes), dtype=np.int64))
+
+    distance = np.full(adjacency.shape[0], np.inf)
+    predecessor = np.full(adjacency.shape[0], NO_PREDECESSOR, dtype=np.int32)
+    if len(facility_nodes) > 0:
+        # Reverse the graph so that the search runs from the facilities to the nodes
+        _graph = adjacency.T.tocsr() if directed else adjacency
+        distance, predecessor, _ = dijkstra(
+            _graph,
+            directed=directed,
+            indices=facility_nodes,
+            min_only=True,
+            return_predecessors=True,
+        )
+    return distance, predecessor.astype(np.int32)
+
+
+def distance_to_nearest_facility(
+    adjacency: csr_matrix,
+    facility_nodes,
+    directed: bool = False,
+    inaccessibility_code: float = 999,
+) -> np.ndarray:
+    """
+    Distance from every node to the nearest facility node, estimated in one multi-source shortest path pass.
+    :param adjacency: Adjacency matrix of the network (see RoadGraph.adjacency)
+    :type adjacency: csr_matrix
+    :param facility_nodes: Indexes of the nodes closest to each facility
+    :type facility_nodes: iterable
+    :param directed: Whether the adjacency matrix is directed
+    :type directed: bool
+    :param inaccessibility_code: Value assigned to nodes that can not reach any facility
+    :type inaccessibility_code: float
+    :return: Distance per node
+    :rtype: np.ndarray
+    """
+    distance, _ = shortest_path_tree(adjacency, facility_nodes, directed=directed)
+    return encode_inaccessible(distance, inaccessibility_code)
+
+
+def encode_inaccessible(
+    distance: np.ndarray, inaccessibility_code: float
+) -> np.ndarray:
+    """Replace the distance of nodes that can not reach any facility with the inaccessibility code"""
+    return np.where(np.isfinite(distance), distance, inaccessibility_code)
+
+
+def update_shortest_path_tree(
+    graph: RoadGraph,
+    old_keep: np.ndarray,
+    new_keep: np.ndarray,
+    distance: np.ndarray,
+    predecessor: np.ndarray,
+) -> tuple:
+    """
+    Update a shortest path tree after some links were flooded or reopened. Only the nodes whose path used a newly
+    flooded link, and the nodes that get closer through a reopened link, are visited.
+    :param graph: Road network
+    :type graph: RoadGraph
+    :param old_keep: Open links of the scenario the tree was computed for
+    :type old_keep: np.ndarray
+    :param new_keep: Open links of the new scenario
+    :type new_keep: np.ndarray
+    :param distance: Distance per node from shortest_path_tree (inf for unreachable nodes)
+    :type distance: np.ndarray
+    :param predecessor: Predecessor per node from shortest_path_tree
+    :type predecessor: np.ndarray
+    :return: Updated distance and predecessor arrays, and the number of nodes that were visited
+    :rtype: tuple
+    """
+    search_graph = graph.search_graph
+    old_keep = np.asarray(old_keep, dtype=bool)
+    new_keep = np.asarray(new_keep, dtype=bool)
+    distance = np.array(distance, dtype=np.float64)
+    predecessor = np.array(predecessor, dtype=np.int32)
+
+    # Entries of the adjacency, in the direction of the search
+    rows, cols, edge_ids = (
+        search_graph._entry_row,
+        search_graph.indices,
+        search_graph.edge_ids,
+    )
+
+    # Nodes whose path to the facility used a flooded link, and all nodes downstream of them in the tree
+    removed = (old_keep & ~new_keep)[edge_ids]
+    roots = cols[removed][predecessor[cols[removed]] == rows[removed]]
+    affected = _subtree(predecessor, roots)
+    distance[affected] = np.inf
+    predecessor[affected] = NO_PREDECESSOR
+
+    # Seeds: open links entering an affected node from the rest of the tree, and reopened links
+    added = (~old_keep & new_keep)[edge_ids]
+    seed = (
+        new_keep[edge_ids]
+        & ((affected[cols] & ~affected[rows]) | added)
+        & np.isfinite(distance[rows])
+    )
+    seed_distance = distance[rows[seed]] + search_graph.edge_length[edge_ids[seed]]
+
+    visited = _relax(
+        search_graph,
+        new_keep,
+        distance,
+        predecessor,
+        seed_nodes=cols[seed],
+        seed_distance=seed_distance,
+        seed_predecessor=rows[seed],
+    )
+    return distance, predecessor, int(affected.sum()) + visited
+
+
+def _subtree(predecessor: np.ndarray, roots: np.ndarray) -> np.ndarray:
+    """Boolean mask of the roots and all their descendants in the shortest path tree"""
+    n_nodes = len(predecessor)
+    affected = np.zeros(n_nodes, dtype=bool)
+    if len(roots) == 0:
+        return affected
+
+    # Children of each node, as a CSR structure
+    has_parent = np.flatnonzero(predecessor >= 0)
+    children = has_parent[np.argsort(predecessor[has_parent], kind="stable")]
+    children_ptr = np.zeros(n_nodes + 1, dtype=np.int64)
+    np.cumsum(
+        np.bincount(predecessor[has_parent], minlength=n_nodes), out=children_ptr[1:]
+    )
+
+    stack = list(np.unique(roots))
+    while stack:
+        node = stack.pop()
+        if affected[node]:
+            continue
+        affected[node] = True
+        stack.extend(children[children_ptr[node] : children_ptr[node + 1]])
+    return affected
+
+
+def _relax(
+    search_graph: RoadGraph,
+    keep: np.ndarray,
+    distance: np.ndarray,
+    predecessor: np.ndarray,
+    seed_nodes: np.ndarray,
+    seed_distance: np.ndarray,
+    seed_predecessor: np.ndarray,
+) -> int:
+    """Dijkstra from the seeds, only following improvements; distance and predecessor are updated in place"""
+    indptr, indices, edge_ids, length = (
+        search_graph.indptr,
+        search_graph.indices,
+        search_graph.edge_ids,
+        search_graph.edge_length,
+    )
+
+    heap = []
+    for node, dist, pred in zip(
+        seed_nodes.tolist(), seed_distance.tolist(), seed_predecessor.tolist()
+    ):
+        if dist < distance[node]:
+            distance[node] = dist
+            predecessor[node] = pred
+            heap.append((dist, node))
+    heapify(heap)
+
+    visited = 0
+    while heap:
+        dist, node = heappop(heap)
+        if dist > distance[node]:
+            continue
+        visited += 1
+        for k in range(indptr[node], indptr[node + 1]):
+            edge = edge_ids[k]
+            if not keep[edge]:
+                continue
+            neighbour = indices[k]
+            new_dist = dist + length[edge]
+            if new_dist < distance[neighbour]:
+                distance[neighbour] = new_dist
+                predecessor[neighbour] = node
+                heappush(heap, (new_dist, neighbour))
+    return visited
+
+
+def flood_mask(link_depth, link_removal_threshold: float) -> np.ndarray:
+    """
+    Boolean mask of the links that stay open for a flood scenario. Links without flood data are kept.
+    :param link_depth: Water depth over each link
+    :type link_depth: np.ndarray
+    :param link_removal_threshold: Links with depth greater than this value are removed
+    :type link_removal_threshold: float
+    :return: True for open links
+    :rtype: np.ndarray
+    """
+    return ~(np.asarray(link_depth, dtype=np.float64) > link_removal_threshold)
+
+
+def masked_distances(
+    graph: RoadGraph,
+    keep: np.ndarray,
+    facility_nodes: dict,
+    inaccessibility_code: float = 1e5,
+    previous_state: dict = None,
+    max_change_ratio: float = 0.05,
+) -> tuple:
+    """
+    Distance to the nearest facility for a scenario given as a mask over the links of the base graph. The adjacency
+    is built once per mask and shared by all facilities. If the state of a previous run is given and the share of
+    links that changed flood state is at most max_change_ratio, the previous shortest path trees are updated instead
+    of recomputed. Only arrays are passed, so this is cheap to run in a worker process.
+    :param graph: Road network
+    :type graph: RoadGraph
+    :param keep: Boolean mask, True for links that are open in this scenario
+    :type keep: np.ndarray
+    :param facility_nodes: Node ids of each facility, {facility label: node ids}
+    :type facility_nodes: dict
+    :param inaccessibility_code: Value assigned to nodes that can not reach any facility
+    :type inaccessibility_code: float
+    :param previous_state: State returned by the previous run of this scenario
+    :type previous_state: dict
+    :param max_change_ratio: Largest share of changed links for which the trees are updated
+    :type max_change_ratio: float
+    :return: Distance per node for each facility ({facility label: distances}) and the state of this run
+    :rtype: tuple
+    """
+    keep = np.asarray(keep, dtype=bool)
+    facility_nodes = {
+        facility: np.unique(np.asarray(list(nodes), dtype=np.int64))
+        for facility, nodes in facility_nodes.items()
+    }
+
+    incremental = previous_state is not None and previous_state["graph"] == (
+        graph.fingerprint
+    )
+    if incremental:
+        change_ratio = np.count_nonzero(previous_state["keep"] != keep) / max(
+            graph.n_edges, 1
+        )
+        incremental = change_ratio <= max_change_ratio
+
+    adjacency = None
+    trees = {}
+    for facility, nodes in facility_nodes.items():
+        previous_tree = previous_state["trees"].get(facility) if incremental else None
+        if previous_tree is not None and np.array_equal(previous_tree[0], nodes):
+            distance, predecessor, _ = update_shortest_path_tree(
+                graph,
+                old_keep=previous_state["keep"],
+                new_keep=keep,
+                distance=previous_tree[1],
+                predecessor=previous_tree[2],
+            )
+        else:
+            if adjacency is None:
+                adjacency = graph.adjacency(keep=keep)
+            distance, predecessor = shortest_path_tree(
+                adjacency, nodes, directed=graph.directed
+            )
+        trees[facility] = (nodes, distance, predecessor)
+
+    distances = {
+        facility: encode_inaccessible(tree[1], inaccessibility_code)
+        for facility, tree in trees.items()
+    }
+    state = {"graph": graph.fingerprint, "keep": keep, "trees": trees}
+    return distances, state
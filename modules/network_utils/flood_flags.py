@@ -0,0 +1,51 @@
+"""Flooded road classification
+Details
+-------
+Tags road links as flooded (1) or not flooded (0) by comparing the water depth over each link with one or more
+wading heights. Links without flood data get a no data code. Flags are stored as int8.
+
+"""
+import numpy as np
+import pandas as pd
+
+
+def classify_flooded_links(
+    depth, wading_heights, encode_no_data_as: int = -1
+) -> np.ndarray:
+    """
+    Flag flooded links for many scenarios and wading heights in one call
+    :param depth: Water depth over each link, shape (links,) or (links, scenarios)
+    :type depth: np.ndarray
+    :param wading_heights: Wading height or list of wading heights
+    :type wading_heights: float or list
+    :param encode_no_data_as: Code for links without (finite) flood data; must fit in int8
+    :type encode_no_data_as: int
+    :return: Flags of shape (links, scenarios x wading heights); the columns iterate over the wading heights first,
+    i.e., column s * len(wading_heights) + h is scenario s and wading height h
+    :rtype: np.ndarray
+    """
+    if not np.iinfo(np.int8).min <= encode_no_data_as <= np.iinfo(np.int8).max:
+        raise ValueError(f"No data code {encode_no_data_as} does not fit in int8")
+
+    depth = np.asarray(depth, dtype=np.float64)
+    depth = depth.reshape(depth.shape[0], -1)
+    wading_heights = np.atleast_1d(np.asarray(wading_heights, dtype=np.float64))
+
+    # (links, scenarios, wading heights)
+    flags = (depth[:, :, None] >= wading_heights[None, None, :]).astype(np.int8)
+    flags[~np.isfinite(depth)] = encode_no_data_as
+    return flags.reshape(depth.shape[0], -1)
+
+
+def flags_to_column(flags: np.ndarray, encode_no_data_as=None):
+    """
+    Column values for a vector of flags from classify_flooded_links
+    :param flags: Flags of one scenario and wading height
+    :param encode_no_data_as: If None, links without data become missing values (nullable Int8), else flags are
+    returned as int8 with this code for links without data
+    :return: np.ndarray or pd.arrays.IntegerArray
+    """
+    if encode_no_data_as is not None:
+        return flags
+    # Flags were computed with -1 for no data
+    return pd.arrays.IntegerArray(np.maximum(flags, 0), mask=flags < 0)
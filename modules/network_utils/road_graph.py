@@ -0,0 +1,127 @@
+"""Compact representation of the road network
+Details
+-------
+Integer indexed, array backed graph built once from the road links. Nodes are rows of a coordinate array and links
+are stored as source/target/length arrays together with a CSR adjacency, so the graph is cheap to keep in memory and
+to ship to worker processes.
+
+"""
+import hashlib
+from functools import cached_property
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.spatial import cKDTree
+
+
+class RoadGraph:
+    """Integer indexed road network"""
+
+    def __init__(
+        self, node_coords, edge_source, edge_target, edge_length, directed=False
+    ):
+        # Coordinates of each node; the row number is the node id
+        self.node_coords = np.asarray(node_coords, dtype=np.float64).reshape(-1, 2)
+        # Link arrays, one entry per road link in the order of the road geodataframe
+        self.edge_source = np.asarray(edge_source, dtype=np.int32)
+        self.edge_target = np.asarray(edge_target, dtype=np.int32)
+        self.edge_length = np.asarray(edge_length, dtype=np.float64)
+        self.directed = directed
+        # Build the adjacency
+        self._build_csr()
+
+    @property
+    def n_nodes(self) -> int:
+        return self.node_coords.shape[0]
+
+    @property
+    def n_edges(self) -> int:
+        return self.edge_source.shape[0]
+
+    @cached_property
+    def fingerprint(self) -> str:
+        """Hash of the graph arrays; identifies the graph across runs"""
+        digest = hashlib.sha1(str(self.directed).encode())
+        for array in (
+            self.node_coords,
+            self.edge_source,
+            self.edge_target,
+            self.edge_length,
+        ):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+    @cached_property
+    def node_tree(self) -> cKDTree:
+        """Spatial index over the node coordinates"""
+        return cKDTree(self.node_coords)
+
+    def nearest_nodes(self, xy) -> tuple:
+        """
+        Nearest node for each point, in one vectorized query
+        :param xy: Coordinates of the points, shape (n, 2)
+        :return: Node id and distance (in the units of the crs) for each point
+        """
+        distance, node = self.node_tree.query(np.asarray(xy, dtype=np.float64))
+        return node.astype(np.int64), distance
+
+    def __getstate__(self):
+        # The spatial index is cheap to rebuild; do not ship it to worker processes
+        state = self.__dict__.copy()
+        state.pop("node_tree", None)
+        return state
+
+    @cached_property
+    def search_graph(self) -> "RoadGraph":
+        """Graph traversed when searching from the facilities to the nodes, i.e., the reversed graph if directed"""
+        if not self.directed:
+            return self
+        return RoadGraph(
+            node_coords=self.node_coords,
+            edge_source=self.edge_target,
+            edge_target=self.edge_source,
+            edge_length=self.edge_length,
+            directed=True,
+        )
+
+    def _build_csr(self) -> None:
+        """CSR adjacency; entry k of row i links node i to node indices[k] through link edge_ids[k]"""
+        edge_ids = np.arange(self.n_edges, dtype=np.int32)
+        source, target = self.edge_source, self.edge_target
+        if not self.directed:
+            source, target, edge_ids = (
+                np.concatenate([source, target]),
+                np.concatenate([target, source]),
+                np.concatenate([edge_ids, edge_ids]),
+            )
+        # Sort by node, then neighbour, then length so that the shortest parallel link comes first
+        order = np.lexsort((self.edge_length[edge_ids], target, source))
+        self.indptr = np.zeros(self.n_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(source, minlength=self.n_nodes), out=self.indptr[1:])
+        self.indices = target[order]
+        self.edge_ids = edge_ids[order]
+        self._entry_row = source[order]
+
+    def adjacency(self, keep=None) -> csr_matrix:
+        """
+        Weighted adjacency matrix for shortest path analysis
+        :param keep: Optional boolean array with one value per link, only True links are included
+        :return: csr_matrix; parallel links collapse to the shortest one
+        """
+        if keep is None:
+            select = slice(None)
+        else:
+            select = np.asarray(keep, dtype=bool)[self.edge_ids]
+        rows, cols, edge_ids = (
+            self._entry_row[select],
+            self.indices[select],
+            self.edge_ids[select],
+        )
+        # Entries are sorted, the first of each (row, col) pair is the shortest link
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+        # Explicit zeros are kept as edges by scipy.sparse.csgraph
+        return csr_matrix(
+            (self.edge_length[edge_ids[first]], (rows[first], cols[first])),
+            shape=(self.n_nodes, self.n_nodes),
+        )
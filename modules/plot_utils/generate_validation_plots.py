@@ -230,8 +230,9 @@ def rainfall_distribution(df_time_series, config):
     x = list(df_time_series.columns)
     # Now convert the columns to time
     # string_to_date_time_central = lambda st: utc_datetime_to_cst(datetime.strptime(st[-18:-4], '%Y%m%d%H%M%S'))
+    # Columns are the UTC time of each time step
     string_to_date_time_central_cst = lambda st: utc_datetime_to_cst(
-        datetime.strptime(st[-14:], "%Y%m%d%H%M%S")
+        pd.Timestamp(st).to_pydatetime()
     ).strftime("%Y:%m:%d:%H:%M")
     # x = [string_to_date_time_central_cst(item) for item in x]
     # y = df_time_series.sum(axis=0)
@@ -1,9 +1,190 @@
 import subprocess
 import os
+import json
+import logging
+import mimetypes
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import PIPE
 from subprocess import Popen, PIPE
 from datetime import datetime
 
+from modules.file_management.file_processing import hash_files, atomic_write
+
+log = logging.getLogger(__name__)
+
 
 def sync_aws(config):
     os.system(config.publish.command_to_publish_the_map_to_aws)
+
+
+class LocalDirectoryBackend:
+    """Storage backend that copies the objects to a local folder; useful for testing"""
+
+    def __init__(self, folder: str):
+        self.folder = folder
+
+    def upload(self, local_path: str, key: str) -> None:
+        destination = os.path.join(self.folder, *key.split("/"))
+        with open(local_path, "rb") as source, atomic_write(destination) as file:
+            shutil.copyfileobj(source, file)
+
+    def delete(self, key: str) -> None:
+        destination = os.path.join(self.folder, *key.split("/"))
+        if os.path.isfile(destination):
+            os.remove(destination)
+
+
+class S3Backend:
+    """Storage backend for an S3 bucket; needs boto3"""
+
+    def __init__(self, bucket: str, prefix: str = ""):
+        import boto3
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = boto3.client("s3")
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def upload(self, local_path: str, key: str) -> None:
+        content_type = mimetypes.guess_type(local_path)[0] or "binary/octet-stream"
+        self.client.upload_file(
+            local_path,
+            self.bucket,
+            self._key(key),
+            ExtraArgs={"ContentType": content_type},
+        )
+
+    def delete(self, key: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+
+
+class DeltaPublisher:
+    """
+    Publishes website artifacts, uploading only the files whose content changed since they were last published.
+    The content hash of every published object is kept in a state file, so the state survives restarts.
+    """
+
+    def __init__(
+        self, backend, root_folder: str, path_state: str, max_workers: int = 8
+    ):
+        # Storage backend with upload(local_path, key) and delete(key)
+        self.backend = backend
+        # Object keys are the paths relative to this folder
+        self.root_folder = root_folder
+        self.path_state = path_state
+        self.max_workers = max_workers
+        self.state = {}
+        if os.path.isfile(path_state):
+            with open(path_state) as file:
+                self.state = json.load(file)
+
+    def publish(self, list_of_paths: list) -> list:
+        """
+        Upload the changed files among the given files and folders. Objects of a given folder that no longer exist
+        locally are deleted. Can be called several times per run, to publish results as soon as they are ready.
+        :param list_of_paths: Files or folders inside the root folder
+        :type list_of_paths: list
+        :return: Report per object {key, status, bytes, seconds}; status is uploaded, deleted, unchanged or failed
+        :rtype: list
+        """
+        files, removed = {}, []
+        for path in list_of_paths:
+            if os.path.isdir(path):
+                for root, _, names in os.walk(path):
+                    for name in names:
+                        files[self._key(os.path.join(root, name))] = os.path.join(
+                            root, name
+                        )
+                prefix = self._key(path) + "/"
+                removed.extend(
+                    key
+                    for key in self.state
+                    if key.startswith(prefix) and key not in files
+                )
+            elif os.path.isfile(path):
+                files[self._key(path)] = path
+            else:
+                log.warning(f"Nothing to publish at {path}")
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            reports = list(executor.map(self._upload, files.keys(), files.values()))
+            reports += list(executor.map(self._delete, removed))
+
+        # Store the state after every call, so that partial publishing is not repeated
+        for report in reports:
+            if report["status"] == "uploaded":
+                self.state[report["key"]] = report["hash"]
+            elif report["status"] == "deleted":
+                self.state.pop(report["key"], None)
+        self._save_state()
+
+        for report in reports:
+            if report["status"] in ("uploaded", "deleted", "failed"):
+                log.info(
+                    f"Publish {report['status']}: {report['key']} "
+                    f"({report['bytes']} bytes, {report['seconds'] * 1000:.0f} ms)"
+                )
+        uploaded = [x for x in reports if x["status"] == "uploaded"]
+        log.info(
+            f"Published {len(uploaded)} of {len(files)} objects "
+            f"({sum(x['bytes'] for x in uploaded)} bytes), deleted {len(removed)}"
+        )
+        return reports
+
+    def _key(self, path: str) -> str:
+        """Object key of a local path"""
+        return os.path.relpath(path, self.root_folder).replace(os.sep, "/")
+
+    def _upload(self, key: str, path: str) -> dict:
+        start = time.time()
+        report = {"key": key, "bytes": 0, "hash": None}
+        try:
+            report["hash"] = hash_files([path])
+            if self.state.get(key) == report["hash"]:
+                report["status"] = "unchanged"
+            else:
+                self.backend.upload(path, key)
+                report["status"] = "uploaded"
+                report["bytes"] = os.path.getsize(path)
+        except Exception as error:
+            log.warning(f"Unable to publish {key}: {error}")
+            report["status"] = "failed"
+        report["seconds"] = time.time() - start
+        return report
+
+    def _delete(self, key: str) -> dict:
+        start = time.time()
+        report = {"key": key, "bytes": 0, "hash": None}
+        try:
+            self.backend.delete(key)
+            report["status"] = "deleted"
+        except Exception as error:
+            log.warning(f"Unable to delete {key}: {error}")
+            report["status"] = "failed"
+        report["seconds"] = time.time() - start
+        return report
+
+    def _save_state(self) -> None:
+        with atomic_write(self.path_state, "w") as file:
+            json.dump(self.state, file)
+
+
+def create_publisher(config) -> DeltaPublisher:
+    """Delta publisher for the website, from the publish config"""
+    _delta = config.publish.delta
+    if _delta.backend == "s3":
+        backend = S3Backend(bucket=_delta.bucket, prefix=_delta.prefix)
+    elif _delta.backend == "local":
+        backend = LocalDirectoryBackend(folder=_delta.local_folder)
+    else:
+        raise ValueError(f"Unknown publish backend: {_delta.backend}")
+    return DeltaPublisher(
+        backend=backend,
+        root_folder=config.website_dir,
+        path_state=_delta.path_state,
+        max_workers=_delta.max_workers,
+    )
@@ -99,6 +99,35 @@ def sum_consecutive_rows(
     return _df_scenarios
 
 
+def sum_consecutive_time_steps(
+    values: np.ndarray,
+    number_of_steps_to_sum: int = 4,
+    length_of_the_record_to_filter: int = 1,
+) -> np.ndarray:
+    """
+    Array version of sum_consecutive_rows. Sums groups of 'number_of_steps_to_sum' consecutive time steps of the last
+    length of record x steps to sum time steps; time steps without data count as zero.
+    :param values: Rainfall (time steps x sub-basins)
+    :type values: np.ndarray
+    :param number_of_steps_to_sum: Number of time steps to add together
+    :type number_of_steps_to_sum: int
+    :param length_of_the_record_to_filter: Length of record needed
+    :type length_of_the_record_to_filter: int
+    :return: Rainfall (length of record x sub-basins)
+    :rtype: np.ndarray
+    """
+    n_steps = number_of_steps_to_sum * length_of_the_record_to_filter
+    # Ensuring that the number of records is greater than the length of record x steps to sum
+    assert len(values) >= n_steps
+    _values = np.asarray(values)[len(values) - n_steps :]
+    return np.nansum(
+        _values.reshape(
+            length_of_the_record_to_filter, number_of_steps_to_sum, -1
+        ).astype(np.float64),
+        axis=1,
+    )
+
+
 def remove_empty_files(rootdir: str) -> None:
     """
     Get a list of empty files. This is required as sometimes the CSV files for DSS creation are empty.
@@ -177,3 +206,48 @@ def get_before_and_after_indexes_for_a_list_item(list_to_filter, item_to_match):
         list_.append(list_to_filter[after_index])
 
     return list_
+
+
+def fill_missing_time_steps(
+    values: np.ndarray, present: np.ndarray, method: str = "linear"
+) -> np.ndarray:
+    """
+    Fill the time steps without radar data, for all sub-basins at once
+    :param values: Rainfall (time steps x sub-basins)
+    :type values: np.ndarray
+    :param present: True for the time steps with radar data
+    :type present: np.ndarray
+    :param method: How to fill the missing time steps (radar.radar_rainfall.handle_missing_by):
+        'linear' or 'fill_linear' interpolate in time between the nearest time steps with data, across gaps of any
+        length; gaps at the start take the first value with data.
+        'fill_X' fill with the value X, e.g., 'fill_1'.
+        'neglect' leave the missing time steps empty (NaN).
+        'stop' raise an error if a time step is missing.
+    :type method: str
+    :return: Rainfall with the missing time steps filled (a copy)
+    :rtype: np.ndarray
+    """
+    values = np.array(values, copy=True)
+    present = np.asarray(present, dtype=bool)
+    missing = np.flatnonzero(~present)
+    if len(missing) == 0 or method == "neglect":
+        return values
+    if method == "stop":
+        raise RuntimeError(f"Radar data is missing for {len(missing)} time steps")
+
+    if method in ("linear", "fill_linear"):
+        available = np.flatnonzero(present)
+        if len(available) == 0:
+            raise RuntimeError("No radar data to interpolate from")
+        # Nearest time steps with data before and after each missing time step
+        after = np.searchsorted(available, missing)
+        before = available[np.clip(after - 1, 0, len(available) - 1)]
+        after = available[np.clip(after, 0, len(available) - 1)]
+        span = np.where(after != before, after - before, 1)
+        weight = np.clip((missing - before) / span, 0, 1)[:, None]
+        values[missing] = values[before] * (1 - weight) + values[after] * weight
+    elif method[:5] == "fill_":
+        values[missing] = float(method[5:])
+    else:
+        raise ValueError(f"Unknown method to handle missing radar data: {method}")
+    return values
@@ -0,0 +1,288 @@
+"""Radar data fetcher
+Details
+-------
+Downloads radar files from the remote server over one persistent SSH connection. The connection carries a pool of
+SFTP channels, and files are downloaded concurrently, one channel per worker. Failed downloads are retried with an
+exponential backoff and resume from the bytes already received. Files are written to a temporary file and renamed
+when complete, so partial files never appear in the radar folder.
+
+The radar folder on the server is listed once per run, and the listing is reused while the folder does not change, so
+only files that exist on the server and are not on the disk are requested. Files that are not on the server are kept
+in a registry of known missing files and reported once.
+
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+log = logging.getLogger(__name__)
+
+# Suffix of files that are being downloaded
+PARTIAL_SUFFIX = ".part"
+# Bytes read from the server at a time
+_CHUNK_SIZE = 1 << 20
+
+
+class SSHSession:
+    """Persistent SSH connection to the radar server"""
+
+    def __init__(self, host_name: str, user_name: str, password: str, port: int = 22):
+        import paramiko
+
+        self._paramiko = paramiko
+        self.transport = paramiko.Transport((host_name, port))
+        self.transport.connect(username=user_name, password=password)
+        # Keep the connection alive between runs
+        self.transport.set_keepalive(30)
+
+    def open_sftp(self):
+        return self._paramiko.SFTPClient.from_transport(self.transport)
+
+    def is_active(self) -> bool:
+        return self.transport.is_active()
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class RadarFetcher:
+    """Concurrent downloads over a pool of SFTP channels of one session"""
+
+    def __init__(
+        self,
+        session_factory,
+        n_channels: int = 4,
+        max_retries: int = 3,
+        backoff_seconds: float = 1.0,
+    ):
+        # Callable returning a new session with open_sftp, is_active and close, e.g., SSHSession
+        self.session_factory = session_factory
+        self.n_channels = n_channels
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.session = None
+        # Names of expected files that were not on the server
+        self.known_missing = set()
+        self._channels = queue.Queue()
+        self._lock = threading.Lock()
+        # {remote folder: ((mtime, size) of the folder, {file name: size})}
+        self._listings = {}
+
+    def connect(self) -> None:
+        """Open the session, or reopen it if the connection was lost"""
+        with self._lock:
+            if self.session is not None and self.session.is_active():
+                return
+            self._close_channels()
+            if self.session is not None:
+                self.session.close()
+            self.session = self.session_factory()
+
+    def close(self) -> None:
+        with self._lock:
+            self._close_channels()
+            if self.session is not None:
+                self.session.close()
+                self.session = None
+
+    def list_remote(self, remote_folder: str) -> dict:
+        """
+        Size of the files in a folder on the server. The listing is reused while the mtime and size of the folder do
+        not change, which costs one stat call instead of a full listing.
+        :param remote_folder: Folder on the server
+        :type remote_folder: str
+        :return: {file name: size in bytes}
+        :rtype: dict
+        """
+        self.connect()
+        channel = self._borrow_channel()
+        try:
+            folder = channel.stat(remote_folder)
+            signature = (folder.st_mtime, folder.st_size)
+            cached = self._listings.get(remote_folder)
+            if cached is not None and cached[0] == signature:
+                self._channels.put(channel)
+                return cached[1]
+            listing = {
+                x.filename: x.st_size for x in channel.listdir_attr(remote_folder)
+            }
+        except Exception:
+            _close_quietly(channel)
+            raise
+        self._channels.put(channel)
+
+        # Files that are still being written are listed as empty, and writing to them does not change the folder
+        if folder.st_mtime is None or 0 in listing.values():
+            self._listings.pop(remote_folder, None)
+        else:
+            self._listings[remote_folder] = (signature, listing)
+        return listing
+
+    def fetch_missing(
+        self, list_of_file_names: list, remote_folder: str, local_folder: str
+    ) -> dict:
+        """
+        Download the files of a list that are on the server but not in the local folder
+        :param list_of_file_names: Names of the files required
+        :type list_of_file_names: list
+        :param remote_folder: Folder of the files on the server
+        :type remote_folder: str
+        :param local_folder: Folder of the files on the disk
+        :type local_folder: str
+        :return: {file name: status}; status is local, collected, missing or failed
+        :rtype: dict
+        """
+        os.makedirs(local_folder, exist_ok=True)
+        local = {x.name for x in os.scandir(local_folder) if x.stat().st_size > 0}
+        status = {x: "local" for x in list_of_file_names if x in local}
+        wanted = [x for x in list_of_file_names if x not in local]
+        if not wanted:
+            return status
+
+        listing = self.list_remote(remote_folder)
+        available = [x for x in wanted if listing.get(x, 0) > 0]
+        missing = [x for x in wanted if listing.get(x, 0) == 0]
+        newly_missing = [x for x in missing if x not in self.known_missing]
+        if newly_missing:
+            log.info(
+                f"{len(newly_missing)} files are not on the server: {newly_missing}"
+            )
+        # Only the files of the current window are tracked
+        self.known_missing = set(missing)
+
+        fetched = self.fetch(
+            [f"{remote_folder}/{x}" for x in available],
+            local_folder,
+            sizes={f"{remote_folder}/{x}": listing[x] for x in available},
+        )
+        for name in available:
+            status[name] = (
+                "collected" if fetched[f"{remote_folder}/{name}"] else "failed"
+            )
+        for name in missing:
+            status[name] = "missing"
+        return status
+
+    def fetch(
+        self, list_of_remote_paths: list, local_folder: str, sizes: dict = None
+    ) -> dict:
+        """
+        Download files to a local folder, keeping the file names
+        :param list_of_remote_paths: Paths of the files on the server
+        :type list_of_remote_paths: list
+        :param local_folder: Folder to save the files to
+        :type local_folder: str
+        :param sizes: Size of the files from a listing, {remote path: size}; saves a stat call per file
+        :type sizes: dict
+        :return: {remote path: True if the file was downloaded}; missing and empty files are False
+        :rtype: dict
+        """
+        if not list_of_remote_paths:
+            return {}
+        self.connect()
+        os.makedirs(local_folder, exist_ok=True)
+        sizes = sizes or {}
+
+        def _fetch(remote_path):
+            local_path = os.path.join(local_folder, remote_path.split("/")[-1])
+            return self._fetch_with_retry(
+                remote_path, local_path, sizes.get(remote_path)
+            )
+
+        with ThreadPoolExecutor(max_workers=self.n_channels) as executor:
+            status = list(executor.map(_fetch, list_of_remote_paths))
+        return dict(zip(list_of_remote_paths, status))
+
+    def _fetch_with_retry(
+        self, remote_path: str, local_path: str, size: int = None
+    ) -> bool:
+        for attempt in range(self.max_retries + 1):
+            channel = None
+            try:
+                self.connect()
+                channel = self._borrow_channel()
+                downloaded = self._download(channel, remote_path, local_path, size)
+                self._channels.put(channel)
+                return downloaded
+            except FileNotFoundError:
+                if channel is not None:
+                    self._channels.put(channel)
+                log.info(f"Not on the server: {remote_path}")
+                return False
+            except Exception as error:
+                # The channel may be broken; do not return it to the pool
+                if channel is not None:
+                    _close_quietly(channel)
+                if attempt == self.max_retries:
+                    log.warning(f"Failed to collect {remote_path}: {error}")
+                    return False
+                wait = self.backoff_seconds * 2**attempt
+                log.info(f"Retrying {remote_path} in {wait} s: {error}")
+                time.sleep(wait)
+        return False
+
+    def _borrow_channel(self):
+        try:
+            return self._channels.get_nowait()
+        except queue.Empty:
+            return self.session.open_sftp()
+
+    def _download(
+        self, channel, remote_path: str, local_path: str, size: int = None
+    ) -> bool:
+        """Download to a temporary file, resuming a previous partial download, then move it in place"""
+        partial_path = f"{local_path}{PARTIAL_SUFFIX}"
+        offset = os.path.getsize(partial_path) if os.path.isfile(partial_path) else 0
+        if size is None:
+            size = channel.stat(remote_path).st_size
+        if offset > size:
+            offset = 0
+
+        with channel.open(remote_path, "rb") as remote, open(
+            partial_path, "ab" if offset else "wb"
+        ) as local:
+            remote.seek(offset)
+            for chunk in iter(lambda: remote.read(_CHUNK_SIZE), b""):
+                local.write(chunk)
+
+        if os.path.getsize(partial_path) == 0:
+            # The server sometimes lists files without data
+            os.remove(partial_path)
+            log.info(f"Empty file on the server: {remote_path}")
+            return False
+        os.replace(partial_path, local_path)
+        log.info(f"collected {remote_path}")
+        return True
+
+    def _close_channels(self) -> None:
+        while not self._channels.empty():
+            _close_quietly(self._channels.get_nowait())
+
+
+def create_radar_fetcher(config, session_factory=None) -> RadarFetcher:
+    """Radar fetcher from the radar config; connects to the radar server unless another session_factory is given"""
+    _fetcher = config.radar.fetcher
+    if session_factory is None:
+        session_factory = partial(
+            SSHSession,
+            host_name=config.radar.server.HOST_NAME,
+            user_name=config.radar.server.USER_NAME,
+            password=config.radar.server.PASSWORD,
+        )
+    return RadarFetcher(
+        session_factory,
+        n_channels=_fetcher.n_channels,
+        max_retries=_fetcher.max_retries,
+        backoff_seconds=_fetcher.backoff_seconds,
+    )
+
+
+def _close_quietly(channel) -> None:
+    try:
+        channel.close()
+    except Exception:
+        pass
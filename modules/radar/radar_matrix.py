@@ -0,0 +1,58 @@
+"""Radar rainfall of the analysis window
+Details
+-------
+The radar rainfall of the current run as a float32 array (time step x sub-basin). Time steps are labelled with a
+DatetimeIndex (UTC) and sub-basins by position, so the aggregations of a run are array reductions over trailing
+time steps instead of lookups of file name labels.
+
+"""
+import numpy as np
+import pandas as pd
+
+
+class RadarMatrix:
+    """Rainfall (time step x sub-basin), in time order"""
+
+    def __init__(self, values, times, subbasins: list, present=None):
+        self.values = np.asarray(values, dtype=np.float32)
+        self.times = pd.DatetimeIndex(times)
+        self.subbasins = list(subbasins)
+        # True for the time steps with radar data
+        self.present = (
+            np.ones(len(self.times), dtype=bool)
+            if present is None
+            else np.asarray(present, dtype=bool)
+        )
+        if self.values.shape != (len(self.times), len(self.subbasins)):
+            raise ValueError(
+                f"Radar values of shape {self.values.shape} do not match {len(self.times)} time steps and "
+                f"{len(self.subbasins)} sub-basins"
+            )
+
+    def trailing(self, n_steps: int) -> np.ndarray:
+        """View of the values of the last n time steps"""
+        return self.values[len(self.values) - min(int(n_steps), len(self.values)) :]
+
+    def trailing_sum(self, n_steps: int) -> np.ndarray:
+        """Rainfall of each sub-basin over the last n time steps; time steps without data count as zero"""
+        return np.nansum(self.trailing(n_steps), axis=0, dtype=np.float64)
+
+    def subbasin_positions(self, subbasins: list) -> np.ndarray:
+        """Positions of sub-basins on the sub-basin axis"""
+        position = {name: count for count, name in enumerate(self.subbasins)}
+        return np.array([position[name] for name in subbasins], dtype=np.int64)
+
+    def without_subbasins(self, subbasins: list) -> "RadarMatrix":
+        """Matrix without some sub-basins, e.g., the summary records; sub-basins not in the matrix are ignored"""
+        drop = set(subbasins)
+        keep = [count for count, x in enumerate(self.subbasins) if x not in drop]
+        return RadarMatrix(
+            self.values[:, keep],
+            self.times,
+            [self.subbasins[x] for x in keep],
+            self.present,
+        )
+
+    def to_frame(self) -> pd.DataFrame:
+        """Table with sub-basins as rows and time steps as columns"""
+        return pd.DataFrame(self.values.T, index=self.subbasins, columns=self.times)
@@ -0,0 +1,189 @@
+"""Radar data store
+Details
+-------
+Keeps the radar rainfall on the disk as one float32 array per day (time step x sub-basin), memory mapped when read.
+Each radar csv is ingested once when it is collected, and a run reads its window as slices of the daily partitions
+instead of parsing every csv of the window again.
+
+Layout of the store folder:
+    meta.json              time step in minutes and the sub-basins, in column order
+    {YYYYMMDD}.npy         float32 (time steps per day, sub-basins), NaN where no data
+    {YYYYMMDD}_present.npy bool (time steps per day), True for the time steps that were ingested
+
+"""
+import json
+import logging
+import os
+import re
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from modules.file_management.file_processing import atomic_write
+
+log = logging.getLogger(__name__)
+
+# Time stamp in the radar file names, e.g., KHGX_LII_basin_UTC_20220331130000.csv
+_TIME_STAMP = re.compile(r"(\d{14})")
+
+
+def time_of_radar_file(file_name: str) -> datetime:
+    """Time stamp in the name of a radar file"""
+    match = _TIME_STAMP.search(os.path.basename(file_name))
+    if match is None:
+        raise ValueError(f"No time stamp in the radar file name {file_name}")
+    return datetime.strptime(match.group(1), "%Y%m%d%H%M%S")
+
+
+class RadarStore:
+    """Append only store of radar rainfall, partitioned by day"""
+
+    def __init__(self, folder: str, time_step_minutes: int = 5):
+        self.folder = folder
+        self.time_step_minutes = int(time_step_minutes)
+        if (24 * 60) % self.time_step_minutes != 0:
+            raise ValueError("The time step must divide a day")
+        self.steps_per_day = 24 * 60 // self.time_step_minutes
+        self.subbasins = []
+        self._column = {}
+
+        os.makedirs(folder, exist_ok=True)
+        self.path_meta = os.path.join(folder, "meta.json")
+        if os.path.isfile(self.path_meta):
+            with open(self.path_meta) as file:
+                meta = json.load(file)
+            if meta["time_step_minutes"] != self.time_step_minutes:
+                raise ValueError(
+                    f"The radar store {folder} has a time step of {meta['time_step_minutes']} minutes"
+                )
+            self._add_subbasins(meta["subbasins"])
+
+    def ingest(self, list_of_paths: list) -> int:
+        """
+        Add radar csv files to the store; files of time steps that are already in the store are skipped
+        :param list_of_paths: Paths to the radar csv files (sub-basin, rainfall per row, no header)
+        :type list_of_paths: list
+        :return: Number of files ingested
+        :rtype: int
+        """
+        by_day = {}
+        for path in list_of_paths:
+            time = time_of_radar_file(path)
+            by_day.setdefault(time.date(), []).append((self._step(time), path))
+
+        count = 0
+        for day, items in sorted(by_day.items()):
+            present = self._open_present(day)
+            items = [(step, path) for step, path in items if not present[step]]
+            if not items:
+                continue
+            records = [
+                pd.read_csv(path, header=None, index_col=0).iloc[:, 0]
+                for _, path in items
+            ]
+            new = [
+                x for r in records for x in r.index.astype(str) if x not in self._column
+            ]
+            if new:
+                self._add_subbasins(new)
+                self._save_meta()
+
+            values = self._open_values(day, mode="r+")
+            for (step, _), record in zip(items, records):
+                values[step] = np.nan
+                columns = [self._column[x] for x in record.index.astype(str)]
+                values[step, columns] = record.to_numpy(dtype=np.float32)
+            # Values go to the disk before the time steps are marked as present
+            values.flush()
+            for step, _ in items:
+                present[step] = True
+            present.flush()
+            count += len(items)
+            del values, present
+
+        if count:
+            log.info(f"Ingested {count} radar files into {self.folder}")
+        return count
+
+    def window(self, list_of_times: list) -> tuple:
+        """
+        Rainfall of a list of time steps
+        :param list_of_times: Times of the time steps (datetime)
+        :type list_of_times: list
+        :return: (values (time steps x sub-basins) float32 with NaN where no data, present per time step, sub-basins)
+        :rtype: tuple
+        """
+        values = np.full((len(list_of_times), len(self.subbasins)), np.nan, np.float32)
+        present = np.zeros(len(list_of_times), dtype=bool)
+        if not list_of_times:
+            return values, present, list(self.subbasins)
+
+        steps = np.array([self._step(x) for x in list_of_times])
+        days = np.array([x.date() for x in list_of_times])
+        for day in sorted(set(days)):
+            if not os.path.isfile(self._path(day, "_present")):
+                continue
+            rows = np.flatnonzero(days == day)
+            day_values = self._open_values(day, mode="r")
+            day_present = np.load(self._path(day, "_present"), mmap_mode="r")
+            values[rows, : day_values.shape[1]] = day_values[steps[rows]]
+            present[rows] = day_present[steps[rows]]
+        # Time steps that were not ingested have no data
+        values[~present] = np.nan
+        return values, present, list(self.subbasins)
+
+    def _step(self, time: datetime) -> int:
+        minutes = time.hour * 60 + time.minute
+        if minutes % self.time_step_minutes or time.second:
+            raise ValueError(
+                f"{time} is not on the {self.time_step_minutes} minute radar time step"
+            )
+        return minutes // self.time_step_minutes
+
+    def _path(self, day, suffix: str = "") -> str:
+        return os.path.join(self.folder, f"{day:%Y%m%d}{suffix}.npy")
+
+    def _open_present(self, day):
+        path = self._path(day, "_present")
+        if not os.path.isfile(path):
+            np.save(path, np.zeros(self.steps_per_day, dtype=bool))
+        return np.load(path, mmap_mode="r+")
+
+    def _open_values(self, day, mode: str):
+        path = self._path(day)
+        if not os.path.isfile(path):
+            if mode == "r":
+                return np.empty((self.steps_per_day, 0), dtype=np.float32)
+            np.save(
+                path,
+                np.full((self.steps_per_day, len(self.subbasins)), np.nan, np.float32),
+            )
+        values = np.load(path, mmap_mode=mode)
+        if mode != "r" and values.shape[1] < len(self.subbasins):
+            # Widen the partition for sub-basins that appeared after it was created
+            widened = np.full(
+                (self.steps_per_day, len(self.subbasins)), np.nan, np.float32
+            )
+            widened[:, : values.shape[1]] = values
+            del values
+            with atomic_write(path) as file:
+                np.save(file, widened)
+            values = np.load(path, mmap_mode=mode)
+        return values
+
+    def _add_subbasins(self, subbasins: list) -> None:
+        for name in subbasins:
+            if name not in self._column:
+                self._column[name] = len(self.subbasins)
+                self.subbasins.append(name)
+
+    def _save_meta(self) -> None:
+        with atomic_write(self.path_meta, "w") as file:
+            json.dump(
+                {
+                    "time_step_minutes": self.time_step_minutes,
+                    "subbasins": self.subbasins,
+                },
+                file,
+            )
@@ -0,0 +1,95 @@
+"""Rolling radar window
+Details
+-------
+Keeps the radar rainfall of the current analysis window in memory between runs. Consecutive runs share all but the
+newest few time steps, so a run reads from the radar store only the time steps that entered the window, and the time
+steps that were missing before, and overwrites the slots of the time steps that left it.
+
+"""
+import logging
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from modules.radar.radar_store import RadarStore
+
+log = logging.getLogger(__name__)
+
+# Time steps are numbered from this time
+_EPOCH = datetime(1970, 1, 1)
+
+
+class RadarWindow:
+    """Ring buffer of the radar rainfall (time step x sub-basin) of a window of consecutive time steps"""
+
+    def __init__(
+        self,
+        store: RadarStore,
+        missing_data_tag: float = None,
+        replace_missing_tag_with: float = 0,
+    ):
+        self.store = store
+        # Values encoding missing data in the radar files are replaced when a time step is loaded
+        self.missing_data_tag = missing_data_tag
+        self.replace_missing_tag_with = replace_missing_tag_with
+        self.step = timedelta(minutes=store.time_step_minutes)
+        self.values = np.empty((0, 0), dtype=np.float32)
+        self.present = np.zeros(0, dtype=bool)
+        # Numbers of the first and last time step in the buffer
+        self.first = None
+        self.last = None
+
+    def update(self, list_of_times: list) -> tuple:
+        """
+        Move the window to a list of consecutive time steps, loading only the time steps that are not in memory
+        :param list_of_times: Times of the time steps (datetime), in order, one time step apart
+        :type list_of_times: list
+        :return: (values (time steps x sub-basins) float32 with NaN where no data, present per time step, sub-basins)
+        :rtype: tuple
+        """
+        numbers = np.array([self._number(x) for x in list_of_times], dtype=np.int64)
+        if len(numbers) and np.any(np.diff(numbers) != 1):
+            raise ValueError("The radar window must be consecutive time steps")
+        if not len(numbers):
+            return self.store.window([])
+
+        first, last = int(numbers[0]), int(numbers[-1])
+        if (
+            self.first is None
+            or len(numbers) > len(self.present)
+            or self.values.shape[1] != len(self.store.subbasins)
+        ):
+            # First run, a longer window or new sub-basins; fill the whole buffer
+            self._allocate(len(numbers))
+            load = numbers
+        else:
+            kept = (numbers >= self.first) & (numbers <= self.last)
+            kept[kept] = self.present[numbers[kept] % len(self.present)]
+            load = numbers[~kept]
+        self.first, self.last = first, last
+
+        if len(load):
+            values, present, _ = self.store.window(
+                [_EPOCH + int(x) * self.step for x in load]
+            )
+            if self.missing_data_tag is not None:
+                values[values == self.missing_data_tag] = self.replace_missing_tag_with
+            slots = load % len(self.present)
+            self.values[slots] = values
+            self.present[slots] = present
+            log.info(f"Loaded {len(load)} time steps into the radar window")
+
+        slots = numbers % len(self.present)
+        return self.values[slots], self.present[slots], list(self.store.subbasins)
+
+    def _number(self, time: datetime) -> int:
+        number, remainder = divmod(time - _EPOCH, self.step)
+        if remainder:
+            raise ValueError(f"{time} is not on the radar time step")
+        return number
+
+    def _allocate(self, length: int) -> None:
+        self.values = np.full(
+            (length, len(self.store.subbasins)), np.nan, dtype=np.float32
+        )
+        self.present = np.zeros(length, dtype=bool)
@@ -0,0 +1,70 @@
+"""Rainfall thresholds
+Details
+-------
+Checks the radar rainfall of the window against the run criteria, i.e., rainfall depths over durations. One prefix sum
+along time per sub-basin gives the rainfall over any trailing duration as a single difference, so all durations are
+evaluated together and adding durations adds almost no cost.
+
+"""
+import numpy as np
+import pandas as pd
+
+from modules.radar.radar_matrix import RadarMatrix
+
+
+def trailing_sums(values: np.ndarray, list_of_time_steps: list) -> np.ndarray:
+    """
+    Rainfall of each sub-basin over the last n time steps, for several n; time steps without data count as zero
+    :param values: Rainfall (time steps x sub-basins)
+    :type values: np.ndarray
+    :param list_of_time_steps: Number of trailing time steps of each duration
+    :type list_of_time_steps: list
+    :return: Rainfall (durations x sub-basins)
+    :rtype: np.ndarray
+    """
+    values = np.asarray(values)
+    prefix = np.zeros((len(values) + 1, values.shape[1]), dtype=np.float64)
+    np.cumsum(np.nan_to_num(values, nan=0.0), axis=0, out=prefix[1:])
+    start = len(values) - np.clip(
+        np.asarray(list_of_time_steps, dtype=np.int64), 0, len(values)
+    )
+    return prefix[-1] - prefix[start]
+
+
+def evaluate_run_criteria(
+    radar_matrix: RadarMatrix, criteria: dict, time_step_minutes: int
+) -> tuple:
+    """
+    Check the rainfall of the window against the run criteria {name: {duration_min, threshold}}
+    :param radar_matrix: Rainfall of the window
+    :type radar_matrix: RadarMatrix
+    :param criteria: Run criteria, thresholds.run_criteria in the config
+    :type criteria: dict
+    :param time_step_minutes: Time step of the radar data in minutes
+    :type time_step_minutes: int
+    :return: (one row per criterion with the max and mean rainfall of the sub-basins and whether it triggers a model
+        run; exceedance flags, criteria x sub-basins)
+    :rtype: tuple
+    """
+    names = list(criteria.keys())
+    duration = np.array([criteria[x]["duration_min"] for x in names], dtype=np.int64)
+    limit = np.array([criteria[x]["threshold"] for x in names], dtype=np.float64)
+    time_steps = duration // int(time_step_minutes)
+
+    rainfall = trailing_sums(radar_matrix.values, time_steps)
+    exceeded = rainfall >= limit[:, None]
+
+    df_criteria = pd.DataFrame(
+        {
+            "Criteria": names,
+            "Duration": duration,
+            "Limit": limit,
+            "Time steps": time_steps,
+            "Max of Observed Rainfall": rainfall.max(axis=1),
+            "Avg of Observed Rainfall": rainfall.mean(axis=1),
+            "Sub-basins exceeded": exceeded.sum(axis=1),
+            "Trigger_Model_Run": exceeded.any(axis=1),
+        }
+    )
+    df_exceeded = pd.DataFrame(exceeded, index=names, columns=radar_matrix.subbasins)
+    return df_criteria, df_exceeded
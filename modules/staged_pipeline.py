@@ -0,0 +1,102 @@
+"""Staged pipeline
+Details
+-------
+Runs the steps of an analysis cycle as stages, each on its own worker thread, so a fast stage of the next cycle (e.g.,
+the radar data) proceeds while a slow stage of the current cycle (e.g., HEC-RAS) runs. A stage starts once the stages
+it depends on have finished for its cycle, and receives their results.
+
+Each stage has at most one running and one waiting job. A new job replaces the waiting one, so a slow stage never
+queues up overlapping runs; it takes the most recent cycle once it is free.
+
+"""
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class Stage:
+    """A step of the pipeline; function(results) gets the results of the stages it depends on, by stage name"""
+
+    def __init__(self, name: str, function, after: list = ()):
+        self.name = name
+        self.function = function
+        self.after = tuple(after)
+        self.pipeline = None
+        self._condition = threading.Condition()
+        # Results of the earlier stages of the waiting job
+        self._waiting = None
+        self._running = False
+        self._thread = threading.Thread(
+            target=self._work, name=f"stage_{name}", daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, results: dict) -> None:
+        with self._condition:
+            if self._waiting is not None:
+                log.info(f"Stage {self.name} is busy; skipping an older waiting cycle")
+            self._waiting = results
+            self._condition.notify_all()
+
+    def busy(self) -> bool:
+        with self._condition:
+            return self._running or self._waiting is not None
+
+    def wait(self, timeout: float = None) -> bool:
+        """Wait until the stage has no running or waiting job; returns False on timeout"""
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._running and self._waiting is None, timeout
+            )
+
+    def _work(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._waiting is not None)
+                results, self._waiting = self._waiting, None
+                self._running = True
+            try:
+                result = self.function(results)
+            except Exception:
+                # A failed stage ends its cycle; the next cycle starts over
+                log.exception(f"Stage {self.name} failed")
+            else:
+                if self.pipeline is not None:
+                    self.pipeline.finished(self, {**results, self.name: result})
+            finally:
+                with self._condition:
+                    self._running = False
+                    self._condition.notify_all()
+
+
+class StagedPipeline:
+    """Stages with dependencies; run_cycle starts the stages that do not depend on other stages"""
+
+    def __init__(self, stages: list):
+        self.stages = {stage.name: stage for stage in stages}
+        for stage in stages:
+            unknown = set(stage.after) - set(self.stages)
+            if unknown:
+                raise ValueError(
+                    f"Stage {stage.name} depends on unknown stages {unknown}"
+                )
+            stage.pipeline = self
+
+    def run_cycle(self) -> None:
+        """Start a cycle; returns at once"""
+        for stage in self.stages.values():
+            if not stage.after:
+                stage.submit({})
+
+    def finished(self, stage: Stage, results: dict) -> None:
+        """Start the stages whose dependencies have all finished for the cycle"""
+        for dependent in self.stages.values():
+            if stage.name in dependent.after and all(
+                x in results for x in dependent.after
+            ):
+                dependent.submit(results)
+
+    def wait(self, timeout: float = None) -> bool:
+        """Wait until no stage has a running or waiting job"""
+        return all(stage.wait(timeout) for stage in self.stages.values())
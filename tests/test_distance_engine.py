@@ -0,0 +1,90 @@
+"""Tests of the distance engine against networkx"""
+import networkx as nx
+import numpy as np
+import pytest
+
+from modules.network_utils.distance_engine import masked_distances
+from modules.network_utils.road_graph import RoadGraph
+
+INACCESSIBLE = 1e5
+
+
+def _grid_graph(size=12, seed=0, directed=False):
+    """Grid network with random link lengths, a few parallel links and a few isolated nodes"""
+    rng = np.random.default_rng(seed)
+    node = np.arange(size * size).reshape(size, size)
+    source = np.concatenate([node[:, :-1].ravel(), node[:-1, :].ravel()])
+    target = np.concatenate([node[:, 1:].ravel(), node[1:, :].ravel()])
+    # Parallel links of a different length
+    parallel = rng.choice(len(source), 10, replace=False)
+    source = np.concatenate([source, source[parallel]])
+    target = np.concatenate([target, target[parallel]])
+    length = rng.uniform(1, 10, len(source))
+    coords = np.column_stack([node.ravel() % size, node.ravel() // size]).astype(float)
+    coords = np.vstack([coords, [[-5, -5], [-6, -6]]])
+    return RoadGraph(coords, source, target, length, directed=directed), rng
+
+
+def _networkx_distances(graph, keep, facility_nodes):
+    """Distance to the nearest facility node with networkx; INACCESSIBLE if none is reachable"""
+    network = nx.DiGraph() if graph.directed else nx.Graph()
+    network.add_nodes_from(range(graph.n_nodes))
+    for source, target, length in zip(
+        graph.edge_source[keep], graph.edge_target[keep], graph.edge_length[keep]
+    ):
+        # Parallel links collapse to the shortest one
+        if (
+            not network.has_edge(source, target)
+            or network[source][target]["weight"] > length
+        ):
+            network.add_edge(source, target, weight=length)
+    if graph.directed:
+        # Distance from the node to the facility
+        network = network.reverse()
+    found = nx.multi_source_dijkstra_path_length(network, set(facility_nodes))
+    return np.array([found.get(x, INACCESSIBLE) for x in range(graph.n_nodes)])
+
+
+@pytest.mark.parametrize("directed", [False, True])
+def test_masked_distances_match_networkx(directed):
+    graph, rng = _grid_graph(directed=directed)
+    keep = rng.random(graph.n_edges) > 0.2
+    facility_nodes = {"Hospitals": [0, 77], "Fire_stations": [143]}
+
+    distances, _ = masked_distances(
+        graph, keep, facility_nodes, inaccessibility_code=INACCESSIBLE
+    )
+
+    for facility, nodes in facility_nodes.items():
+        np.testing.assert_allclose(
+            distances[facility], _networkx_distances(graph, keep, nodes)
+        )
+
+
+@pytest.mark.parametrize("directed", [False, True])
+def test_incremental_update_matches_networkx(directed):
+    graph, rng = _grid_graph(seed=1, directed=directed)
+    facility_nodes = {"Hospitals": [5, 90], "Fire_stations": [130]}
+    keep = rng.random(graph.n_edges) > 0.1
+    _, state = masked_distances(
+        graph, keep, facility_nodes, inaccessibility_code=INACCESSIBLE
+    )
+
+    # Flood some open links and reopen some flooded ones, over several runs
+    for _ in range(5):
+        new_keep = keep.copy()
+        new_keep[rng.choice(np.flatnonzero(keep), 8, replace=False)] = False
+        new_keep[rng.choice(np.flatnonzero(~keep), 3, replace=False)] = True
+        distances, state = masked_distances(
+            graph,
+            new_keep,
+            facility_nodes,
+            inaccessibility_code=INACCESSIBLE,
+            previous_state=state,
+            max_change_ratio=1.0,
+        )
+        for facility, nodes in facility_nodes.items():
+            np.testing.assert_allclose(
+                distances[facility], _networkx_distances(graph, new_keep, nodes)
+            )
+        keep = new_keep
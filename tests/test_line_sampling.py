@@ -0,0 +1,109 @@
+"""Tests of LinePixelIndex against rasterstats zonal statistics on the same lines"""
+import numpy as np
+import pytest
+import shapely
+from rasterio import Affine
+from rasterstats import zonal_stats
+
+from modules.geo_utils.line_sampling import LinePixelIndex, cached_line_index
+
+NODATA = -9999.0
+SHAPE = (40, 50)
+# 10 m pixels, north up
+TRANSFORM = Affine(10.0, 0.0, 1000.0, 0.0, -10.0, 2000.0)
+
+
+@pytest.fixture
+def depth():
+    rng = np.random.default_rng(7)
+    data = rng.uniform(0.0, 3.0, SHAPE)
+    data[rng.random(SHAPE) < 0.1] = NODATA
+    return data
+
+
+def _zonal_max(lines, data, all_touched=False):
+    stats = zonal_stats(
+        lines,
+        data,
+        affine=TRANSFORM,
+        nodata=NODATA,
+        stats=["max"],
+        all_touched=all_touched,
+    )
+    return np.array([np.nan if s["max"] is None else s["max"] for s in stats])
+
+
+def _random_lines(n, seed):
+    rng = np.random.default_rng(seed)
+    lines = []
+    for _ in range(n):
+        n_vertices = rng.integers(2, 6)
+        x = rng.uniform(1000.0, 1500.0, n_vertices)
+        y = rng.uniform(1600.0, 2000.0, n_vertices)
+        lines.append(shapely.LineString(np.column_stack([x, y])))
+    return lines
+
+
+def test_max_matches_zonal_stats_on_pixel_center_lines(depth):
+    # Lines along rows and columns of pixel centers cross an unambiguous set of pixels
+    lines = [
+        shapely.LineString([(1005.0, 1995.0), (1495.0, 1995.0)]),
+        shapely.LineString([(1105.0, 1825.0), (1305.0, 1825.0)]),
+        shapely.LineString([(1255.0, 1995.0), (1255.0, 1605.0)]),
+        shapely.LineString([(1045.0, 1905.0), (1045.0, 1705.0), (1245.0, 1705.0)]),
+        shapely.MultiLineString(
+            [[(1015.0, 1615.0), (1095.0, 1615.0)], [(1405.0, 1915.0), (1405.0, 1815.0)]]
+        ),
+    ]
+    index = LinePixelIndex.from_lines(lines, TRANSFORM, SHAPE)
+    result = index.reduce(depth, nodata=NODATA)
+
+    np.testing.assert_allclose(result["max"], _zonal_max(lines, depth))
+
+
+def test_max_matches_all_touched_zonal_stats_with_a_short_step(depth):
+    lines = _random_lines(30, seed=3)
+    index = LinePixelIndex.from_lines(lines, TRANSFORM, SHAPE, step=0.01)
+    result = index.reduce(depth, nodata=NODATA)
+
+    np.testing.assert_allclose(
+        result["max"], _zonal_max(lines, depth, all_touched=True)
+    )
+
+
+def test_max_never_exceeds_all_touched_zonal_stats(depth):
+    # With the default step some corner pixels may be missed, but no pixel off the line is sampled
+    lines = _random_lines(30, seed=5)
+    index = LinePixelIndex.from_lines(lines, TRANSFORM, SHAPE)
+    result = index.reduce(depth, nodata=NODATA)
+    expected = _zonal_max(lines, depth, all_touched=True)
+
+    assert np.all(result["max"] <= expected)
+
+
+def test_lines_outside_the_raster_get_nan(depth):
+    lines = [
+        shapely.LineString([(500.0, 500.0), (600.0, 600.0)]),
+        # Only the part inside the raster is sampled
+        shapely.LineString([(905.0, 1995.0), (1095.0, 1995.0)]),
+    ]
+    result = LinePixelIndex.from_lines(lines, TRANSFORM, SHAPE).reduce(
+        depth, nodata=NODATA
+    )
+
+    assert np.isnan(result["max"][0])
+    assert result["length_flooded"][0] == 0
+    np.testing.assert_allclose(result["max"][1:], _zonal_max(lines[1:], depth))
+
+
+def test_cached_index_is_reused(depth, tmp_path):
+    lines = _random_lines(10, seed=11)
+    first = cached_line_index(lines, TRANSFORM, SHAPE, cache_folder=str(tmp_path))
+    second = cached_line_index(lines, TRANSFORM, SHAPE, cache_folder=str(tmp_path))
+
+    assert len(list(tmp_path.iterdir())) == 1
+    np.testing.assert_array_equal(first.pixels, second.pixels)
+    np.testing.assert_allclose(
+        first.reduce(depth, nodata=NODATA)["max"],
+        second.reduce(depth, nodata=NODATA)["max"],
+    )
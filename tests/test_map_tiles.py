@@ -0,0 +1,137 @@
+"""Tests of the incremental XYZ tiles of the flood depth map"""
+import json
+import os
+
+import numpy as np
+import pytest
+from rasterio import Affine
+
+# The color legend lives next to the GeoTiff readers
+pytest.importorskip("geotiff")
+
+from modules.image_utils.map_tiles import (  # noqa: E402
+    MANIFEST_NAME,
+    clear_xyz_tiles,
+    generate_xyz_tiles,
+)
+
+COLOR_MAP = {"a": [0.01, 1, 0, 0, 255, 255], "b": [1, 100, 255, 0, 0, 255]}
+# 200 x 200 pixels of 0.0005 degrees over Houston
+TRANSFORM = Affine(0.0005, 0.0, -95.5, 0.0, -0.0005, 29.75)
+ZOOMS = {"min_zoom": 10, "max_zoom": 12, "tile_size": 64}
+
+
+@pytest.fixture
+def depth():
+    rng = np.random.default_rng(1)
+    return rng.uniform(0.0, 2.0, (200, 200))
+
+
+def _tile_files(tile_folder):
+    """Modification time of every tile, by z/x/y key"""
+    files = {}
+    for root, _, names in os.walk(tile_folder):
+        for name in names:
+            if name.endswith(".png"):
+                path = os.path.join(root, name)
+                key = os.path.relpath(path, tile_folder)[: -len(".png")]
+                files[key.replace(os.sep, "/")] = os.stat(path).st_mtime_ns
+    return files
+
+
+def _reset_times(tile_folder):
+    for root, _, names in os.walk(tile_folder):
+        for name in names:
+            os.utime(os.path.join(root, name), ns=(0, 0))
+
+
+def _tile_bounds(key):
+    """(west, south, east, north) of a z/x/y tile"""
+    z, x, y = (int(v) for v in key.split("/"))
+    n = 2**z
+    lat = lambda row: np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * row / n))))
+    return x / n * 360 - 180, lat(y + 1), (x + 1) / n * 360 - 180, lat(y)
+
+
+def _intersects(key, west, south, east, north):
+    w, s, e, n = _tile_bounds(key)
+    return w < east and e > west and s < north and n > south
+
+
+def _pixel_box(rows, cols):
+    """(west, south, east, north) of a block of pixels"""
+    west, north = TRANSFORM * (cols.start, rows.start)
+    east, south = TRANSFORM * (cols.stop, rows.stop)
+    return west, south, east, north
+
+
+def test_unchanged_depth_writes_nothing(depth, tmp_path):
+    tile_folder = str(tmp_path / "tiles")
+    first = generate_xyz_tiles(depth, TRANSFORM, COLOR_MAP, tile_folder, **ZOOMS)
+    assert first["written"] > 0 and first["removed"] == 0
+    assert len(_tile_files(tile_folder)) == first["written"]
+
+    _reset_times(tile_folder)
+    second = generate_xyz_tiles(depth, TRANSFORM, COLOR_MAP, tile_folder, **ZOOMS)
+
+    assert second == {"written": 0, "unchanged": first["written"], "removed": 0}
+    assert set(_tile_files(tile_folder).values()) == {0}
+    with open(os.path.join(tile_folder, MANIFEST_NAME)) as file:
+        manifest = json.load(file)
+    assert manifest["bounds"] == [-95.5, 29.65, -95.4, 29.75]
+    assert len(manifest["tiles"]) == first["written"]
+
+
+def test_only_changed_tiles_are_rewritten(depth, tmp_path):
+    tile_folder = str(tmp_path / "tiles")
+    first = generate_xyz_tiles(depth, TRANSFORM, COLOR_MAP, tile_folder, **ZOOMS)
+    _reset_times(tile_folder)
+
+    rows, cols = slice(10, 30), slice(150, 180)
+    depth[rows, cols] += 5.0
+    second = generate_xyz_tiles(depth, TRANSFORM, COLOR_MAP, tile_folder, **ZOOMS)
+    rewritten = [k for k, v in _tile_files(tile_folder).items() if v != 0]
+
+    assert 0 < second["written"] < first["written"]
+    assert second["written"] + second["unchanged"] == first["written"]
+    assert len(rewritten) == second["written"]
+    assert all(_intersects(k, *_pixel_box(rows, cols)) for k in rewritten)
+
+
+def test_empty_tiles_are_removed(depth, tmp_path):
+    tile_folder = str(tmp_path / "tiles")
+    generate_xyz_tiles(depth, TRANSFORM, COLOR_MAP, tile_folder, **ZOOMS)
+    before = set(_tile_files(tile_folder))
+
+    # The west half dries up
+    rows, cols = slice(0, 200), slice(0, 100)
+    depth[rows, cols] = np.nan
+    summary = generate_xyz_tiles(depth, TRANSFORM, COLOR_MAP, tile_folder, **ZOOMS)
+    after = set(_tile_files(tile_folder))
+    stale = before - after
+
+    assert summary["removed"] == len(stale) > 0
+    assert after <= before
+    # Tiles are sampled at their pixel centers, so a stale tile may overlap the wet half by less than a tile pixel
+    west, south, east, north = _pixel_box(slice(0, 200), slice(100, 200))
+    for key in stale:
+        margin = 360 / 2 ** int(key.split("/")[0]) / ZOOMS["tile_size"]
+        assert not _intersects(key, west + margin, south, east, north)
+    with open(os.path.join(tile_folder, MANIFEST_NAME)) as file:
+        assert set(json.load(file)["tiles"]) == after
+
+
+def test_clear_removes_every_tile(depth, tmp_path):
+    tile_folder = str(tmp_path / "tiles")
+    assert clear_xyz_tiles(tile_folder) == 0
+    summary = generate_xyz_tiles(depth, TRANSFORM, COLOR_MAP, tile_folder, **ZOOMS)
+
+    assert clear_xyz_tiles(tile_folder) == summary["written"]
+    assert _tile_files(tile_folder) == {}
+    with open(os.path.join(tile_folder, MANIFEST_NAME)) as file:
+        manifest = json.load(file)
+    assert manifest["tiles"] == {} and manifest["max_zoom"] == 12
+
+    # Tiles removed by clear are written again by the next run
+    again = generate_xyz_tiles(depth, TRANSFORM, COLOR_MAP, tile_folder, **ZOOMS)
+    assert again["written"] == summary["written"]
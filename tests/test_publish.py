@@ -0,0 +1,92 @@
+"""Tests of the delta publisher with a local folder as the storage backend"""
+import pytest
+
+from modules.publish.publish import DeltaPublisher, LocalDirectoryBackend
+
+
+class FailingBackend(LocalDirectoryBackend):
+    """Local backend whose uploads of some keys fail"""
+
+    def __init__(self, folder, failing_keys):
+        super().__init__(folder)
+        self.failing_keys = set(failing_keys)
+
+    def upload(self, local_path, key):
+        if key in self.failing_keys:
+            raise OSError("connection reset")
+        super().upload(local_path, key)
+
+
+@pytest.fixture
+def website(tmp_path):
+    root = tmp_path / "website"
+    (root / "data" / "tiles" / "10").mkdir(parents=True)
+    (root / "data" / "tiles" / "10" / "1.png").write_bytes(b"tile 1")
+    (root / "data" / "tiles" / "10" / "2.png").write_bytes(b"tile 2")
+    (root / "data" / "flooded_roads.geojson").write_text("{}")
+    (root / "index.html").write_text("<html></html>")
+    return root
+
+
+def _publisher(tmp_path, root, backend=None):
+    backend = backend or LocalDirectoryBackend(str(tmp_path / "bucket"))
+    return DeltaPublisher(backend, str(root), str(tmp_path / "state.json"))
+
+
+def _status(reports):
+    return {x["key"]: x["status"] for x in reports}
+
+
+def test_only_changed_files_are_uploaded(tmp_path, website):
+    paths = [str(website / "data"), str(website / "index.html")]
+    status = _status(_publisher(tmp_path, website).publish(paths))
+    assert set(status.values()) == {"uploaded"}
+    assert len(status) == 4
+    assert (tmp_path / "bucket" / "data" / "tiles" / "10" / "2.png").read_bytes() == (
+        b"tile 2"
+    )
+
+    # The state is read back by a new publisher, as after a restart
+    status = _status(_publisher(tmp_path, website).publish(paths))
+    assert set(status.values()) == {"unchanged"}
+
+    (website / "data" / "tiles" / "10" / "2.png").write_bytes(b"tile 2, new depth")
+    # Rewriting a file with the same content is not a change
+    (website / "index.html").write_text("<html></html>")
+    status = _status(_publisher(tmp_path, website).publish(paths))
+
+    assert [k for k, v in status.items() if v != "unchanged"] == ["data/tiles/10/2.png"]
+    assert status["data/tiles/10/2.png"] == "uploaded"
+    assert (tmp_path / "bucket" / "data" / "tiles" / "10" / "2.png").read_bytes() == (
+        b"tile 2, new depth"
+    )
+
+
+def test_removed_files_are_deleted(tmp_path, website):
+    publisher = _publisher(tmp_path, website)
+    publisher.publish([str(website / "data")])
+
+    (website / "data" / "tiles" / "10" / "1.png").unlink()
+    status = _status(publisher.publish([str(website / "data")]))
+
+    assert status["data/tiles/10/1.png"] == "deleted"
+    assert not (tmp_path / "bucket" / "data" / "tiles" / "10" / "1.png").exists()
+    assert "data/tiles/10/1.png" not in _publisher(tmp_path, website).state
+    # Files published on their own are not deleted when their folder is published
+    publisher.publish([str(website / "index.html")])
+    status = _status(publisher.publish([str(website / "data" / "tiles")]))
+    assert set(status.values()) == {"unchanged"}
+
+
+def test_failed_uploads_are_retried(tmp_path, website):
+    backend = FailingBackend(str(tmp_path / "bucket"), ["data/flooded_roads.geojson"])
+    status = _status(
+        _publisher(tmp_path, website, backend).publish([str(website / "data")])
+    )
+    assert status["data/flooded_roads.geojson"] == "failed"
+    assert status["data/tiles/10/1.png"] == "uploaded"
+
+    status = _status(_publisher(tmp_path, website).publish([str(website / "data")]))
+
+    assert status["data/flooded_roads.geojson"] == "uploaded"
+    assert status["data/tiles/10/1.png"] == "unchanged"
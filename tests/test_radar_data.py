@@ -0,0 +1,58 @@
+"""Tests of filling the missing radar time steps"""
+import numpy as np
+import pytest
+
+from modules.radar.radar_data import fill_missing_time_steps
+
+
+@pytest.fixture
+def rainfall():
+    values = np.array(
+        [[1, 10], [np.nan] * 2, [np.nan] * 2, [np.nan] * 2, [5, 50], [np.nan] * 2],
+        dtype=np.float32,
+    )
+    present = np.array([True, False, False, False, True, False])
+    return values, present
+
+
+def test_linear_fill_across_long_gaps(rainfall):
+    values, present = rainfall
+    filled = fill_missing_time_steps(values, present, "linear")
+
+    np.testing.assert_allclose(filled[:5, 0], [1, 2, 3, 4, 5])
+    np.testing.assert_allclose(filled[:5, 1], [10, 20, 30, 40, 50])
+    # Gaps at the end take the last value with data
+    np.testing.assert_allclose(filled[5], [5, 50])
+    # The input is not modified
+    assert np.isnan(values[1]).all()
+
+
+def test_linear_fill_of_a_gap_at_the_start():
+    values = np.array([[np.nan], [np.nan], [3]], dtype=np.float32)
+    filled = fill_missing_time_steps(values, [False, False, True], "fill_linear")
+
+    np.testing.assert_allclose(filled[:, 0], [3, 3, 3])
+
+
+def test_constant_fill_and_neglect(rainfall):
+    values, present = rainfall
+
+    filled = fill_missing_time_steps(values, present, "fill_0.5")
+    np.testing.assert_allclose(filled[~present], 0.5)
+    np.testing.assert_allclose(filled[present], values[present])
+
+    assert np.isnan(fill_missing_time_steps(values, present, "neglect")[1]).all()
+
+
+def test_stop_and_unknown_methods(rainfall):
+    values, present = rainfall
+    with pytest.raises(RuntimeError):
+        fill_missing_time_steps(values, present, "stop")
+    with pytest.raises(ValueError):
+        fill_missing_time_steps(values, present, "nearest")
+    with pytest.raises(RuntimeError):
+        fill_missing_time_steps(values, np.zeros(len(values), dtype=bool), "linear")
+    # Nothing to fill
+    np.testing.assert_array_equal(
+        fill_missing_time_steps(values[:1], present[:1], "stop"), values[:1]
+    )
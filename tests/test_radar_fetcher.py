@@ -0,0 +1,178 @@
+"""Tests of the radar fetcher, against a local folder standing in for the radar server"""
+import os
+import shutil
+import threading
+import time
+from functools import partial
+from types import SimpleNamespace
+
+import pytest
+
+from modules.radar.radar_fetcher import PARTIAL_SUFFIX, create_radar_fetcher
+
+REMOTE_FOLDER = "PIRadarData"
+
+
+class LocalSFTPClient:
+    """Stand-in for paramiko.SFTPClient that serves a local folder"""
+
+    def __init__(self, root_folder: str):
+        self.root_folder = root_folder
+
+    def _path(self, remote_path: str) -> str:
+        return os.path.join(self.root_folder, *remote_path.split("/"))
+
+    def open(self, remote_path: str, mode: str = "rb"):
+        return open(self._path(remote_path), mode)
+
+    def stat(self, remote_path: str):
+        return os.stat(self._path(remote_path))
+
+    def listdir_attr(self, remote_path: str = "."):
+        return [
+            SimpleNamespace(
+                filename=entry.name,
+                st_size=entry.stat().st_size,
+                st_mtime=entry.stat().st_mtime,
+            )
+            for entry in os.scandir(self._path(remote_path))
+        ]
+
+    def get(self, remote_path: str, local_path: str) -> None:
+        shutil.copyfile(self._path(remote_path), local_path)
+
+    def close(self) -> None:
+        pass
+
+
+class LocalSFTPSession:
+    """Stand-in for SSHSession that serves a local folder"""
+
+    def __init__(self, root_folder: str):
+        self.root_folder = root_folder
+
+    def open_sftp(self) -> LocalSFTPClient:
+        return LocalSFTPClient(self.root_folder)
+
+    def is_active(self) -> bool:
+        return os.path.isdir(self.root_folder)
+
+    def close(self) -> None:
+        pass
+
+
+@pytest.fixture
+def server(tmp_path):
+    """Folder standing in for the radar server, with radar files of different sizes"""
+    root = tmp_path / "server"
+    (root / REMOTE_FOLDER).mkdir(parents=True)
+    files = {}
+    for count in range(12):
+        name = f"KHGX_LII_basin_UTC_20220331{count:02d}0000.csv"
+        files[name] = "".join(f"{x},{count * 0.1:.1f}\n" for x in range(count + 1))
+        (root / REMOTE_FOLDER / name).write_text(files[name])
+    return root, files
+
+
+def _fetcher(root, max_retries=2):
+    config = SimpleNamespace(
+        radar=SimpleNamespace(
+            fetcher=SimpleNamespace(
+                n_channels=4,
+                max_retries=max_retries,
+                backoff_seconds=0.01,
+            )
+        )
+    )
+    return create_radar_fetcher(
+        config, session_factory=partial(LocalSFTPSession, str(root))
+    )
+
+
+def test_concurrent_download(server, tmp_path, monkeypatch):
+    root, files = server
+    local_folder = tmp_path / "radar"
+    active, peak, lock = [0], [0], threading.Lock()
+    open_file = LocalSFTPClient.open
+
+    def slow_open(self, remote_path, mode="rb"):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.05)
+        with lock:
+            active[0] -= 1
+        return open_file(self, remote_path, mode)
+
+    monkeypatch.setattr(LocalSFTPClient, "open", slow_open)
+    names = sorted(files) + ["KHGX_LII_basin_UTC_20220401000000.csv"]
+    status = _fetcher(root).fetch_missing(names, REMOTE_FOLDER, str(local_folder))
+
+    assert status[names[-1]] == "missing"
+    assert all(status[x] == "collected" for x in files)
+    assert all((local_folder / x).read_text() == files[x] for x in files)
+    assert not any(x.endswith(PARTIAL_SUFFIX) for x in os.listdir(local_folder))
+    assert peak[0] > 1
+
+    # Files already on the disk are not downloaded again
+    status = _fetcher(root).fetch_missing(names, REMOTE_FOLDER, str(local_folder))
+    assert all(status[x] == "local" for x in files)
+
+
+def test_resume_partial_download(server, tmp_path):
+    root, files = server
+    local_folder = tmp_path / "radar"
+    local_folder.mkdir()
+    name = sorted(files)[-1]
+    # Bytes of an interrupted download; they differ from the server so that a fresh download would show
+    received = "X" * 10
+    (local_folder / f"{name}{PARTIAL_SUFFIX}").write_text(received)
+
+    status = _fetcher(root).fetch([f"{REMOTE_FOLDER}/{name}"], str(local_folder))
+
+    assert status == {f"{REMOTE_FOLDER}/{name}": True}
+    assert (local_folder / name).read_text() == received + files[name][10:]
+    assert not (local_folder / f"{name}{PARTIAL_SUFFIX}").exists()
+
+
+def test_retry_after_a_failed_download(server, tmp_path, monkeypatch):
+    root, files = server
+    local_folder = tmp_path / "radar"
+    calls = {}
+    open_file = LocalSFTPClient.open
+
+    def flaky_open(self, remote_path, mode="rb"):
+        # The first attempt of every file loses the connection
+        calls[remote_path] = calls.get(remote_path, 0) + 1
+        if calls[remote_path] == 1:
+            raise EOFError("Connection lost")
+        return open_file(self, remote_path, mode)
+
+    monkeypatch.setattr(LocalSFTPClient, "open", flaky_open)
+    status = _fetcher(root).fetch_missing(
+        sorted(files), REMOTE_FOLDER, str(local_folder)
+    )
+
+    assert all(status[x] == "collected" for x in files)
+    assert all((local_folder / x).read_text() == files[x] for x in files)
+    assert set(calls.values()) == {2}
+
+
+def test_retries_are_limited(server, tmp_path, monkeypatch):
+    root, files = server
+    local_folder = tmp_path / "radar"
+    calls = []
+
+    def broken_open(self, remote_path, mode="rb"):
+        calls.append(remote_path)
+        raise EOFError("Connection lost")
+
+    monkeypatch.setattr(LocalSFTPClient, "open", broken_open)
+    name = sorted(files)[0]
+    status = _fetcher(root, max_retries=2).fetch_missing(
+        [name], REMOTE_FOLDER, str(local_folder)
+    )
+
+    assert status == {name: "failed"}
+    assert len(calls) == 3
+    assert not (local_folder / name).exists()
@@ -0,0 +1,97 @@
+"""Tests of the per-day radar store"""
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from modules.radar.radar_store import RadarStore, time_of_radar_file
+
+SUBBASINS = ["B100", "B200", "B300"]
+
+
+def write_radar_file(folder, time, values, subbasins=SUBBASINS):
+    """Radar csv as collected from the server: (sub-basin, rainfall) per row, no header"""
+    path = folder / f"KHGX_LII_basin_UTC_{time:%Y%m%d%H%M%S}.csv"
+    path.write_text("".join(f"{s},{v}\n" for s, v in zip(subbasins, values)))
+    return str(path)
+
+
+@pytest.fixture
+def radar_folder(tmp_path):
+    folder = tmp_path / "radar"
+    folder.mkdir()
+    return folder
+
+
+def test_time_of_radar_file():
+    assert time_of_radar_file(
+        "/data/KHGX_LII_basin_UTC_20220331130500.csv"
+    ) == datetime(2022, 3, 31, 13, 5)
+    with pytest.raises(ValueError):
+        time_of_radar_file("KHGX_LII_basin.csv")
+
+
+def test_ingest_is_idempotent(radar_folder, tmp_path):
+    start = datetime(2022, 3, 31, 23, 45)
+    times = [start + timedelta(minutes=5 * i) for i in range(6)]
+    paths = [
+        write_radar_file(radar_folder, t, [i, 10 * i, 100 * i])
+        for i, t in enumerate(times)
+    ]
+    store = RadarStore(str(tmp_path / "store"))
+
+    assert store.ingest(paths) == 6
+    values, present, subbasins = store.window(times)
+    assert store.ingest(paths) == 0
+    again, present_again, _ = store.window(times)
+
+    assert subbasins == SUBBASINS
+    assert present.all() and present_again.all()
+    np.testing.assert_array_equal(values, again)
+    np.testing.assert_array_equal(values[:, 1], 10 * np.arange(6, dtype=np.float32))
+
+
+def test_ingest_skips_time_steps_already_present(radar_folder, tmp_path):
+    time = datetime(2022, 4, 1, 6, 0)
+    store = RadarStore(str(tmp_path / "store"))
+    store.ingest([write_radar_file(radar_folder, time, [1, 2, 3])])
+
+    # A second file for the same time step does not overwrite the first one
+    store.ingest([write_radar_file(radar_folder, time, [7, 8, 9])])
+    values, _, _ = store.window([time])
+
+    np.testing.assert_array_equal(values[0], [1, 2, 3])
+
+
+def test_window_of_missing_time_steps(radar_folder, tmp_path):
+    start = datetime(2022, 4, 1, 6, 0)
+    times = [start + timedelta(minutes=5 * i) for i in range(4)]
+    store = RadarStore(str(tmp_path / "store"))
+    store.ingest([write_radar_file(radar_folder, times[1], [1, 2, 3])])
+
+    values, present, _ = store.window(times + [start + timedelta(days=3)])
+
+    np.testing.assert_array_equal(present, [False, True, False, False, False])
+    assert np.isnan(values[~present]).all()
+    np.testing.assert_array_equal(values[1], [1, 2, 3])
+
+
+def test_new_subbasins_and_reopening(radar_folder, tmp_path):
+    first, second = datetime(2022, 4, 1, 6, 0), datetime(2022, 4, 1, 6, 5)
+    store = RadarStore(str(tmp_path / "store"))
+    store.ingest([write_radar_file(radar_folder, first, [1, 2, 3])])
+    store.ingest(
+        [write_radar_file(radar_folder, second, [4, 5], subbasins=["B300", "B400"])]
+    )
+
+    reopened = RadarStore(str(tmp_path / "store"))
+    values, present, subbasins = reopened.window([first, second])
+
+    assert subbasins == SUBBASINS + ["B400"]
+    assert present.all()
+    np.testing.assert_array_equal(values[0, :3], [1, 2, 3])
+    assert np.isnan(values[0, 3])
+    np.testing.assert_array_equal(values[1, 2:], [4, 5])
+    assert np.isnan(values[1, :2]).all()
+    with pytest.raises(ValueError):
+        RadarStore(str(tmp_path / "store"), time_step_minutes=10)
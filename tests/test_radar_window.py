@@ -0,0 +1,124 @@
+"""Tests of the rolling radar window"""
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from modules.radar.radar_store import RadarStore
+from modules.radar.radar_window import RadarWindow
+
+START = datetime(2022, 4, 1, 23, 30)
+SUBBASINS = ["B100", "B200"]
+
+
+def step_time(i):
+    return START + timedelta(minutes=5 * i)
+
+
+def step_values(i):
+    return [float(i), float(100 + i)]
+
+
+class RecordingStore(RadarStore):
+    """Radar store that records the time steps read by each window call"""
+
+    def __init__(self, folder):
+        super().__init__(folder)
+        self.reads = []
+
+    def window(self, list_of_times):
+        self.reads.append(list(list_of_times))
+        return super().window(list_of_times)
+
+
+@pytest.fixture
+def radar_folder(tmp_path):
+    folder = tmp_path / "radar"
+    folder.mkdir()
+    return folder
+
+
+@pytest.fixture
+def store(tmp_path):
+    return RecordingStore(str(tmp_path / "store"))
+
+
+def ingest(store, folder, steps):
+    paths = []
+    for i in steps:
+        path = folder / f"KHGX_LII_basin_UTC_{step_time(i):%Y%m%d%H%M%S}.csv"
+        path.write_text(
+            "".join(f"{s},{v}\n" for s, v in zip(SUBBASINS, step_values(i)))
+        )
+        paths.append(str(path))
+    store.ingest(paths)
+
+
+def test_missing_steps_are_empty_until_they_arrive(store, radar_folder):
+    ingest(store, radar_folder, [0, 1, 3, 4])
+    window = RadarWindow(store)
+
+    values, present, subbasins = window.update([step_time(i) for i in range(5)])
+    assert subbasins == SUBBASINS
+    np.testing.assert_array_equal(present, [True, True, False, True, True])
+    assert np.isnan(values[2]).all()
+    np.testing.assert_array_equal(values[3], step_values(3))
+
+    # The missing step arrives late; the next run loads it with the new step
+    ingest(store, radar_folder, [2, 5])
+    store.reads.clear()
+    values, present, _ = window.update([step_time(i) for i in range(1, 6)])
+
+    assert present.all()
+    np.testing.assert_array_equal(values, [step_values(i) for i in range(1, 6)])
+    assert store.reads == [[step_time(2), step_time(5)]]
+
+
+def test_only_new_steps_are_loaded(store, radar_folder):
+    ingest(store, radar_folder, range(12))
+    window = RadarWindow(store)
+    window.update([step_time(i) for i in range(6)])
+
+    for shift in range(1, 7):
+        store.reads.clear()
+        times = [step_time(i) for i in range(shift, shift + 6)]
+        values, present, _ = window.update(times)
+
+        assert store.reads == [[times[-1]]]
+        assert present.all()
+        np.testing.assert_array_equal(
+            values, [step_values(i) for i in range(shift, shift + 6)]
+        )
+
+
+def test_jump_and_longer_window_reload(store, radar_folder):
+    ingest(store, radar_folder, range(20))
+    window = RadarWindow(store)
+    window.update([step_time(i) for i in range(4)])
+
+    store.reads.clear()
+    times = [step_time(i) for i in range(10, 14)]
+    values, _, _ = window.update(times)
+    assert store.reads == [times]
+    np.testing.assert_array_equal(values, [step_values(i) for i in range(10, 14)])
+
+    store.reads.clear()
+    times = [step_time(i) for i in range(8, 16)]
+    values, _, _ = window.update(times)
+    assert store.reads == [times]
+    np.testing.assert_array_equal(values, [step_values(i) for i in range(8, 16)])
+
+
+def test_missing_data_tag_is_replaced(store, radar_folder):
+    path = radar_folder / f"KHGX_LII_basin_UTC_{step_time(0):%Y%m%d%H%M%S}.csv"
+    path.write_text("B100,-999\nB200,2\n")
+    store.ingest([str(path)])
+
+    values, _, _ = RadarWindow(store, missing_data_tag=-999).update([step_time(0)])
+
+    np.testing.assert_array_equal(values[0], [0, 2])
+
+
+def test_window_must_be_consecutive(store):
+    with pytest.raises(ValueError):
+        RadarWindow(store).update([step_time(0), step_time(2)])
@@ -26,10 +26,10 @@ map.on('load', function () {
     add_layer_access_to_dialysis_centers();
     // Add outline to access maps
     add_layer_access_maps_outline();
-    // Add inundation layer
-    add_layer_inundation_map();
     // Add flooded roads
     add_layer_flooded_roads();
+    // Add inundation layer, below the flooded roads, once the tile manifest is loaded
+    load_inundation_map();
     // Load study area
     load_study_area_boundary();
     // Load locations of fire stations
@@ -48,7 +48,56 @@ map.on('load', function () {
 
 // Add all sources
 function load_sources() {
-    // Source: Add Flood depth raster data
+    // Source: Add road condition
+    map.addSource('flooded_roads', { type: 'geojson', data: 'data/flooded_roads.geojson' }),
+
+    // Source: Add accessibility measures data
+    map.addSource('mobility', { type: 'geojson', data: 'data/mobility.geojson' })
+
+
+};
+
+// Add flood depth raster data, as XYZ tiles (see flood_depth_tiles in the website config), or as the flood depth
+// image if there are no tiles
+function load_inundation_map() {
+
+    // The manifest written with the tiles gives their zoom levels and bounds
+    fetch('data/flood_depth_tiles/manifest.json', { cache: 'no-store' })
+        .then(response => {
+            if (!response.ok) {
+                throw new Error('No flood depth tiles');
+            }
+            return response.json();
+        })
+        .then(manifest => {
+            // No flood map has been tiled yet
+            if (!manifest.bounds) {
+                throw new Error('No flood depth tiles');
+            }
+            // Tile urls must be absolute
+            var base_url = window.location.href.substring(0, window.location.href.lastIndexOf('/') + 1);
+            map.addSource('radar', {
+                'type': 'raster',
+                'tiles': [base_url + 'data/flood_depth_tiles/{z}/{x}/{y}.png'],
+                'tileSize': manifest.tile_size,
+                'minzoom': manifest.min_zoom,
+                'maxzoom': manifest.max_zoom,
+                'bounds': manifest.bounds
+            });
+        })
+        .catch(() => {
+            // Tiles are turned off or not available; show the flood depth image instead
+            if (!map.getSource('radar')) {
+                add_source_inundation_image();
+            }
+        })
+        .then(add_layer_inundation_map);
+
+};
+
+// Source: Add Flood depth raster data, as a single image
+function add_source_inundation_image() {
+
     map.addSource('radar', {
         'type': 'image',
         'url': 'data/flood_depth_raster.png',
@@ -60,20 +109,15 @@ function load_sources() {
         ]
     });
 
-    // Source: Add road condition
-    map.addSource('flooded_roads', { type: 'geojson', data: 'data/flooded_roads.geojson' }),
-
-    // Source: Add accessibility measures data
-    map.addSource('mobility', { type: 'geojson', data: 'data/mobility.geojson' })
-
-
 };
 
 // Add inundation layer
 function add_layer_inundation_map() {
 
-    // Map Layer: Add inundation depth map to a layer
-    map.addLayer({ id: 'Inundation Depth', 'type': 'raster', 'source': 'radar', 'paint': { 'raster-fade-duration': 0 } });
+    // Map Layer: Add inundation depth map to a layer, below the flooded roads. The layer is added after the
+    // navigation is set up, so it follows the state of the flood depth button
+    var visibility = layer_status_flood_depth.classList.contains(layer_status_class) ? 'visible' : 'none';
+    map.addLayer({ id: 'Inundation Depth', 'type': 'raster', 'source': 'radar', 'layout': { 'visibility': visibility }, 'paint': { 'raster-fade-duration': 0 } }, 'Flooded roads');
 
 };
 
@@ -108,8 +108,10 @@ flood_depth_button.addEventListener("click", () => {
   // Toggle staus
   layer_status_flood_depth.classList.toggle(layer_status_class)
   legend_water_depth.classList.toggle(layer_status_class)
-  // Manage layer visibility
-  manage_visibility(layer_status_flood_depth.classList.contains(layer_status_class), 'Inundation Depth')
+  // Manage layer visibility; the layer is added once the flood depth tiles or image are found
+  if (map.getLayer('Inundation Depth')) {
+    manage_visibility(layer_status_flood_depth.classList.contains(layer_status_class), 'Inundation Depth')
+  }
 });
 
 